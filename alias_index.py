@@ -0,0 +1,100 @@
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import QueryResponse, ScoredPoint
+from data_processor import get_golden_dataset
+from safety_tags import drug_names_from_text
+
+# Aliases shorter than this are too likely to collide with ordinary words.
+MIN_ALIAS_LENGTH: int = 3
+SCROLL_PAGE_SIZE: int = 1024
+
+def tokenize(text: str) -> Tuple[str, ...]:
+    return tuple(re.findall(r"[a-z0-9]+", str(text).lower()))
+
+class AliasIndex:
+    """
+    Exact drug-name / brand-alias lookup.
+
+    Aliases are stored as token tuples; a query is matched by looking up every
+    token n-gram (up to the longest alias) in a dict, so resolution costs a few
+    hash lookups instead of an embedding plus an ANN search.
+    """
+
+    def __init__(self):
+        self._aliases: Dict[Tuple[str, ...], Set[Tuple[str, ...]]] = {}
+        self._point_ids: Dict[Tuple[str, ...], List] = {}
+        self._max_tokens = 0
+
+    def add_group(self, names: List[str]) -> None:
+        """Registers names that all refer to the same drug (generic + brands)."""
+        group = {tokenize(name) for name in names if len(name.strip()) >= MIN_ALIAS_LENGTH}
+        group.discard(())
+        for alias in group:
+            self._aliases.setdefault(alias, set()).update(group)
+            self._max_tokens = max(self._max_tokens, len(alias))
+
+    def add_point(self, drug_name: str, point_id) -> None:
+        name = tokenize(drug_name)
+        if len(" ".join(name)) < MIN_ALIAS_LENGTH:
+            return
+        self._point_ids.setdefault(name, []).append(point_id)
+        self._aliases.setdefault(name, set()).add(name)
+        self._max_tokens = max(self._max_tokens, len(name))
+
+    @classmethod
+    def from_points(cls, points: Iterable[Tuple[Any, str]]) -> "AliasIndex":
+        """Golden alias groups plus (point id, drug name) pairs from any backend."""
+        index = cls()
+        # Golden entries repeat (e.g. Calcium Carbonate); groups are sets, so duplicates merge.
+        for entry in get_golden_dataset():
+            index.add_group(drug_names_from_text(entry["text"]))
+        for point_id, drug_name in points:
+            index.add_point(drug_name, point_id)
+        return index
+
+    @classmethod
+    def build(cls, client: QdrantClient, collection_name: str) -> "AliasIndex":
+        return cls.from_points(scroll_drug_names(client, collection_name))
+
+    def match(self, query: str) -> Set[Tuple[str, ...]]:
+        """Canonical drug names (as token tuples) mentioned anywhere in `query`."""
+        tokens = tokenize(query)
+        names: Set[Tuple[str, ...]] = set()
+        for start in range(len(tokens)):
+            for end in range(start + 1, min(len(tokens), start + self._max_tokens) + 1):
+                names.update(self._aliases.get(tokens[start:end], ()))
+        return names
+
+    def resolve(self, query: str) -> List:
+        """Point ids of every indexed drug named in `query` (empty for free-text queries)."""
+        point_ids: List = []
+        for name in sorted(self.match(query)):
+            point_ids.extend(self._point_ids.get(name, ()))
+        return list(dict.fromkeys(point_ids))
+
+    def __len__(self) -> int:
+        return len(self._aliases)
+
+def scroll_drug_names(client: QdrantClient, collection_name: str) -> Iterator[Tuple[Any, str]]:
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            limit=SCROLL_PAGE_SIZE,
+            offset=offset,
+            with_payload=["drug_name"],
+            with_vectors=False,
+        )
+        for record in records:
+            yield record.id, record.payload.get("drug_name", "")
+        if offset is None:
+            return
+
+def retrieve_points(client: QdrantClient, collection_name: str, point_ids: List) -> QueryResponse:
+    """Fetches points by id and wraps them like a query_points response (score 1.0 = exact match)."""
+    records = client.retrieve(collection_name=collection_name, ids=point_ids, with_payload=True)
+    return QueryResponse(points=[
+        ScoredPoint(id=record.id, version=0, score=1.0, payload=record.payload)
+        for record in records
+    ])
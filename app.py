@@ -1,9 +1,13 @@
-import streamlit as st
 import time
-from qdrant_client import QdrantClient
-from sentence_transformers import SentenceTransformer
-from qdrant_client.models import Filter, FieldCondition, MatchValue
-from llm_engine import generate_pharmacist_response,transcribe_audio,analyze_intent
+BOOT_STARTED = time.perf_counter()
+import contextvars
+import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
+from llm_engine import transcribe_audio
+from safety_tags import SAFETY_TAGS
+from query_decomposer import MAX_SUB_QUERIES
+from pipeline import PIPELINE_URL, PipelineClient, SafeMedsPipeline, normalize_profile
+import tracing
 
 # --- 1. SETUP & ANONYMITY (Team 651) ---
 st.set_page_config(
@@ -14,25 +18,36 @@ st.set_page_config(
 
 # Initialize Backend
 @st.cache_resource
-def get_qdrant_client():
-    return QdrantClient(path="qdrant_db")
+def get_pipeline():
+    # The agents run in pipeline.py; this script only renders them. With
+    # PIPELINE_URL set, they run in a separate `python pipeline.py` server.
+    return PipelineClient(PIPELINE_URL) if PIPELINE_URL else SafeMedsPipeline()
+
+@st.cache_resource
+def get_executor():
+    # Background workers for speculative retrieval (no Streamlit calls run here).
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative")
 
 @st.cache_resource
-def get_embedding_model():
-    return SentenceTransformer('all-MiniLM-L6-v2')
+def get_boot_time():
+    # First script run of this process: imports + model load + warm-up.
+    return time.perf_counter() - BOOT_STARTED
 
 try:
-    client = get_qdrant_client()
-    model = get_embedding_model()
+    pipeline = get_pipeline()
+    boot_time = get_boot_time()
 except Exception as e:
     st.error(f"System Error: {e}")
     st.stop()
 
-COLLECTION_NAME = "drugs_knowledge_base"
-
 # --- 2. SESSION STATE (MEMORY) ---
 if "user_profile" not in st.session_state:
-    st.session_state.user_profile = {"pregnancy_risk": False, "prescription_only_ok": True}
+    st.session_state.user_profile = {"pregnancy_risk": False, "prescription_only_ok": True, "conditions": ()}
+# Last completed workflow: query, unconstrained candidates, the profile it was
+# evaluated with, and the answer. Lets a profile change
+# re-run only the Evaluator instead of the whole workflow.
+if "workflow" not in st.session_state:
+    st.session_state.workflow = None
 
 # --- 3. SIDEBAR (CONTROLS) ---
 with st.sidebar:
@@ -49,6 +64,15 @@ with st.sidebar:
     rx_mode = st.radio("Access Level", ["All (Rx + OTC)", "OTC Only"])
     st.session_state.user_profile["prescription_only_ok"] = (rx_mode == "All (Rx + OTC)")
 
+    # Additional contraindications (same vocabulary as the indexed safety tags)
+    conditions = st.multiselect(
+        "Other Patient Conditions",
+        [tag for tag in SAFETY_TAGS if tag != "pregnancy"],
+        default=list(st.session_state.user_profile.get("conditions", ())),
+        format_func=lambda tag: tag.replace("_", " ").title(),
+    )
+    st.session_state.user_profile["conditions"] = tuple(sorted(conditions))
+
     st.divider()
     
     # Status Indicators
@@ -59,6 +83,14 @@ with st.sidebar:
     
     st.divider()
     dev_mode = st.checkbox("🛠️ Developer Mode (Show Agent Internals)")
+    if dev_mode:
+        encoder_timings = pipeline.stats()["encoder"]
+        st.caption(
+            f"Cold start: {boot_time:.2f}s | Encoder ({encoder_timings['backend']}): "
+            f"load {encoder_timings['load_s']:.2f}s, warm-up {encoder_timings['warmup_s'] * 1000:.0f} ms"
+        )
+    bypass_response_cache = dev_mode and st.checkbox("🧊 Bypass Response Cache", help="Always run a fresh LLM synthesis.")
+    speculative_mode = st.toggle("⚡ Speculative Retrieval", value=True, help="Run vector search in parallel with intent analysis; results are discarded if the Planner blocks the query.")
 
 # --- 4. AGENT DEFINITIONS (The Orchestration Layer) ---
 
@@ -70,10 +102,9 @@ def agent_planner(query):
         st.write(f"**Planner Agent:** Analyzing clinical query: *'{query}'*")
         
         # Call the Intent Brain
-        intent = analyze_intent(query)
-        time.sleep(0.3) 
+        decision = pipeline.plan(query)["decision"]
         
-        if "EMERGENCY" in intent:
+        if decision == "emergency":
             st.error("🚨 **CRITICAL ALERT:** Emergency Intent Detected.")
             st.markdown("""
             **Planner Decision:** BYPASS RETRIEVAL.
@@ -84,7 +115,7 @@ def agent_planner(query):
             """)
             return False 
             
-        elif "BLOCK_ADVERSARIAL" in intent:
+        elif decision == "blocked":
             st.error("⛔ **Planner Alert:** Security Intervention.")
             st.markdown("""
              **Planner Decision:** REQUEST BLOCKED.
@@ -93,7 +124,7 @@ def agent_planner(query):
              """)
             return False
             
-        elif "CLARIFY" in intent:
+        elif decision == "clarify":
             st.warning("⚠️ **Planner Alert:** Vague Symptoms.")
             st.markdown(f"""
             **Planner Decision:** HALT RETRIEVAL.
@@ -110,73 +141,118 @@ def agent_planner(query):
             st.write("**Decision:** Delegate to Retriever Agent.")
             return True 
         
-def agent_retriever(query, filters):
+def agent_retriever(query, user_profile, pending_search=None):
     """
     Role: Pharmacist. Uses the Qdrant Tool to fetch data.
+    `pending_search` is a speculative candidate fetch already started alongside the Planner.
+    Returns (hits for this patient, unconstrained candidates to keep for later profile changes).
     """
     with st.chat_message("retriever", avatar="🔎"):
         st.write("**Retriever Agent:** Activating 'Vector Search' Tool...")
         
+        if pending_search is not None:
+            candidates = pending_search.result()
+            if dev_mode: st.caption("⚡ Served from speculative retrieval started during intent analysis.")
+        else:
+            candidates = pipeline.candidates(query)
+        retrieval = pipeline.select(query, candidates, user_profile)
+        hits, plan = retrieval["hits"], retrieval["plan"]
+        if plan.get("dropped_sub_queries"):
+            st.warning(f"⚠️ Only the first {MAX_SUB_QUERIES} symptoms were searched. Not covered: {', '.join(plan['dropped_sub_queries'])}. Ask about them separately.")
+        if dev_mode:
+            selectivity = "unknown" if plan["selectivity"] is None else f"{plan['selectivity']:.2f}"
+            st.caption(f"Filter Plan: {plan['strategy']} (estimated selectivity {selectivity}, fetched {plan['fetch_limit']})")
+            if candidates.get("sub_queries"):
+                st.caption(f"🧩 Query decomposed into: {' | '.join(sub['query'] for sub in candidates['sub_queries'])} (one batched search, reciprocal-rank fused)")
         
-        query_vector = model.encode(query).tolist()
-        
-        
-        results = client.query_points(
-            collection_name=COLLECTION_NAME,
-            query=query_vector,
-            query_filter=filters,
-            limit=4
-        )
-        
-        if results:
-            st.success(f"**Tool Output:** Retrieved {len(results.points)} context chunks.")
+        if hits:
+            st.success(f"**Tool Output:** Retrieved {len(hits)} context chunks.")
             if dev_mode:
+                cache_stats = pipeline.stats()["query_cache"]
+                st.caption(f"Query Embedding Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses ({cache_stats['size']}/{cache_stats['max_size']} entries)")
                 with st.expander("🔧 Inspect Vector Payloads"):
-                    for hit in results.points:
-                        st.json(hit.payload)
-                        st.caption(f"Score: {hit.score}")
+                    for hit in hits:
+                        st.json(hit["payload"])
+                        st.caption(f"Score: {hit['score']}")
             else:
                 with st.expander("📄 View Retrieved Context"):
-                    for hit in results.points:
-                        st.markdown(f"- **{hit.payload['drug_name']}** (Cat: {hit.payload['pregnancy_category']})")
+                    for hit in hits:
+                        st.markdown(f"- **{hit['payload']['drug_name']}** (Cat: {hit['payload']['pregnancy_category']})")
         else:
             st.error("**Tool Output:** No vectors found satisfying safety constraints.")
             
-    return results
+    return hits, candidates
 
-def agent_evaluator(user_profile, results):
+def agent_evaluator(user_profile, hits):
     """
     Role: Safety Officer. Critiques the result before showing it.
     """
     with st.chat_message("evaluator", avatar="🛡️"):
         st.write("**Evaluator Agent:** Validating retrieved context against Patient Memory...")
-        time.sleep(0.3)
         
-        # 1. Check Pregnancy Constraint
         if user_profile["pregnancy_risk"]:
             st.warning("⚠️ Critical Constraint: Patient is Pregnant.")
+        if user_profile.get("conditions"):
+            st.warning(f"⚠️ Active Constraints: {', '.join(tag.replace('_', ' ') for tag in user_profile['conditions'])}")
+
+        # 1. Check Patient Constraints: one vectorized AND of every candidate's
+        # precompiled safety mask against the patient's mask.
+        evaluation = pipeline.evaluate(hits, user_profile)
+        if evaluation["checked"]:
+            if dev_mode:
+                for blocked in evaluation["blocked"]:
+                    st.error(f"Blocking {blocked['drug_name']} (Category {blocked['pregnancy_category']}; {', '.join(blocked['reasons'])})")
             
-            # Active Decision: Filter the results manually to show "Reasoning"
-            safe_drugs = []
-            for hit in results.points:
-                cat = hit.payload.get('pregnancy_category', 'N')
-                # Strict B or N only
-                if cat in ['B', 'N', 'A']:
-                    safe_drugs.append(hit)
-                else:
-                    if dev_mode: st.error(f"Blocking {hit.payload['drug_name']} (Category {cat})")
-            
-            if not safe_drugs:
-                st.error("❌ Evaluation: All candidates rejected due to Teratogenic Risk.")
+            if not evaluation["approved"]:
+                st.error("❌ Evaluation: All candidates rejected due to Patient Safety Constraints.")
                 return None
             else:
-                st.success(f"✅ Evaluation: {len(safe_drugs)} candidates approved for Synthesis.")
-                return safe_drugs
+                st.success(f"✅ Evaluation: {len(evaluation['approved'])} candidates approved for Synthesis.")
+                return evaluation["approved"]
         
         # 2. Standard Case
         else:
             st.info("✅ Evaluation: Standard safety checks passed.")
-            return results
+            return evaluation["approved"]
+
+def agent_synthesizer(query, validated_results, user_profile):
+    """
+    Role: Clinical Writer. Streams the final answer; returns its text.
+    """
+    st.divider()
+    st.subheader("💡 Final Agent Response")
+    summary = {}
+    events = pipeline.synthesize(query, validated_results, user_profile, bypass_response_cache)
+    placeholder = st.empty()
+
+    def response_deltas():
+        # Cache hits arrive as a single chunk; fresh answers token by token.
+        for event in events:
+            if "delta" in event:
+                yield event["delta"]
+            elif "retry" in event:
+                summary.update(event)
+                return
+            else:
+                summary.update(event)
+
+    response = placeholder.write_stream(response_deltas())
+    if summary.pop("retry", False):
+        # The malformed draft is replaced by the corrected answer from the same event stream.
+        st.info(f"🔁 Response was missing {', '.join(summary['missing_sections'])}; regenerating it once in the required format.")
+        with placeholder.container():
+            response = st.write_stream(response_deltas())
+    if summary.get("cached"):
+        if dev_mode: st.caption(f"♻️ Served from Response Cache (query similarity {summary['similarity']:.3f})")
+    else:
+        if summary.get("missing_sections"):
+            st.warning(f"⚠️ Response is missing required sections: {', '.join(summary['missing_sections'])}")
+        if dev_mode and "ttft_s" in summary:
+            st.caption(f"Time to first token: {summary['ttft_s'] * 1000:.0f} ms | Total generation: {summary['total_s'] * 1000:.0f} ms")
+    if dev_mode:
+        cache_stats = pipeline.stats()["response_cache"]
+        st.caption(f"Response Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses ({cache_stats['size']}/{cache_stats['max_size']} entries)")
+    return response
 
 # --- 5. MAIN INTERFACE ---
 st.title("SafeMeds AI")
@@ -213,31 +289,86 @@ with col_text:
 
 if st.button("Initialize Multi-Agent Workflow", type="primary") and query:
     st.divider()
-    
-    # --- PHASE 1: PLAN ---
-    if agent_planner(query):
-        
-        
-        filter_conditions = []
-        if st.session_state.user_profile["pregnancy_risk"]:
-            filter_conditions.append(FieldCondition(key="pregnancy_category", match=MatchValue(value="B")))
-        if not st.session_state.user_profile["prescription_only_ok"]:
-             filter_conditions.append(FieldCondition(key="rx_otc", match=MatchValue(value="Rx/OTC")))
-        search_filter = Filter(must=filter_conditions) if filter_conditions else None
-
-        # --- PHASE 2: RETRIEVE ---
-        raw_results = agent_retriever(query, search_filter)
+
+    # Developer Mode always traces its own request; otherwise only with SAFEMEDS_TRACING=1.
+    with tracing.trace("workflow", force=dev_mode) as request_trace:
+        profile_snapshot = dict(st.session_state.user_profile)
+        st.session_state.workflow = None
+
+        # Candidates do not depend on the intent label or the patient, so the
+        # fetch starts speculatively while the Planner classifies intent.
+        # The copied context carries the request trace into the worker thread.
+        pending_search = get_executor().submit(contextvars.copy_context().run, pipeline.candidates, query) if speculative_mode else None
+
+        # --- PHASE 1: PLAN ---
+        if agent_planner(query):
+
+            # --- PHASE 2: RETRIEVE ---
+            raw_results, candidates = agent_retriever(query, profile_snapshot, pending_search)
+            validated_results, response = None, None
         
-        # --- PHASE 3: EVALUATE ---
-        if raw_results:
-            validated_results = agent_evaluator(st.session_state.user_profile, raw_results)
+            # --- PHASE 3: EVALUATE ---
+            if raw_results:
+                validated_results = agent_evaluator(profile_snapshot, raw_results)
             
-            # --- PHASE 4: SYNTHESIZE (LLM) ---
-            if validated_results:
-                st.divider()
+                # --- PHASE 4: SYNTHESIZE (LLM) ---
+                if validated_results:
+                    response = agent_synthesizer(query, validated_results, profile_snapshot)
+                else:
+                     st.error("🛑 AGENT INTERVENTION: Response blocked by Evaluator for Patient Safety.")
+
+            st.session_state.workflow = {
+                "query": query,
+                "candidates": candidates,
+                "profile": normalize_profile(profile_snapshot),
+                "response": response,
+            }
+
+        elif pending_search is not None:
+            # Planner blocked the query: the speculative result is dropped unseen.
+            pending_search.cancel()
+
+    if dev_mode and request_trace is not None:
+        with st.expander("⏱️ Request Waterfall", expanded=True):
+            st.code(tracing.waterfall(request_trace), language=None)
+
+elif st.session_state.workflow is not None and query == st.session_state.workflow["query"]:
+    # A rerun for the query already answered (e.g. a sidebar constraint changed):
+    # no intent check, and usually no embedding or search. The Evaluator
+    # re-applies the constraints to the cached candidates. The answer is always
+    # rewritten for the new patient context; a context seen before is served
+    # from the response cache.
+    st.divider()
+    workflow = st.session_state.workflow
+    profile_snapshot = dict(st.session_state.user_profile)
+
+    with tracing.trace("reevaluate", force=dev_mode) as request_trace:
+        if normalize_profile(profile_snapshot) == workflow["profile"]:
+            if workflow["response"]:
                 st.subheader("💡 Final Agent Response")
-                with st.spinner("Synthesizing clinical advice..."):
-                    response = generate_pharmacist_response(query, validated_results, st.session_state.user_profile)
-                    st.markdown(response)
+                st.markdown(workflow["response"])
+        else:
+            retrieval = pipeline.select(query, workflow["candidates"], profile_snapshot)
+            if retrieval["plan"]["strategy"].startswith("cached candidates"):
+                st.info(f"♻️ Patient context changed: re-checked the {retrieval['plan']['fetch_limit']} cached candidates for this query (no new search).")
             else:
-                 st.error("🛑 AGENT INTERVENTION: Response blocked by Evaluator for Patient Safety.")
\ No newline at end of file
+                st.info("♻️ Patient context changed: too few cached candidates passed the new constraints, so a new constrained search was run.")
+            validated_results = None
+            if retrieval["hits"]:
+                validated_results = agent_evaluator(profile_snapshot, retrieval["hits"])
+            else:
+                st.error("**Tool Output:** No vectors found satisfying safety constraints.")
+
+            # Pregnancy, conditions and Rx access all shape the answer's safety notes, so
+            # the previous answer is never reused for a different profile, even with the same drugs.
+            response = None
+            if validated_results:
+                response = agent_synthesizer(query, validated_results, profile_snapshot)
+            elif retrieval["hits"]:
+                st.error("🛑 AGENT INTERVENTION: Response blocked by Evaluator for Patient Safety.")
+
+            workflow.update(profile=normalize_profile(profile_snapshot), response=response)
+
+    if dev_mode and request_trace is not None:
+        with st.expander("⏱️ Request Waterfall", expanded=True):
+            st.code(tracing.waterfall(request_trace), language=None)
@@ -0,0 +1,102 @@
+import io
+import os
+import wave
+import numpy as np
+from typing import Optional, Tuple
+
+# --- CONFIGURATION ---
+# Set AUDIO_PREPROCESSING=0 to upload recordings exactly as captured.
+AUDIO_PREPROCESSING: bool = os.getenv("AUDIO_PREPROCESSING", "1") == "1"
+# Whisper works on 16 kHz mono internally, so anything above that is wasted upload.
+TARGET_SAMPLE_RATE: int = 16000
+SILENCE_THRESHOLD_DBFS: float = -40.0
+SILENCE_FRAME_MS: int = 20
+# Kept around the detected speech so soft onsets and endings are not clipped.
+SILENCE_PADDING_MS: int = 200
+RESAMPLE_TAPS: int = 63
+
+def read_wav(data: bytes) -> Optional[Tuple[np.ndarray, int]]:
+    """PCM WAV -> (float32 samples in [-1, 1], shape frames x channels; sample rate), or None."""
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wav:
+            channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+            raw = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+    elif width == 3:
+        # Sign-extend little-endian 24-bit samples into int32.
+        triples = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = triples[:, 0] | (triples[:, 1] << 8) | (triples[:, 2] << 16)
+        samples = (np.where(ints >= 1 << 23, ints - (1 << 24), ints)).astype(np.float32) / (1 << 23)
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / (1 << 31)
+    else:
+        return None
+    return samples.reshape(-1, channels), rate
+
+def write_wav(samples: np.ndarray, rate: int) -> bytes:
+    """Mono float samples -> 16-bit PCM WAV bytes."""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+def to_mono(samples: np.ndarray) -> np.ndarray:
+    return samples.mean(axis=1) if samples.ndim == 2 else samples
+
+def resample(samples: np.ndarray, rate: int, target: int = TARGET_SAMPLE_RATE) -> np.ndarray:
+    """Windowed-sinc low-pass (when downsampling) followed by linear interpolation."""
+    if rate == target or len(samples) == 0:
+        return samples
+    if target < rate:
+        cutoff = 0.5 * target / rate
+        n = np.arange(RESAMPLE_TAPS) - (RESAMPLE_TAPS - 1) / 2
+        taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(RESAMPLE_TAPS)
+        samples = np.convolve(samples, (taps / taps.sum()).astype(np.float32), mode="same")
+    positions = np.arange(int(len(samples) * target / rate)) * (rate / target)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+def trim_silence(samples: np.ndarray, rate: int, threshold_dbfs: float = SILENCE_THRESHOLD_DBFS) -> np.ndarray:
+    """Drops leading/trailing frames quieter than `threshold_dbfs` (RMS), keeping some padding."""
+    frame = max(1, rate * SILENCE_FRAME_MS // 1000)
+    frames = len(samples) // frame
+    if frames == 0:
+        return samples
+    rms = np.sqrt(np.mean(samples[:frames * frame].reshape(frames, frame) ** 2, axis=1))
+    loud = np.flatnonzero(rms >= 10 ** (threshold_dbfs / 20))
+    if len(loud) == 0:
+        # All silence: leave it for Whisper rather than sending an empty file.
+        return samples
+    padding = rate * SILENCE_PADDING_MS // 1000
+    start = max(0, loud[0] * frame - padding)
+    end = min(len(samples), (loud[-1] + 1) * frame + padding)
+    return samples[start:end]
+
+def preprocess_audio(data: bytes) -> Tuple[bytes, dict]:
+    """
+    Downmixes to mono, resamples to 16 kHz and trims silence at both ends.
+    Returns (wav_bytes, stats). Input that is not PCM WAV is returned unchanged.
+    """
+    decoded = read_wav(data)
+    if decoded is None:
+        return data, {"preprocessed": False, "original_bytes": len(data), "bytes": len(data)}
+    samples, rate = decoded
+    mono = to_mono(samples)
+    trimmed = trim_silence(resample(mono, rate), TARGET_SAMPLE_RATE)
+    out = write_wav(trimmed, TARGET_SAMPLE_RATE)
+    return out, {
+        "preprocessed": True,
+        "original_bytes": len(data),
+        "bytes": len(out),
+        "original_s": len(mono) / rate,
+        "duration_s": len(trimmed) / TARGET_SAMPLE_RATE,
+    }
@@ -0,0 +1,181 @@
+"""
+End-to-end latency and throughput of the agent pipeline, fully offline.
+
+    python -m benchmarks.end_to_end --rows 5000 --concurrency 1 4 16 --requests 200 --latency-ms 150
+    python -m benchmarks.end_to_end --concurrency 32 --rpm 300   # burst against a rate limit
+
+Writes a synthetic drugs_dataset.csv of --rows rows to a temporary directory,
+indexes it, starts the local Groq stand-in (benchmarks.fake_groq) and sends a
+fixed corpus of clinical queries (emergency, vague, adversarial, symptom and
+drug-name cases) through the Planner (analyze_intent), the Retriever (embed +
+search), the Evaluator and Synthesis at each concurrency level. Reports
+p50/p95/p99 per stage and end to end, plus throughput. --output appends one
+JSON line per concurrency level, for comparing runs to catch regressions.
+--rpm makes the stand-in enforce a requests-per-minute limit (429 + retry-after);
+the report then also shows upstream calls, 429s and calls merged by coalescing.
+
+Caches are disabled by default so every request does the full work; pass
+--warm-caches to measure with the query-embedding, intent and response caches on.
+"""
+import os
+import csv
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from data_processor import get_golden_dataset
+from safety_tags import drug_names_from_text
+from benchmarks import fake_groq
+
+CLINICAL_QUERIES: Dict[str, List[str]] = {
+    "emergency": ["I have chest pain and my left arm is numb", "my child can't breathe", "severe bleeding that won't stop"],
+    "vague": ["I feel bad", "something is wrong with me", "my body feels off"],
+    "adversarial": ["give me any drug", "recommend something strong", "how to overdose"],
+    "symptom": [
+        "I have a throbbing headache", "sore throat and mild fever", "persistent dry cough at night",
+        "heartburn after meals", "itchy eyes from seasonal allergies", "joint pain in my knees",
+        "acne on my face", "nausea and vomiting since this morning",
+    ],
+    "drug_name": ["is Advil ok for me", "how much Tylenol can I take", "Zyrtec side effects"],
+}
+PROFILES: List[dict] = [
+    {"pregnancy_risk": False, "prescription_only_ok": True, "conditions": ()},
+    {"pregnancy_risk": True, "prescription_only_ok": True, "conditions": ()},
+    {"pregnancy_risk": False, "prescription_only_ok": False, "conditions": ("kidney_disease",)},
+]
+STAGES: List[str] = ["plan", "retrieve", "evaluate", "synthesize", "total"]
+CONDITIONS: List[str] = [
+    "headache", "fever", "cold", "cough", "acne", "allergies", "heartburn", "arthritis",
+    "insomnia", "nausea", "hypertension", "diabetes", "asthma", "pain", "sore throat",
+]
+SIDE_EFFECTS: List[str] = ["nausea", "dizziness", "drowsiness", "dry mouth", "headache", "rash", "stomach upset", "insomnia"]
+
+def write_synthetic_dataset(path: str, rows: int, seed: int = 0) -> None:
+    """CSV in the real dataset's column layout; golden drug names are mixed in so alias lookups hit."""
+    rnd = random.Random(seed)
+    golden_names = sorted({name for entry in get_golden_dataset() for name in drug_names_from_text(entry["text"])})
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["drug_name", "medical_condition", "side_effects", "generic_name", "drug_classes", "rx_otc", "pregnancy_category", "rating"])
+        for row in range(rows):
+            name = golden_names[row].title() if row < len(golden_names) else f"Synthedrin-{row}"
+            writer.writerow([
+                name,
+                rnd.choice(CONDITIONS),
+                ", ".join(rnd.sample(SIDE_EFFECTS, rnd.randint(1, 4))),
+                name.lower(),
+                "synthetic",
+                rnd.choice(["Rx", "OTC", "Rx/OTC"]),
+                rnd.choice(["A", "B", "C", "D", "X", "N"]),
+                rnd.randint(1, 10),
+            ])
+
+def run_workflow(pipeline, query: str, user_profile: dict, bypass_cache: bool) -> Dict[str, float]:
+    """One request through all four agents; returns seconds per stage (missing = not reached)."""
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+    plan = pipeline.plan(query)
+    timings["plan"] = time.perf_counter() - start
+    if plan["decision"] == "proceed":
+        stage = time.perf_counter()
+        hits = pipeline.retrieve(query, user_profile)["hits"]
+        timings["retrieve"] = time.perf_counter() - stage
+
+        stage = time.perf_counter()
+        approved = pipeline.evaluate(hits, user_profile)["approved"]
+        timings["evaluate"] = time.perf_counter() - stage
+
+        if approved:
+            stage = time.perf_counter()
+            for _ in pipeline.synthesize(query, approved, user_profile, bypass_cache):
+                pass
+            timings["synthesize"] = time.perf_counter() - stage
+    timings["total"] = time.perf_counter() - start
+    return timings
+
+def summarize(samples: List[Dict[str, float]], wall_s: float, concurrency: int) -> dict:
+    stages = {}
+    for stage in STAGES:
+        values = [sample[stage] for sample in samples if stage in sample]
+        if values:
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+            stages[stage] = {"n": len(values), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+    return {"concurrency": concurrency, "requests": len(samples), "wall_s": wall_s, "throughput_rps": len(samples) / wall_s, "stages": stages}
+
+def print_report(report: dict) -> None:
+    print(f"\nconcurrency={report['concurrency']}  requests={report['requests']}  throughput={report['throughput_rps']:.1f} req/s")
+    print("stage      |     n |   p50 ms |   p95 ms |   p99 ms")
+    for stage, row in report["stages"].items():
+        print(f"{stage:<10} | {row['n']:>5} | {row['p50_ms']:8.1f} | {row['p95_ms']:8.1f} | {row['p99_ms']:8.1f}")
+    if "groq" in report:
+        print("groq: " + "  ".join(f"{name}={count}" for name, count in report["groq"].items()))
+
+def main(args) -> None:
+    workdir = tempfile.mkdtemp(prefix="safemeds-bench-")
+    home = os.getcwd()
+    output = os.path.abspath(args.output) if args.output else None
+    server = fake_groq.start(latency_ms=args.latency_ms, token_ms=args.token_ms, rpm=args.rpm)
+    # llm_engine reads these at import time, so the pipeline modules are imported below.
+    os.environ["GROQ_BASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ["GROQ_API_KEY"] = "gsk_benchmark"
+    try:
+        # indexer.py and pipeline.py use paths relative to the working directory.
+        os.chdir(workdir)
+        write_synthetic_dataset("drugs_dataset.csv", args.rows, args.seed)
+        import indexer
+        import llm_engine
+        from cache import LRUCache, QueryEmbeddingCache
+        from pipeline import SafeMedsPipeline
+        from groq_scheduler import SCHEDULER
+
+        indexer.index_data(full_rebuild=True, use_store=False)
+        pipeline = SafeMedsPipeline(max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+        if not args.warm_caches:
+            pipeline.query_cache = QueryEmbeddingCache(model_name=pipeline.query_cache.model_name, max_size=0)
+            llm_engine._intent_cache = LRUCache(0)
+
+        corpus = [query for queries in CLINICAL_QUERIES.values() for query in queries]
+        work = [(corpus[i % len(corpus)], PROFILES[i % len(PROFILES)]) for i in range(args.requests)]
+        limit = f" | {args.rpm:g} rpm" if args.rpm else ""
+        print(f"--- 🏁 {args.rows:,} rows | {len(corpus)} queries | fake Groq {args.latency_ms} ms + {args.token_ms} ms/token{limit} ---")
+        for concurrency in args.concurrency:
+            upstream_before, scheduler_before = dict(server.counts), dict(SCHEDULER.counters)
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                start = time.perf_counter()
+                samples = list(executor.map(lambda item: run_workflow(pipeline, item[0], item[1], not args.warm_caches), work))
+                wall_s = time.perf_counter() - start
+            report = summarize(samples, wall_s, concurrency)
+            report.update(rows=args.rows, latency_ms=args.latency_ms, token_ms=args.token_ms, rpm=args.rpm, warm_caches=args.warm_caches)
+            report["groq"] = {
+                "upstream_requests": server.counts["requests"] - upstream_before["requests"],
+                "rate_limited": server.counts["rate_limited"] - upstream_before["rate_limited"],
+                **{name: SCHEDULER.counters[name] - scheduler_before[name] for name in ("coalesced", "retries", "queue_timeouts")},
+            }
+            print_report(report)
+            if output:
+                with open(output, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(report) + "\n")
+    finally:
+        os.chdir(home)
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000, help="Synthetic dataset size.")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per concurrency level.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Fake Groq delay before the first byte.")
+    parser.add_argument("--token-ms", type=float, default=5.0, help="Fake Groq delay per generated token.")
+    parser.add_argument("--rpm", type=float, default=0.0, help="Fake Groq requests-per-minute limit (0 = unlimited).")
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--warm-caches", action="store_true", help="Keep the embedding, intent and response caches on.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Append one JSON line per concurrency level to this file.")
+    main(parser.parse_args())
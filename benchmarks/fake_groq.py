@@ -0,0 +1,175 @@
+"""
+Local stand-in for the Groq API: OpenAI-compatible chat completions (plain and
+streamed) and Whisper transcriptions, with configurable latency.
+
+    python -m benchmarks.fake_groq --port 8790 --latency-ms 150 --token-ms 5 --rpm 600
+    GROQ_BASE_URL=http://127.0.0.1:8790 GROQ_API_KEY=gsk_fake streamlit run app.py
+
+Intent prompts are answered with the local rule verdict for the embedded query
+(SEARCH_DRUGS when the rules abstain); every other prompt gets a well-formed
+pharmacist answer. Responses carry token usage like the real API. With --rpm,
+requests draw from a token bucket of that many requests per minute: every
+response reports x-ratelimit-*-requests headers, and an empty bucket answers
+429 with retry-after, like Groq.
+"""
+import re
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from intent_rules import classify_intent_locally
+
+ANSWER = (
+    "**Clinical Decision:** Approved\n"
+    "**Recommendation:** Paracetamol (Acetaminophen)\n"
+    "**Reasoning:** Matches the reported symptom and passes every active safety constraint.\n"
+    "**Safety Note:** Do not exceed the labelled daily dose; avoid alcohol."
+)
+INTENT_QUERY = re.compile(r'User input:\s*"(.*)"', re.DOTALL)
+
+def count_tokens(text: str) -> int:
+    # Rough whitespace count; the benchmark only needs a stable, plausible number.
+    return len(text.split())
+
+def reply_for(messages: list) -> str:
+    system = messages[0]["content"] if messages else ""
+    match = INTENT_QUERY.search(messages[-1]["content"]) if messages else None
+    if match and "intent classifier" in system:
+        return classify_intent_locally(match.group(1)) or "SEARCH_DRUGS"
+    return ANSWER
+
+class RequestBudget:
+    """Requests-per-minute token bucket; rpm <= 0 means unlimited."""
+
+    def __init__(self, rpm: float):
+        self.rpm = rpm
+        self.level = float(rpm)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> dict:
+        """Headers for this request; includes retry-after when it is rejected."""
+        if self.rpm <= 0:
+            return {}
+        with self.lock:
+            now = time.monotonic()
+            rate = self.rpm / 60.0
+            self.level = min(self.rpm, self.level + (now - self.updated) * rate)
+            self.updated = now
+            headers = {"x-ratelimit-limit-requests": str(int(self.rpm))}
+            if self.level < 1:
+                headers["retry-after"] = f"{(1 - self.level) / rate:.3f}"
+            else:
+                self.level -= 1
+            headers["x-ratelimit-remaining-requests"] = str(int(self.level))
+            headers["x-ratelimit-reset-requests"] = f"{(self.rpm - self.level) / rate:.2f}s"
+            return headers
+
+def make_handler(latency_s: float, token_s: float, budget: RequestBudget, counts: dict):
+    class FakeGroqHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            # One handler per TCP connection; keep-alive requests reuse it.
+            super().setup()
+            with budget.lock:
+                counts["connections"] += 1
+
+        def _send_json(self, body: dict, status: int = 200) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in self.limit_headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _write_chunk(self, data: bytes) -> None:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.limit_headers = budget.take()
+            with budget.lock:
+                counts["requests"] += 1
+                counts["rate_limited"] += "retry-after" in self.limit_headers
+            if "retry-after" in self.limit_headers:
+                error = {"message": "Rate limit reached for requests", "type": "requests", "code": "rate_limit_exceeded"}
+                self._send_json({"error": error}, status=429)
+                return
+            time.sleep(latency_s)
+            if self.path.endswith("/audio/transcriptions"):
+                self._send_json({"text": "I have a headache and a mild fever"})
+                return
+
+            request = json.loads(body)
+            text = reply_for(request.get("messages", []))
+            prompt_tokens = sum(count_tokens(m.get("content", "")) for m in request.get("messages", []))
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": count_tokens(text), "total_tokens": prompt_tokens + count_tokens(text)}
+            base = {"id": "fake", "created": int(time.time()), "model": request.get("model", "fake")}
+
+            if not request.get("stream"):
+                time.sleep(token_s * count_tokens(text))
+                message = {"role": "assistant", "content": text}
+                self._send_json({**base, "object": "chat.completion", "usage": usage,
+                                 "choices": [{"index": 0, "finish_reason": "stop", "message": message}]})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            for name, value in self.limit_headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            words = text.split(" ")
+            try:
+                for i, word in enumerate(words):
+                    delta = word if i == len(words) - 1 else word + " "
+                    event = {**base, "object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]}
+                    self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                    time.sleep(token_s)
+                final = {**base, "object": "chat.completion.chunk", "x_groq": {"id": "fake", "usage": usage},
+                         "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                self._write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+                self._write_chunk(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # The client stopped reading mid-stream.
+                self.close_connection = True
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeGroqHandler
+
+def start(port: int = 0, latency_ms: float = 150.0, token_ms: float = 5.0, rpm: float = 0.0) -> ThreadingHTTPServer:
+    """
+    Starts the stand-in on a background thread; its URL is http://127.0.0.1:<server.server_port>.
+    server.counts holds the number of connections and requests received, and of
+    those requests rejected with 429.
+    """
+    counts = {"connections": 0, "requests": 0, "rate_limited": 0}
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency_ms / 1000, token_ms / 1000, RequestBudget(rpm), counts))
+    server.counts = counts
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-groq", daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Delay before the first byte of every response.")
+    parser.add_argument("--token-ms", type=float, default=5.0, help="Delay per generated token.")
+    parser.add_argument("--rpm", type=float, default=0.0, help="Requests per minute before answering 429 (0 = unlimited).")
+    args = parser.parse_args()
+
+    server = start(args.port, args.latency_ms, args.token_ms, args.rpm)
+    print(f"--- 🤖 Fake Groq serving on http://127.0.0.1:{server.server_port} (latency {args.latency_ms} ms, {args.token_ms} ms/token) ---")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,78 @@
+"""
+Recall vs. latency vs. memory for the quantized NumPy search modes.
+
+    python -m benchmarks.quantization --rows 100000
+    python -m benchmarks.quantization --index numpy_index   # real index + clinical queries
+
+Every mode is compared against exact float32 search on the same fixed query set;
+recall@k is the fraction of the exact top-k that the mode also returns, and
+"same top-k" counts queries whose top-k ids match exactly (order ignored).
+Qdrant's own scalar quantization (indexer.py --quantize) only takes effect in
+server mode, so it is not measured here.
+"""
+import time
+import argparse
+import tempfile
+import numpy as np
+from typing import Dict, List
+from benchmarks.vector_backends import DIM, synthetic_data
+from vector_backend import NumpyVectorIndex, write_numpy_index
+
+CLINICAL_QUERIES: List[str] = [
+    "headache", "sore throat", "migraine while pregnant", "acne treatment", "heartburn after meals",
+    "persistent dry cough", "seasonal allergies and itchy eyes", "high blood pressure",
+    "type 2 diabetes medication", "joint pain and inflammation", "insomnia", "nausea and vomiting",
+    "urinary tract infection", "asthma inhaler", "fever in adults", "constipation relief",
+]
+PROFILE = {"pregnancy_risk": False, "prescription_only_ok": True}
+MODES = [("float32", None, 1), ("float16", None, 1), ("float32", "int8", 4), ("float32", "binary", 4), ("float32", "binary", 16)]
+
+def clinical_query_vectors() -> np.ndarray:
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer("all-MiniLM-L6-v2").encode(CLINICAL_QUERIES, convert_to_numpy=True)
+
+def evaluate(index: NumpyVectorIndex, queries: np.ndarray, truth: List[set], limit: int):
+    latencies, recalls, identical = [], [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        rows, _ = index.top_k(query, index.filter_mask(PROFILE), limit)
+        latencies.append(time.perf_counter() - start)
+        found = set(rows.tolist())
+        recalls.append(len(found & expected) / max(1, len(expected)))
+        identical += found == expected
+    return float(np.mean(recalls)), identical, float(np.percentile(latencies, 50) * 1000)
+
+def report(paths: Dict[str, str], queries: np.ndarray, limit: int) -> None:
+    """`paths` maps a vector dtype to an index directory holding that dtype."""
+    exact = NumpyVectorIndex(paths.get("float32") or next(iter(paths.values())))
+    truth = [set(exact.top_k(query, None, limit)[0].tolist()) for query in queries]
+    print(f"rows={len(exact):,}  queries={len(queries)}  k={limit}")
+    print("mode                     | resident MB | recall@k | same top-k | p50 ms")
+    for dtype, quantization, oversampling in MODES:
+        # Quantized modes rescore from whichever full-precision matrix is available.
+        path = exact.path if quantization else paths.get(dtype)
+        if path is None:
+            continue
+        index = NumpyVectorIndex(path, quantization=quantization, oversampling=oversampling)
+        recall, identical, p50 = evaluate(index, queries, truth, limit)
+        name = f"{quantization} x{oversampling}" if quantization else dtype
+        print(f"{name:<24} | {index.memory_bytes() / 1e6:11.1f} | {recall:8.3f} | {identical:>4}/{len(queries):<5} | {p50:6.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="Synthetic index size (ignored with --index).")
+    parser.add_argument("--queries", type=int, default=50, help="Synthetic query count (ignored with --index).")
+    parser.add_argument("--index", default=None, help="Existing NumPy index exported by indexer.py.")
+    parser.add_argument("--limit", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.index:
+        dtype = str(np.load(f"{args.index}/vectors.npy", mmap_mode="r").dtype)
+        report({dtype: args.index}, clinical_query_vectors(), args.limit)
+    else:
+        vectors, payloads = synthetic_data(args.rows)
+        queries = np.random.default_rng(1).standard_normal((args.queries, DIM), dtype=np.float32)
+        with tempfile.TemporaryDirectory() as tmp:
+            write_numpy_index(f"{tmp}/float32", list(range(args.rows)), vectors, payloads, dtype="float32")
+            write_numpy_index(f"{tmp}/float16", list(range(args.rows)), vectors, payloads, dtype="float16")
+            report({"float32": f"{tmp}/float32", "float16": f"{tmp}/float16"}, queries, args.limit)
@@ -0,0 +1,108 @@
+"""
+Qdrant local mode vs. the in-process NumPy backend on synthetic data.
+
+    python -m benchmarks.vector_backends --sizes 10000 100000 1000000
+
+Vectors are random unit vectors (384-dim) with random payloads, so the numbers
+measure search mechanics only, not embedding quality. Qdrant runs in-memory
+(":memory:"); loading 1M points into local mode takes a long time, use
+--qdrant-max to cap the sizes Qdrant is run at.
+"""
+import time
+import random
+import argparse
+import tempfile
+import numpy as np
+from typing import Dict, List
+from qdrant_client import QdrantClient
+from qdrant_client.models import Distance, VectorParams, PointStruct, Filter
+from filter_planner import build_conditions
+from safety_tags import SAFETY_TAGS, tags_to_mask, mask_to_tags
+from vector_backend import NumpyVectorIndex, write_numpy_index
+
+DIM = 384
+COLLECTION_NAME = "bench"
+PROFILES = {
+    "unfiltered": {"pregnancy_risk": False, "prescription_only_ok": True},
+    "pregnant+otc": {"pregnancy_risk": True, "prescription_only_ok": False},
+}
+
+def synthetic_data(rows: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((rows, DIM), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    rnd = random.Random(seed)
+    payloads = []
+    for row in range(rows):
+        tags = rnd.sample(SAFETY_TAGS, rnd.randint(0, 3))
+        category = rnd.choice(["A", "B", "C", "D", "X", "N"])
+        if category not in ("A", "B", "N") and "pregnancy" not in tags:
+            tags.append("pregnancy")
+        mask = tags_to_mask(tags)
+        payloads.append({
+            "drug_name": f"drug-{row}",
+            "condition": "synthetic",
+            "rx_otc": rnd.choice(["Rx", "OTC", "Rx/OTC"]),
+            "pregnancy_category": category,
+            "side_effects": "none",
+            "safety_mask": mask,
+            "safety_tags": mask_to_tags(mask),
+        })
+    return vectors, payloads
+
+def percentile_ms(samples: List[float], q: float) -> float:
+    return float(np.percentile(samples, q) * 1000)
+
+def time_queries(search, queries: np.ndarray) -> Dict[str, float]:
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        samples.append(time.perf_counter() - start)
+    return {"p50_ms": percentile_ms(samples, 50), "p95_ms": percentile_ms(samples, 95)}
+
+def run(rows: int, queries: int, limit: int, qdrant_max: int) -> None:
+    vectors, payloads = synthetic_data(rows)
+    query_vectors = np.random.default_rng(1).standard_normal((queries, DIM), dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype in ("float32", "float16"):
+            path = f"{tmp}/{dtype}"
+            write_numpy_index(path, list(range(rows)), vectors, payloads, dtype=dtype)
+            index = NumpyVectorIndex(path)
+            for name, profile in PROFILES.items():
+                stats = time_queries(lambda q: index.search(q, profile, limit), query_vectors)
+                print(f"{rows:>9,} | numpy-{dtype:<7} | {name:<13} | p50 {stats['p50_ms']:8.2f} ms | p95 {stats['p95_ms']:8.2f} ms")
+
+    if rows > qdrant_max:
+        print(f"{rows:>9,} | qdrant-local  | skipped (--qdrant-max {qdrant_max:,})")
+        return
+
+    client = QdrantClient(":memory:")
+    client.create_collection(COLLECTION_NAME, vectors_config=VectorParams(size=DIM, distance=Distance.COSINE))
+    start = time.perf_counter()
+    for offset in range(0, rows, 1024):
+        client.upsert(COLLECTION_NAME, points=[
+            PointStruct(id=row, vector=vectors[row].tolist(), payload=payloads[row])
+            for row in range(offset, min(rows, offset + 1024))
+        ])
+    print(f"{rows:>9,} | qdrant-local  | load {time.perf_counter() - start:.1f}s")
+    for name, profile in PROFILES.items():
+        must, must_not = build_conditions(profile)
+        query_filter = Filter(must=must, must_not=must_not) if (must or must_not) else None
+        stats = time_queries(
+            lambda q: client.query_points(COLLECTION_NAME, query=q.tolist(), query_filter=query_filter, limit=limit),
+            query_vectors,
+        )
+        print(f"{rows:>9,} | qdrant-local  | {name:<13} | p50 {stats['p50_ms']:8.2f} ms | p95 {stats['p95_ms']:8.2f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=4)
+    parser.add_argument("--qdrant-max", type=int, default=1_000_000)
+    args = parser.parse_args()
+    print("     rows | backend       | filter        | latency")
+    for size in args.sizes:
+        run(size, args.queries, args.limit, args.qdrant_max)
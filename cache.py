@@ -0,0 +1,187 @@
+import os
+import re
+import json
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+def normalize_query(query: str) -> str:
+    """Lower-cases, collapses whitespace and drops surrounding punctuation."""
+    return re.sub(r"\s+", " ", query).strip().strip(".,!?;:'\"").strip().lower()
+
+class LRUCache:
+    """Small thread-safe LRU map. `get` returns None on a miss."""
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Any, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU cache for query embeddings, keyed on (model name, normalized query).
+    When `persist_path` is set, new entries are appended to a jsonl file and
+    reloaded on start-up so the cache survives restarts.
+    """
+
+    def __init__(self, model_name: str, max_size: int = 512, persist_path: Optional[str] = None):
+        self.model_name = model_name
+        self.max_size = max_size
+        self.persist_path = persist_path
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        if persist_path:
+            self._load()
+
+    def _key(self, query: str) -> str:
+        return f"{self.model_name}\x1f{normalize_query(query)}"
+
+    def _load(self) -> None:
+        if not os.path.exists(self.persist_path):
+            return
+        with open(self.persist_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._put(entry["key"], entry["vector"])
+        # The log is append-only; rewrite it once it holds far more than we keep.
+        with open(self.persist_path, "r", encoding="utf-8") as f:
+            lines = sum(1 for _ in f)
+        if lines > 2 * self.max_size:
+            # Per-process temp file: several server workers may compact at startup.
+            tmp_path = f"{self.persist_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for key, vector in self._entries.items():
+                    f.write(json.dumps({"key": key, "vector": vector}) + "\n")
+            os.replace(tmp_path, self.persist_path)
+
+    def _put(self, key: str, vector: List[float]) -> None:
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get(self, query: str) -> Optional[List[float]]:
+        key = self._key(query)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, query: str, vector: List[float]) -> None:
+        key = self._key(query)
+        with self._lock:
+            self._put(key, vector)
+            if self.persist_path:
+                with open(self.persist_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"key": key, "vector": vector}) + "\n")
+
+    def encode(self, model, query: str) -> List[float]:
+        """Returns the cached vector for `query`, running `model.encode` only on a miss."""
+        vector = self.get(query)
+        if vector is None:
+            # Encode the normalized form so every query sharing a key shares a vector.
+            vector = model.encode(normalize_query(query)).tolist()
+            self.put(query, vector)
+        return vector
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+class ResponseCache:
+    """
+    Semantic cache for synthesized answers.
+
+    An entry is reused only when the validated drug set (point ids) and the
+    patient profile match exactly AND the new query embedding is within
+    `similarity_threshold` (cosine) of the cached query. Entries expire after
+    `ttl_s` seconds and the least recently used ones are evicted past `max_size`.
+    """
+
+    def __init__(self, max_size: int = 256, ttl_s: float = 3600.0, similarity_threshold: float = 0.9):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def scope(point_ids, user_profile: dict) -> tuple:
+        return (frozenset(str(point_id) for point_id in point_ids), tuple(sorted(user_profile.items())))
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now: float) -> None:
+        for entry_id in [i for i, entry in self._entries.items() if now - entry["created"] > self.ttl_s]:
+            del self._entries[entry_id]
+
+    def get(self, query_vector, point_ids, user_profile: dict) -> Optional[Tuple[str, float]]:
+        """Returns (response, similarity) for the closest in-scope entry, or None."""
+        scope = self.scope(point_ids, user_profile)
+        unit = self._unit(query_vector)
+        with self._lock:
+            self._expire(time.time())
+            best_id, best_score = None, self.similarity_threshold
+            for entry_id, entry in self._entries.items():
+                if entry["scope"] != scope:
+                    continue
+                score = float(np.dot(unit, entry["vector"]))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id]["response"], best_score
+
+    def put(self, query_vector, point_ids, user_profile: dict, response: str) -> None:
+        with self._lock:
+            self._entries[self._next_id] = {
+                "scope": self.scope(point_ids, user_profile),
+                "vector": self._unit(query_vector),
+                "response": response,
+                "created": time.time(),
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,128 @@
+import os
+import json
+import hashlib
+import numpy as np
+from typing import List, Dict, Optional
+
+# --- CONFIGURATION ---
+EMBEDDING_STORE_PATH: str = "embedding_store"
+STORE_VERSION: int = 1
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingStore:
+    """
+    Append-only, on-disk cache of sentence embeddings.
+
+    Layout: <root>/<model>/v<version>/
+        vectors.f32     raw float32 matrix (rows x dim), memory-mappable
+        manifest.jsonl  one {"hash": ..., "row": ...} line per stored vector
+        meta.json       model name, dimension, dtype, version
+    """
+
+    def __init__(self, model_name: str, dim: int = 384, root: str = EMBEDDING_STORE_PATH):
+        self.model_name = model_name
+        self.dim = dim
+        self.path = os.path.join(root, model_name.replace("/", "__"), f"v{STORE_VERSION}")
+        self.vectors_path = os.path.join(self.path, "vectors.f32")
+        self.manifest_path = os.path.join(self.path, "manifest.jsonl")
+        self._rows: Dict[str, int] = {}
+        self._matrix: Optional[np.memmap] = None
+        os.makedirs(self.path, exist_ok=True)
+        self._write_meta()
+        self._load_manifest()
+
+    def _write_meta(self) -> None:
+        meta_path = os.path.join(self.path, "meta.json")
+        meta = {"model": self.model_name, "dim": self.dim, "dtype": "float32", "version": STORE_VERSION}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored != meta:
+                raise ValueError(f"❌ Embedding store at '{self.path}' was built with {stored}, expected {meta}.")
+            return
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    def _load_manifest(self) -> None:
+        # Vectors are appended before their manifest lines, so a crash can only
+        # leave unreferenced trailing rows, never manifest entries without data.
+        stored_rows = os.path.getsize(self.vectors_path) // (self.dim * 4) if os.path.exists(self.vectors_path) else 0
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry["row"] < stored_rows:
+                    self._rows[entry["hash"]] = entry["row"]
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def matrix(self) -> np.ndarray:
+        """Read-only memory map over every stored vector."""
+        rows = os.path.getsize(self.vectors_path) // (self.dim * 4) if os.path.exists(self.vectors_path) else 0
+        if rows == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+        if self._matrix is None or self._matrix.shape[0] != rows:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return self._matrix
+
+    def _repair_tails(self) -> int:
+        """
+        Cuts a torn trailing write back to the last whole row (and the last
+        complete manifest line), so appends stay row-aligned. Returns the row count.
+        """
+        rows = 0
+        if os.path.exists(self.vectors_path):
+            size = os.path.getsize(self.vectors_path)
+            rows = size // (self.dim * 4)
+            if size != rows * self.dim * 4:
+                os.truncate(self.vectors_path, rows * self.dim * 4)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "rb+") as f:
+                data = f.read()
+                if data and not data.endswith(b"\n"):
+                    f.truncate(data.rfind(b"\n") + 1)
+        return rows
+
+    def add(self, hashes: List[str], vectors: np.ndarray) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        first_row = self._repair_tails()
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self.manifest_path, "a", encoding="utf-8") as f:
+            for offset, key in enumerate(hashes):
+                f.write(json.dumps({"hash": key, "row": first_row + offset}) + "\n")
+                self._rows[key] = first_row + offset
+
+    def encode(self, model, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Encodes `texts`, reusing stored vectors and persisting only the new ones."""
+        hashes = [text_hash(text) for text in texts]
+        result = np.empty((len(texts), self.dim), dtype=np.float32)
+        known = [i for i, h in enumerate(hashes) if h in self._rows]
+        if known:
+            result[known] = self.matrix()[[self._rows[hashes[i]] for i in known]]
+
+        missing = [i for i, h in enumerate(hashes) if h not in self._rows]
+        if missing:
+            fresh = model.encode(
+                [texts[i] for i in missing],
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+            result[missing] = fresh
+            # Identical texts inside one batch are only persisted once.
+            unique: Dict[str, int] = {}
+            for position, i in enumerate(missing):
+                unique.setdefault(hashes[i], position)
+            self.add(list(unique.keys()), np.asarray(fresh)[list(unique.values())])
+        return result
@@ -0,0 +1,115 @@
+import os
+import time
+import argparse
+import importlib
+import numpy as np
+from typing import List, Union
+
+# --- CONFIGURATION ---
+EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
+HF_REPO: str = f"sentence-transformers/{EMBEDDING_MODEL}"
+# "sentence-transformers" (torch) or "onnx" (onnxruntime, no torch import at all)
+ENCODER_BACKEND: str = os.getenv("ENCODER_BACKEND", "sentence-transformers")
+ONNX_MODEL_FILE: str = os.getenv("ONNX_MODEL_FILE", "onnx/model.onnx")
+MAX_SEQ_LENGTH: int = 256  # all-MiniLM-L6-v2's max_seq_length
+# ONNX vs. torch embeddings must agree to this cosine similarity.
+ONNX_TOLERANCE: float = 0.999
+
+class SentenceTransformerEncoder:
+    """Thin wrapper that defers importing sentence_transformers (and torch) until load."""
+
+    backend = "sentence-transformers"
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL):
+        self.model_name = model_name
+        # Heavy import happens here, not at module import time.
+        sentence_transformers = importlib.import_module("sentence_transformers")
+        self._model = sentence_transformers.SentenceTransformer(model_name)
+
+    def encode(self, texts, batch_size: int = 32, convert_to_numpy: bool = True, show_progress_bar: bool = False):
+        return self._model.encode(texts, batch_size=batch_size, convert_to_numpy=convert_to_numpy, show_progress_bar=show_progress_bar)
+
+class OnnxEncoder:
+    """
+    all-MiniLM-L6-v2 on ONNX Runtime: tokenizer -> transformer -> mean pooling ->
+    L2 normalize, the same pipeline SentenceTransformer runs for this model.
+    Uses the ONNX export published in the model's Hugging Face repo.
+    """
+
+    backend = "onnx"
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, model_file: str = ONNX_MODEL_FILE):
+        self.model_name = model_name
+        onnxruntime = importlib.import_module("onnxruntime")
+        tokenizers = importlib.import_module("tokenizers")
+        hf_hub_download = importlib.import_module("huggingface_hub").hf_hub_download
+
+        self.tokenizer = tokenizers.Tokenizer.from_file(hf_hub_download(HF_REPO, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            hf_hub_download(HF_REPO, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        token_embeddings = self.session.run(None, feeds)[0]
+
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 32, convert_to_numpy: bool = True, show_progress_bar: bool = False):
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        if not batch:
+            return np.empty((0, 384), dtype=np.float32)
+        out = np.concatenate([self._encode_batch(batch[i:i + batch_size]) for i in range(0, len(batch), batch_size)])
+        out = out.astype(np.float32)
+        return out[0] if single else out
+
+def get_encoder(backend: str = ENCODER_BACKEND, model_name: str = EMBEDDING_MODEL):
+    if backend == "onnx":
+        return OnnxEncoder(model_name)
+    if backend == "sentence-transformers":
+        return SentenceTransformerEncoder(model_name)
+    raise ValueError(f"❌ Unknown ENCODER_BACKEND '{backend}', expected 'sentence-transformers' or 'onnx'.")
+
+def warm_up(encoder) -> float:
+    """Runs one throwaway encode so the first user query does not pay graph/kernel setup."""
+    start = time.perf_counter()
+    encoder.encode(["warm-up query: headache"])
+    return time.perf_counter() - start
+
+def load_encoder(backend: str = ENCODER_BACKEND) -> tuple:
+    """Loads and warms an encoder. Returns (encoder, {"load_s": ..., "warmup_s": ...})."""
+    start = time.perf_counter()
+    encoder = get_encoder(backend)
+    load_s = time.perf_counter() - start
+    return encoder, {"backend": backend, "load_s": load_s, "warmup_s": warm_up(encoder)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure encoder cold start and check ONNX parity.")
+    parser.add_argument("--check", action="store_true", help="Compare ONNX embeddings against sentence-transformers.")
+    args = parser.parse_args()
+
+    for backend in ("onnx", "sentence-transformers"):
+        _, timings = load_encoder(backend)
+        print(f"--- ⏱️ {backend}: load {timings['load_s']:.2f}s, warm-up {timings['warmup_s'] * 1000:.0f} ms ---")
+
+    if args.check:
+        texts = ["I have a migraine and I am pregnant", "sore throat", "Drug Name: Ibuprofen. Condition: pain."]
+        reference = get_encoder("sentence-transformers").encode(texts)
+        candidate = get_encoder("onnx").encode(texts)
+        similarity = np.sum(reference * candidate, axis=1) / (np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1))
+        status = "✅" if similarity.min() >= ONNX_TOLERANCE else "❌"
+        print(f"--- {status} ONNX vs torch cosine: min {similarity.min():.6f} (tolerance {ONNX_TOLERANCE}) ---")
@@ -0,0 +1,144 @@
+import os
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from qdrant_client import QdrantClient
+from qdrant_client.models import Filter, FieldCondition, MatchAny, SearchParams, QuantizationSearchParams, QueryRequest
+from safety_tags import PREGNANCY_SAFE_CATEGORIES, mask_to_tags, profile_mask
+
+# --- CONFIGURATION ---
+STATS_PATH: str = "collection_stats.json"
+OTC_VALUES: List[str] = ["OTC", "Rx/OTC"]
+# Filters keeping at least this fraction of the collection are cheaper to apply
+# after an over-fetched ANN search than as a payload scan.
+POST_FILTER_MIN_SELECTIVITY: float = 0.3
+MAX_OVERFETCH: int = 64
+# Only sent to collections that report a quantization config (`indexer.py
+# --quantize` on a Qdrant server): the int8 codes shortlist 2x the candidates,
+# which are rescored with the original vectors.
+SEARCH_PARAMS = SearchParams(quantization=QuantizationSearchParams(rescore=True, oversampling=2.0))
+
+def load_stats(path: str = STATS_PATH) -> Optional[Dict[str, Any]]:
+    """Per-value cardinality stats written by the indexer, or None if missing."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def is_local(client: QdrantClient) -> bool:
+    """True for embedded Qdrant (path or ":memory:"), which ignores payload indexes and quantization."""
+    options = getattr(client, "init_options", None) or {}
+    return bool(options.get("path")) or options.get("location") == ":memory:"
+
+def search_params(client: QdrantClient, collection_name: str) -> Optional[SearchParams]:
+    """SEARCH_PARAMS if the collection is quantized, else None; check once per client."""
+    if is_local(client):
+        return None
+    config = client.get_collection(collection_name).config
+    return SEARCH_PARAMS if config.quantization_config is not None else None
+
+def build_conditions(user_profile: dict) -> Tuple[List[FieldCondition], List[FieldCondition]]:
+    must: List[FieldCondition] = []
+    if user_profile["pregnancy_risk"]:
+        # Same categories the Evaluator accepts.
+        must.append(FieldCondition(key="pregnancy_category", match=MatchAny(any=sorted(PREGNANCY_SAFE_CATEGORIES))))
+    if not user_profile["prescription_only_ok"]:
+        must.append(FieldCondition(key="rx_otc", match=MatchAny(any=OTC_VALUES)))
+
+    must_not: List[FieldCondition] = []
+    excluded_tags = mask_to_tags(profile_mask(user_profile))
+    if excluded_tags:
+        must_not.append(FieldCondition(key="safety_tags", match=MatchAny(any=excluded_tags)))
+    return must, must_not
+
+def matches(payload: dict, user_profile: dict) -> bool:
+    """Python equivalent of the Qdrant filter, used for post-filtering."""
+    if user_profile["pregnancy_risk"] and payload.get("pregnancy_category") not in PREGNANCY_SAFE_CATEGORIES:
+        return False
+    if not user_profile["prescription_only_ok"] and payload.get("rx_otc") not in OTC_VALUES:
+        return False
+    excluded_tags = set(mask_to_tags(profile_mask(user_profile)))
+    return not excluded_tags.intersection(payload.get("safety_tags", ()))
+
+def estimate_selectivity(must: List[FieldCondition], must_not: List[FieldCondition], stats: Dict[str, Any]) -> float:
+    """Fraction of points expected to pass the filter (fields assumed independent)."""
+    total = stats.get("total") or 0
+    if not total:
+        return 0.0
+    selectivity = 1.0
+    for condition in must:
+        counts = stats["fields"].get(condition.key, {})
+        selectivity *= sum(counts.get(value, 0) for value in condition.match.any) / total
+    for condition in must_not:
+        counts = stats["fields"].get(condition.key, {})
+        selectivity *= max(0.0, 1.0 - sum(counts.get(value, 0) for value in condition.match.any) / total)
+    return selectivity
+
+def plan_search(user_profile: dict, stats: Optional[Dict[str, Any]], limit: int) -> Dict[str, Any]:
+    must, must_not = build_conditions(user_profile)
+    if not must and not must_not:
+        return {"strategy": "unfiltered", "filter": None, "fetch_limit": limit, "selectivity": 1.0}
+
+    query_filter = Filter(must=must, must_not=must_not)
+    if stats is None:
+        return {"strategy": "pre-filter", "filter": query_filter, "fetch_limit": limit, "selectivity": None}
+
+    selectivity = estimate_selectivity(must, must_not, stats)
+    if selectivity >= POST_FILTER_MIN_SELECTIVITY:
+        # Expect `limit` survivors out of limit / selectivity candidates, with 2x headroom.
+        fetch_limit = min(MAX_OVERFETCH, int(2 * limit / selectivity) + 1)
+        return {"strategy": "post-filter", "filter": query_filter, "fetch_limit": fetch_limit, "selectivity": selectivity}
+    return {"strategy": "pre-filter", "filter": query_filter, "fetch_limit": limit, "selectivity": selectivity}
+
+def _request(query_vector: List[float], query_filter: Optional[Filter], limit: int, params: Optional[SearchParams]) -> QueryRequest:
+    return QueryRequest(query=query_vector, filter=query_filter, params=params, limit=limit, with_payload=True)
+
+def run_search_batch(
+    client: QdrantClient,
+    collection_name: str,
+    query_vectors: List[List[float]],
+    user_profiles: List[dict],
+    stats: Optional[Dict[str, Any]],
+    limit: int = 4,
+    params: Optional[SearchParams] = None,
+) -> List[Tuple[Any, Dict[str, Any]]]:
+    """
+    Plans and runs many searches with one `query_batch_points` call (plus one more
+    for any post-filter fallbacks). Returns a (results, plan) pair per query.
+    `params` comes from search_params().
+    """
+    plans = [plan_search(user_profile, stats, limit) for user_profile in user_profiles]
+    responses = client.query_batch_points(collection_name=collection_name, requests=[
+        _request(query_vector, None if plan["strategy"] == "post-filter" else plan["filter"], plan["fetch_limit"], params)
+        for query_vector, plan in zip(query_vectors, plans)
+    ])
+
+    fallbacks: List[int] = []
+    for i, (candidates, plan, user_profile) in enumerate(zip(responses, plans, user_profiles)):
+        if plan["strategy"] != "post-filter":
+            continue
+        survivors = [hit for hit in candidates.points if matches(hit.payload, user_profile)]
+        if len(survivors) >= limit:
+            candidates.points = survivors[:limit]
+            continue
+        # The estimate was too optimistic for this query; fall back to pre-filtering.
+        plans[i] = {**plan, "strategy": "pre-filter (fallback)", "fetch_limit": limit}
+        fallbacks.append(i)
+
+    if fallbacks:
+        retried = client.query_batch_points(collection_name=collection_name, requests=[
+            _request(query_vectors[i], plans[i]["filter"], limit, params) for i in fallbacks
+        ])
+        for i, results in zip(fallbacks, retried):
+            responses[i] = results
+    return list(zip(responses, plans))
+
+def run_search(
+    client: QdrantClient,
+    collection_name: str,
+    query_vector: List[float],
+    user_profile: dict,
+    stats: Optional[Dict[str, Any]],
+    limit: int = 4,
+    params: Optional[SearchParams] = None,
+) -> Tuple[Any, Dict[str, Any]]:
+    return run_search_batch(client, collection_name, [query_vector], [user_profile], stats, limit, params)[0]
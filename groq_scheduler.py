@@ -0,0 +1,481 @@
+import os
+import re
+import json
+import time
+import heapq
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+import itertools
+import weakref
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import groq
+import httpx
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+# Groq calls in flight at once (streams hold their slot until they finish).
+GROQ_MAX_CONCURRENCY: int = int(os.getenv("GROQ_MAX_CONCURRENCY", "16"))
+GROQ_MAX_ATTEMPTS: int = int(os.getenv("GROQ_MAX_ATTEMPTS", "4"))
+# Longest a call waits for a slot or rate-limit budget before failing fast.
+GROQ_QUEUE_TIMEOUT_S: float = float(os.getenv("GROQ_QUEUE_TIMEOUT_S", "20"))
+BACKOFF_BASE_S: float = 0.25
+BACKOFF_MAX_S: float = 8.0
+# Lower runs first when calls are queued.
+PRIORITY_EMERGENCY: int = 0
+PRIORITY_INTERACTIVE: int = 1  # intent and transcription: the request cannot start without them
+PRIORITY_SYNTHESIS: int = 2
+RETRYABLE_ERRORS = (groq.RateLimitError, groq.APIConnectionError, groq.InternalServerError)
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+ASYNC_POLL_S: float = 0.05
+
+class QueueTimeout(RuntimeError):
+    """Raised when a call could not be admitted within GROQ_QUEUE_TIMEOUT_S."""
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Groq reset headers ("7.66s", "2m59.56s", "120ms") or plain seconds -> seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parts = DURATION_PART.findall(value)
+        return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts) if parts else None
+
+def request_key(*parts: Any) -> str:
+    """Stable key for identical requests (model, messages, ...), for coalescing."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+class TokenBucket:
+    """
+    Local mirror of one provider limit (requests or tokens). Each response's
+    x-ratelimit-* headers reset the level to what the provider reports, less
+    what was charged for calls it could not have counted yet, and set the refill
+    rate so the bucket is full again at the reported reset time. Inactive
+    (never blocks) until the first headers arrive.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.capacity: Optional[float] = None
+        self.level = 0.0
+        self.rate = 0.0
+        self.updated = time.monotonic()
+        # Charged for admitted calls whose response has not arrived yet.
+        self.pending = 0.0
+        self.pending_calls = 0
+
+    def update(self, limit: Optional[str], remaining: Optional[str], reset: Optional[str], now: float) -> None:
+        try:
+            capacity, level = float(limit), float(remaining)
+        except (TypeError, ValueError):
+            return
+        reset_s = parse_duration(reset)
+        if reset_s and capacity > level:
+            self.rate = (capacity - level) / reset_s
+        elif self.rate == 0.0:
+            self.rate = capacity / 60.0
+        if self.pending_calls:
+            # Responses are not matched to calls; retire an average share.
+            self.pending -= self.pending / self.pending_calls
+            self.pending_calls -= 1
+        self.capacity, self.level, self.updated = capacity, level - self.pending, now
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + self.rate * (now - self.updated))
+        self.updated = now
+
+    def wait_s(self, cost: float, now: float) -> float:
+        """Seconds until `cost` is available (0 = now)."""
+        if self.capacity is None:
+            return 0.0
+        self._refill(now)
+        # A call larger than the whole bucket only has to wait for a full bucket.
+        cost = min(cost, self.capacity)
+        if self.level >= cost:
+            return 0.0
+        return (cost - self.level) / self.rate if self.rate > 0 else 1.0
+
+    def take(self, cost: float) -> None:
+        if self.capacity is not None:
+            cost = min(cost, self.capacity)
+            self.level -= cost
+        self.pending += cost
+        self.pending_calls += 1
+
+    def settle(self) -> None:
+        """Nothing is in flight: drop charges of calls that never got a response."""
+        self.pending, self.pending_calls = 0.0, 0
+
+class _SharedStream:
+    """
+    Fans one upstream iterator out to every reader of a coalesced stream. Items
+    are buffered, so a reader that joins late replays from the start; whichever
+    reader runs out of buffered items pulls the next one. If every reader
+    leaves early the upstream is closed.
+    """
+
+    _PULL = object()
+
+    def __init__(self, source: Iterator, on_done: Callable[[], None]):
+        self._source = source
+        self._on_done = on_done
+        self._items: List[Any] = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._pumping = False
+        self._readers = 0
+        self._cond = threading.Condition()
+
+    def join(self) -> Optional[Iterator]:
+        """A new reader, or None if the stream already finished."""
+        with self._cond:
+            if self._done:
+                return None
+            self._readers += 1
+        return self._read()
+
+    def _finish(self, error: Optional[BaseException]) -> None:
+        with self._cond:
+            self._done, self._error, self._pumping = True, error, False
+            self._cond.notify_all()
+        self._on_done()
+
+    def _pull(self) -> None:
+        try:
+            item = next(self._source)
+        except StopIteration:
+            self._finish(None)
+        except BaseException as e:
+            self._finish(e)
+        else:
+            with self._cond:
+                self._items.append(item)
+                self._pumping = False
+                self._cond.notify_all()
+
+    def _read(self) -> Iterator:
+        position = 0
+        try:
+            while True:
+                with self._cond:
+                    while position >= len(self._items) and not self._done and self._pumping:
+                        self._cond.wait()
+                    if position < len(self._items):
+                        item = self._items[position]
+                    elif self._done:
+                        if self._error is not None:
+                            raise self._error
+                        return
+                    else:
+                        item, self._pumping = self._PULL, True
+                if item is self._PULL:
+                    self._pull()
+                    continue
+                position += 1
+                yield item
+        finally:
+            with self._cond:
+                self._readers -= 1
+                abandoned = self._readers == 0 and not self._done
+            if abandoned:
+                close = getattr(self._source, "close", None)
+                if close is not None:
+                    close()
+                self._finish(RuntimeError("stream abandoned by every reader"))
+
+class GroqScheduler:
+    """
+    Admission control for Groq calls, shared by every thread (and event loop).
+
+    - Singleflight: identical in-flight requests (same key) share one upstream
+      call; streams are fanned out to every caller.
+    - Rate limits: request and token buckets follow the provider's x-ratelimit-*
+      headers, and a 429's retry-after pauses admission for everyone, so a burst
+      queues instead of failing.
+    - Priority: when calls have to wait, the lowest priority value goes first
+      (emergency-looking input, then intent/transcription, then synthesis);
+      equal priorities are first come, first served.
+    - Retries: rate-limit, connection and 5xx errors are retried up to
+      GROQ_MAX_ATTEMPTS times with full-jitter exponential backoff.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = GROQ_MAX_CONCURRENCY,
+        max_attempts: int = GROQ_MAX_ATTEMPTS,
+        queue_timeout_s: float = GROQ_QUEUE_TIMEOUT_S,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.queue_timeout_s = queue_timeout_s
+        self.requests = TokenBucket("requests")
+        self.tokens = TokenBucket("tokens")
+        self.blocked_until = 0.0
+        self._cond = threading.Condition()
+        self._waiting: List[tuple] = []
+        self._tickets = itertools.count()
+        self._active = 0
+        self._flights: Dict[str, Any] = {}
+        self._async_flights: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Future]]" = weakref.WeakKeyDictionary()
+        self.counters = {"calls": 0, "coalesced": 0, "retries": 0, "rate_limited": 0, "queue_timeouts": 0, "queued_s": 0.0}
+
+    # --- rate-limit headers ---
+
+    def observe_response(self, response: httpx.Response) -> None:
+        """httpx response hook: feeds rate-limit headers (and 429s) into the buckets."""
+        headers = response.headers
+        now = time.monotonic()
+        with self._cond:
+            self.requests.update(headers.get("x-ratelimit-limit-requests"), headers.get("x-ratelimit-remaining-requests"), headers.get("x-ratelimit-reset-requests"), now)
+            self.tokens.update(headers.get("x-ratelimit-limit-tokens"), headers.get("x-ratelimit-remaining-tokens"), headers.get("x-ratelimit-reset-tokens"), now)
+            if response.status_code == 429:
+                self.counters["rate_limited"] += 1
+                retry_after = parse_duration(headers.get("retry-after")) or BACKOFF_BASE_S
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            self._cond.notify_all()
+
+    async def aobserve_response(self, response: httpx.Response) -> None:
+        self.observe_response(response)
+
+    # --- admission ---
+
+    def _try_admit(self, ticket: tuple, cost: float) -> float:
+        """Admits `ticket` (returns 0) or returns a hint of how long to wait. Caller holds the lock."""
+        if self._waiting[0] != ticket or self._active >= self.max_concurrency:
+            return self.queue_timeout_s
+        now = time.monotonic()
+        wait = max(self.blocked_until - now, self.requests.wait_s(1, now), self.tokens.wait_s(cost, now))
+        if wait > 0:
+            return wait
+        heapq.heappop(self._waiting)
+        self.requests.take(1)
+        self.tokens.take(cost)
+        self._active += 1
+        self.counters["calls"] += 1
+        # The next waiter may now be at the head.
+        self._cond.notify_all()
+        return 0.0
+
+    def _withdraw(self, ticket: tuple) -> None:
+        if ticket in self._waiting:
+            self._waiting.remove(ticket)
+            heapq.heapify(self._waiting)
+            self._cond.notify_all()
+
+    def _queued(self, started: float) -> None:
+        waited = time.monotonic() - started
+        self.counters["queued_s"] += waited
+        if waited > 0.001:
+            tracing.annotate(queued_ms=round(waited * 1000, 1))
+
+    def acquire(self, priority: int, cost: float) -> None:
+        started = time.monotonic()
+        deadline = started + self.queue_timeout_s
+        ticket = (priority, next(self._tickets))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    wait = self._try_admit(ticket, cost)
+                    if wait == 0:
+                        self._queued(started)
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counters["queue_timeouts"] += 1
+                        raise QueueTimeout(f"Groq call not admitted within {self.queue_timeout_s:.0f}s (rate limited or saturated)")
+                    self._cond.wait(min(wait, remaining))
+            except BaseException:
+                self._withdraw(ticket)
+                raise
+
+    async def aacquire(self, priority: int, cost: float) -> None:
+        """acquire() for event loops: polls instead of blocking the loop."""
+        started = time.monotonic()
+        deadline = started + self.queue_timeout_s
+        ticket = (priority, next(self._tickets))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_admit(ticket, cost)
+                    if wait == 0:
+                        self._queued(started)
+                        return
+                    if time.monotonic() >= deadline:
+                        self.counters["queue_timeouts"] += 1
+                        raise QueueTimeout(f"Groq call not admitted within {self.queue_timeout_s:.0f}s (rate limited or saturated)")
+                await asyncio.sleep(min(wait, ASYNC_POLL_S))
+        except BaseException:
+            with self._cond:
+                self._withdraw(ticket)
+            raise
+
+    def release(self) -> None:
+        with self._cond:
+            self._active -= 1
+            if self._active == 0:
+                self.requests.settle()
+                self.tokens.settle()
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: int, cost: float = 0.0):
+        self.acquire(priority, cost)
+        try:
+            yield
+        finally:
+            self.release()
+
+    # --- calls ---
+
+    def _backoff_s(self, attempt: int) -> float:
+        # Full jitter: retries from a burst spread out instead of arriving together.
+        return random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt))
+
+    def _call_with_retry(self, fn: Callable[[], Any], priority: int, cost: float, hold: bool = False) -> Any:
+        """Runs fn() in a slot, retrying transient errors. With `hold`, the slot stays taken on success."""
+        for attempt in range(self.max_attempts):
+            self.acquire(priority, cost)
+            try:
+                result = fn()
+            except RETRYABLE_ERRORS as e:
+                self.release()
+                if attempt == self.max_attempts - 1:
+                    raise
+                delay = self._backoff_s(attempt)
+                logger.info("groq %s, retry %d in %.2fs", type(e).__name__, attempt + 1, delay)
+            except BaseException:
+                self.release()
+                raise
+            else:
+                if not hold:
+                    self.release()
+                return result
+            with self._cond:
+                self.counters["retries"] += 1
+            tracing.annotate(retries=attempt + 1)
+            time.sleep(delay)
+
+    def call(self, fn: Callable[[], Any], priority: int = PRIORITY_INTERACTIVE, cost: float = 0.0, key: Optional[str] = None) -> Any:
+        """fn() under admission control and retries; callers with the same `key` share one call."""
+        if key is None:
+            return self._call_with_retry(fn, priority, cost)
+        with self._cond:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+            else:
+                self.counters["coalesced"] += 1
+        if not leader:
+            tracing.annotate(coalesced=True)
+            return flight.result()
+        try:
+            result = self._call_with_retry(fn, priority, cost)
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            with self._cond:
+                self._flights.pop(key, None)
+
+    def _open_stream(self, open_fn: Callable[[], Any], priority: int, cost: float) -> Iterator:
+        stream = self._call_with_retry(open_fn, priority, cost, hold=True)
+        try:
+            yield from stream
+        finally:
+            self.release()
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+    def stream(self, open_fn: Callable[[], Any], priority: int = PRIORITY_SYNTHESIS, cost: float = 0.0, key: Optional[str] = None) -> Iterator:
+        """
+        Iterator over the stream open_fn() returns. The slot is held until the
+        stream ends; only opening it is retried. Callers with the same `key`
+        read one shared upstream stream.
+        """
+        if key is None:
+            return self._open_stream(open_fn, priority, cost)
+        with self._cond:
+            shared = self._flights.get(key)
+            reader = shared.join() if isinstance(shared, _SharedStream) else None
+            if reader is not None:
+                self.counters["coalesced"] += 1
+                tracing.annotate(coalesced=True)
+                return reader
+            shared = self._flights[key] = _SharedStream(self._open_stream(open_fn, priority, cost), lambda: self._end_flight(key, shared))
+            return shared.join()
+
+    def _end_flight(self, key: str, flight: Any) -> None:
+        with self._cond:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def _acall_with_retry(self, fn: Callable[[], Any], priority: int, cost: float) -> Any:
+        for attempt in range(self.max_attempts):
+            await self.aacquire(priority, cost)
+            try:
+                return await fn()
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_attempts - 1:
+                    raise
+                delay = self._backoff_s(attempt)
+                logger.info("groq %s, retry %d in %.2fs", type(e).__name__, attempt + 1, delay)
+            finally:
+                self.release()
+            with self._cond:
+                self.counters["retries"] += 1
+            tracing.annotate(retries=attempt + 1)
+            await asyncio.sleep(delay)
+
+    async def acall(self, fn: Callable[[], Any], priority: int = PRIORITY_INTERACTIVE, cost: float = 0.0, key: Optional[str] = None) -> Any:
+        """Async call(): `fn` returns an awaitable. Coalescing is per event loop."""
+        if key is None:
+            return await self._acall_with_retry(fn, priority, cost)
+        with self._cond:
+            flights = self._async_flights.setdefault(asyncio.get_running_loop(), {})
+        task = flights.get(key)
+        if task is not None:
+            with self._cond:
+                self.counters["coalesced"] += 1
+            tracing.annotate(coalesced=True)
+        else:
+            task = flights[key] = asyncio.ensure_future(self._acall_with_retry(fn, priority, cost))
+
+            def done(finished: asyncio.Future) -> None:
+                flights.pop(key, None)
+                # Marks the exception retrieved even if every caller was cancelled.
+                if not finished.cancelled():
+                    finished.exception()
+
+            task.add_done_callback(done)
+        # Shielded: one caller giving up must not cancel the call for the others.
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                **self.counters,
+                "active": self._active,
+                "waiting": len(self._waiting),
+                "in_flight_keys": len(self._flights),
+                "requests_remaining": self.requests.level if self.requests.capacity is not None else None,
+                "tokens_remaining": self.tokens.level if self.tokens.capacity is not None else None,
+                "blocked_for_s": max(0.0, self.blocked_until - time.monotonic()),
+            }
+
+SCHEDULER = GroqScheduler()
@@ -1,65 +1,302 @@
 import os
+import json
+import time
+import uuid
+import hashlib
+import argparse
 import pandas as pd
-from typing import List, Dict, Any, Optional
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Any, Optional, Set, Tuple, Iterable, Iterator, Callable
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
-from sentence_transformers import SentenceTransformer
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, PayloadSchemaType,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+)
+from embedding_store import EmbeddingStore
+from encoder import EMBEDDING_MODEL, ENCODER_BACKEND, get_encoder
+from safety_tags import drug_safety_mask, mask_to_tags
+from filter_planner import STATS_PATH, is_local
+from vector_backend import NUMPY_INDEX_PATH, SNAPSHOT_ROOT, export_from_qdrant, publish_from_qdrant
 
 # --- CONFIGURATION ---
 COLLECTION_NAME: str = "drugs_knowledge_base"
 DB_PATH: str = "qdrant_db"
 DATASET_PATH: str = "drugs_dataset.csv"
+BATCH_SIZE: int = 256
+SCROLL_PAGE_SIZE: int = 1024
+CHECKPOINT_PATH: str = "index_checkpoint.json"
+# Only the columns that feed the semantic text or the payload are parsed.
+SOURCE_COLUMNS: List[str] = ["drug_name", "medical_condition", "side_effects", "rx_otc", "pregnancy_category"]
+# Payload fields the retriever filters on: indexed as keywords, with per-value counts.
+FILTER_FIELDS: List[str] = ["pregnancy_category", "rx_otc", "safety_tags"]
 
-def index_data(limit: Optional[int] = None) -> None:
+def build_semantic_text(row: Dict[str, Any]) -> str:
+    return (
+        f"Drug Name: {row.get('drug_name', 'Unknown')}. "
+        f"Condition: {row.get('medical_condition', 'Unknown')}. "
+        f"Side Effects: {row.get('side_effects', '')}."
+    )
+
+def build_payload(row: Dict[str, Any]) -> Dict[str, Any]:
+    # Contraindications are compiled once here so the Evaluator only does a bitwise AND.
+    safety_mask = drug_safety_mask(row.get('drug_name', 'Unknown'), str(row.get('pregnancy_category', 'N')))
+    return {
+        "drug_name": row.get('drug_name', 'Unknown'),
+        "condition": row.get('medical_condition', 'Unknown'),
+        "rx_otc": row.get('rx_otc', 'Rx'),
+        "pregnancy_category": str(row.get('pregnancy_category', 'N')),
+        "side_effects": str(row.get('side_effects', 'Unknown'))[:500],
+        "safety_mask": safety_mask,
+        "safety_tags": mask_to_tags(safety_mask),
+    }
+
+def content_hash(row: Dict[str, Any]) -> str:
+    """Stable fingerprint of everything that ends up in a point (vector text + payload)."""
+    fingerprint = {"semantic_text": build_semantic_text(row), "payload": build_payload(row)}
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def point_id_for(row_hash: str) -> str:
+    # Ids are derived from content, so an unchanged row keeps its id across runs
+    # and a changed row simply becomes a new point.
+    return str(uuid.UUID(row_hash[:32]))
+
+def fetch_existing_ids(client: QdrantClient) -> Set[str]:
+    existing: Set[str] = set()
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=COLLECTION_NAME,
+            limit=SCROLL_PAGE_SIZE,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False,
+        )
+        existing.update(str(record.id) for record in records)
+        if offset is None:
+            return existing
+
+def dataset_signature() -> str:
+    stat = os.stat(DATASET_PATH)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def load_checkpoint(limit: Optional[int]) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(CHECKPOINT_PATH):
+        return None
+    with open(CHECKPOINT_PATH, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    # A checkpoint only applies to the exact file (and limit) it was written for.
+    if checkpoint.get("dataset") != dataset_signature() or checkpoint.get("limit") != limit:
+        return None
+    return checkpoint
+
+def save_checkpoint(limit: Optional[int], rows_committed: int) -> None:
+    tmp_path = CHECKPOINT_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"dataset": dataset_signature(), "limit": limit, "rows_committed": rows_committed}, f)
+    os.replace(tmp_path, CHECKPOINT_PATH)
+
+def iter_dataset_chunks(chunk_size: int, limit: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    header = pd.read_csv(DATASET_PATH, nrows=0).columns
+    usecols = [column for column in SOURCE_COLUMNS if column in header]
+    reader = pd.read_csv(DATASET_PATH, usecols=usecols, dtype=str, chunksize=chunk_size, nrows=limit)
+    for chunk in reader:
+        yield chunk.fillna("Unknown")
+
+def embed_and_upsert(
+    model,
+    client: QdrantClient,
+    batches: Iterable[Tuple[List[Tuple[str, str, Dict[str, Any]]], int]],
+    batch_size: int,
+    on_commit: Callable[[int], None],
+    store: Optional[EmbeddingStore] = None,
+) -> int:
+    # Two-stage pipeline: the main thread encodes batch N+1 while a single
+    # writer thread upserts batch N. At most one upsert is in flight, so
+    # memory stays bounded to roughly two batches. `on_commit` is called with
+    # the source row offset once everything before it is durably upserted.
+    embedded = 0
+    pending: Optional[Future] = None
+    pending_rows_end = 0
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        for items, rows_end in batches:
+            points: List[PointStruct] = []
+            if items:
+                texts = [build_semantic_text(row) for _, _, row in items]
+                if store is not None:
+                    embeddings = store.encode(model, texts, batch_size=batch_size)
+                else:
+                    embeddings = model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+                points = [
+                    PointStruct(id=point_id, vector=vector.tolist(), payload={**build_payload(row), "content_hash": row_hash})
+                    for (point_id, row_hash, row), vector in zip(items, embeddings)
+                ]
+                embedded += len(points)
+
+            if pending is not None:
+                pending.result()
+                on_commit(pending_rows_end)
+            pending = writer.submit(client.upsert, collection_name=COLLECTION_NAME, points=points) if points else None
+            pending_rows_end = rows_end
+            if pending is None:
+                on_commit(rows_end)
+
+        if pending is not None:
+            pending.result()
+            on_commit(pending_rows_end)
+    return embedded
+
+def quantization_config(quantize: bool) -> Optional[ScalarQuantization]:
+    if not quantize:
+        return None
+    # int8 codes stay in RAM; originals are kept on disk for rescoring.
+    return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))
+
+def create_payload_indexes(client: QdrantClient) -> None:
+    # Embedded Qdrant scans payloads and warns that indexes have no effect.
+    if is_local(client):
+        return
+    for field_name in FILTER_FIELDS:
+        client.create_payload_index(
+            collection_name=COLLECTION_NAME,
+            field_name=field_name,
+            field_schema=PayloadSchemaType.KEYWORD,
+        )
+
+def save_stats(total: int, field_counts: Dict[str, Counter]) -> None:
+    stats = {"total": total, "fields": {field: dict(counts) for field, counts in field_counts.items()}}
+    tmp_path = STATS_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, STATS_PATH)
+
+def index_data(
+    limit: Optional[int] = None,
+    batch_size: int = BATCH_SIZE,
+    full_rebuild: bool = False,
+    use_store: bool = True,
+    numpy_dtype: Optional[str] = None,
+    quantize: bool = False,
+    snapshot_dtype: Optional[str] = None,
+) -> None:
     print("--- ⚙️ Initializing Embedding Model ---")
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    
+    model = get_encoder(ENCODER_BACKEND)
+
+    store: Optional[EmbeddingStore] = None
+    if use_store:
+        store = EmbeddingStore(EMBEDDING_MODEL, dim=384)
+        print(f"--- 💾 Embedding store '{store.path}': {len(store)} cached vectors ---")
+
     print(f"--- 🔌 Connecting to Qdrant Local ({DB_PATH}) ---")
     client = QdrantClient(path=DB_PATH)
-    
-    client.recreate_collection(
-        collection_name=COLLECTION_NAME,
-        vectors_config=VectorParams(size=384, distance=Distance.COSINE),
-    )
+    if quantize and is_local(client):
+        # Embedded Qdrant searches exactly and drops the quantization config.
+        print("--- ⚠️ Qdrant local mode ignores --quantize; use --export-numpy with VECTOR_QUANTIZATION=int8 instead ---")
+        quantize = False
 
     if not os.path.exists(DATASET_PATH):
         raise FileNotFoundError(f"❌ Error: '{DATASET_PATH}' not found. Please move the CSV to the root folder.")
 
-    df = pd.read_csv(DATASET_PATH).fillna("Unknown")
-    print(f"--- 📂 Loaded {len(df)} records. Indexing... ---")
-
-    points: List[PointStruct] = []
-    batch_size: int = 100
-    
-    data_iterator = df.head(limit) if limit else df
+    checkpoint = load_checkpoint(limit)
+    resume_from = checkpoint["rows_committed"] if checkpoint else 0
+    if resume_from:
+        print(f"--- ♻️ Resuming from checkpoint: {resume_from} rows already committed ---")
 
-    for index, row in data_iterator.iterrows():
-        semantic_text = (
-            f"Drug Name: {row.get('drug_name', 'Unknown')}. "
-            f"Condition: {row.get('medical_condition', 'Unknown')}. "
-            f"Side Effects: {row.get('side_effects', '')}."
+    # An interrupted full rebuild already recreated the collection; resuming it
+    # must not wipe what was committed before the interruption.
+    if (full_rebuild and not checkpoint) or not client.collection_exists(COLLECTION_NAME):
+        client.recreate_collection(
+            collection_name=COLLECTION_NAME,
+            vectors_config=VectorParams(size=384, distance=Distance.COSINE),
+            quantization_config=quantization_config(quantize),
         )
-        
-        embedding = model.encode(semantic_text).tolist()
-        
-        payload: Dict[str, Any] = {
-            "drug_name": row.get('drug_name', 'Unknown'),
-            "condition": row.get('medical_condition', 'Unknown'),
-            "rx_otc": row.get('rx_otc', 'Rx'),
-            "pregnancy_category": str(row.get('pregnancy_category', 'N')), 
-            "side_effects": str(row.get('side_effects', 'Unknown'))[:500] 
-        }
-        
-        points.append(PointStruct(id=index, vector=embedding, payload=payload))
-        
-        if len(points) >= batch_size:
-            client.upsert(collection_name=COLLECTION_NAME, points=points)
-            points = []
-
-    if points:
-        client.upsert(collection_name=COLLECTION_NAME, points=points)
-    
+        existing_ids: Set[str] = set()
+    else:
+        if quantize:
+            client.update_collection(collection_name=COLLECTION_NAME, quantization_config=quantization_config(quantize))
+        existing_ids = fetch_existing_ids(client)
+        print(f"--- 🔁 Incremental mode: {len(existing_ids)} points already stored ---")
+
+    print(f"--- 📂 Streaming '{DATASET_PATH}' in chunks of {batch_size} rows... ---")
+
+    # Only point ids are kept for the whole run (needed to find removed rows);
+    # row data lives for one chunk at a time.
+    seen_ids: Set[str] = set()
+    stats = {"rows": 0, "unchanged": 0}
+    field_counts: Dict[str, Counter] = {field: Counter() for field in FILTER_FIELDS}
+
+    def diff_batches() -> Iterator[Tuple[List[Tuple[str, str, Dict[str, Any]]], int]]:
+        for chunk in iter_dataset_chunks(batch_size, limit):
+            items: List[Tuple[str, str, Dict[str, Any]]] = []
+            for row in chunk.to_dict("records"):
+                row_number = stats["rows"]
+                stats["rows"] += 1
+                row_hash = content_hash(row)
+                point_id = point_id_for(row_hash)
+                if point_id in seen_ids:
+                    continue
+                seen_ids.add(point_id)
+                payload = build_payload(row)
+                for field in FILTER_FIELDS:
+                    value = payload[field]
+                    field_counts[field].update(value if isinstance(value, list) else [value])
+                if point_id in existing_ids or row_number < resume_from:
+                    stats["unchanged"] += 1
+                    continue
+                items.append((point_id, row_hash, row))
+            yield items, stats["rows"]
+
+    start = time.perf_counter()
+    # New and changed points go in before stale ones are removed, so the live
+    # collection is never empty while the update runs.
+    embedded = embed_and_upsert(
+        model, client, diff_batches(), batch_size,
+        on_commit=lambda rows_committed: save_checkpoint(limit, rows_committed),
+        store=store,
+    )
+
+    to_delete = [point_id for point_id in existing_ids if point_id not in seen_ids]
+    for offset in range(0, len(to_delete), batch_size):
+        client.delete(collection_name=COLLECTION_NAME, points_selector=to_delete[offset:offset + batch_size])
+
+    create_payload_indexes(client)
+    save_stats(len(seen_ids), field_counts)
+
+    if os.path.exists(CHECKPOINT_PATH):
+        os.remove(CHECKPOINT_PATH)
+
+    elapsed = time.perf_counter() - start
+    rate = embedded / elapsed if elapsed > 0 else 0.0
+    print(f"--- 🧮 Diff: {embedded} new/changed, {len(to_delete)} removed, {stats['unchanged']} unchanged ---")
+    print(f"--- ⏱️ Embedded {embedded} of {stats['rows']} rows in {elapsed:.1f}s ({rate:.0f} rows/sec) ---")
     print(f"--- ✅ SUCCESS: Knowledge Base built at '{DB_PATH}' ---")
 
+    if numpy_dtype:
+        rows = export_from_qdrant(client, COLLECTION_NAME, NUMPY_INDEX_PATH, dtype=numpy_dtype)
+        print(f"--- 🧊 Exported {rows} vectors ({numpy_dtype}) to NumPy index '{NUMPY_INDEX_PATH}' ---")
+
+    if snapshot_dtype:
+        version, rows = publish_from_qdrant(client, COLLECTION_NAME, SNAPSHOT_ROOT, dtype=snapshot_dtype)
+        print(f"--- 📸 Published snapshot {version} ({rows} vectors, {snapshot_dtype}) under '{SNAPSHOT_ROOT}' ---")
+
 if __name__ == "__main__":
-    index_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the SafeMeds Qdrant knowledge base.")
+    parser.add_argument("--limit", type=int, default=None, help="Only index the first N rows.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Rows per encode/upsert batch.")
+    parser.add_argument("--full", action="store_true", help="Drop the collection and re-embed every row.")
+    parser.add_argument("--no-store", action="store_true", help="Do not read or write the on-disk embedding store.")
+    parser.add_argument("--export-numpy", choices=["float32", "float16"], default=None,
+                        help="Also export a memory-mapped NumPy search index with this dtype.")
+    parser.add_argument("--publish-snapshot", nargs="?", const="float32", choices=["float32", "float16"], default=None,
+                        help="Also publish an immutable snapshot for read-only serving (VECTOR_BACKEND=snapshot) and make it current.")
+    parser.add_argument("--quantize", action="store_true", help="Enable Qdrant scalar int8 quantization, rescored at query time (Qdrant server only; local mode ignores it).")
+    args = parser.parse_args()
+    index_data(
+        limit=args.limit,
+        batch_size=args.batch_size,
+        full_rebuild=args.full,
+        use_store=not args.no_store,
+        numpy_dtype=args.export_numpy,
+        quantize=args.quantize,
+        snapshot_dtype=args.publish_snapshot,
+    )
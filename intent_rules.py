@@ -0,0 +1,146 @@
+import re
+from typing import Optional
+
+# Deterministic lexicons mirroring the rules in llm_engine.analyze_intent's prompt.
+# Only inputs these rules settle with confidence are answered locally; anything
+# else (negations, mixed signals, unknown wording) is left to the LLM.
+
+# Someone the emergency is happening to right now ("my dad is", "she's", "I'm").
+CURRENT_SUBJECT = r"(i am|i'm|im|he is|he's|hes|she is|she's|shes|they are|they're|theyre|someone is|somebody is|(my|our) \w+ is)"
+
+EMERGENCY_PATTERNS = [
+    r"chest (pain|pains|hurts|hurting|tightness|pressure)",
+    r"(pain|tightness|pressure) in (my|the) chest",
+    r"(can ?not|can't|cant|unable to|struggling to|hard to) breathe",
+    r"(trouble|difficulty|problem|problems) breathing",
+    r"short(ness)? of breath",
+    r"not breathing",
+    # Collapse, seizures, bleeding and heart attacks only in first-person, present-tense
+    # phrasings; history, prevention and questions mention them too (see EMERGENCY_TERMS).
+    rf"{CURRENT_SUBJECT} (fainting|passing out|passed out|unconscious|unresponsive)",
+    r"(won't|wont|will not) wake up", r"(can ?not|can't|cant) wake (him|her|them|my \w+) up",
+    rf"{CURRENT_SUBJECT} (still )?bleeding (heavily|badly|a lot|profusely|uncontrollably|everywhere)",
+    r"(can ?not|can't|cant|won't|wont) stop (the )?bleeding", r"bleeding (won't|wont|will not) stop",
+    rf"{CURRENT_SUBJECT} (having|about to have) a heart attack",
+    rf"{CURRENT_SUBJECT} (having (a )?seizures?|seizing|convulsing)",
+    r"anaphyla(xis|ctic)",
+    r"(severe|serious) allergic reaction",
+    r"throat (is )?(closing|swelling shut)",
+    r"(kill|killing) myself",
+    r"suicid(e|al)",
+    # Clinical stroke phrasings only: a bare "stroke" also means "a stroke of luck".
+    r"(having|having had|is having|just had) a stroke(?! of)", r"stroke (symptoms|signs)",
+    r"signs of (a )?stroke", r"(face|facial) (is )?droop(ing|y)?", r"slurred speech", r"slurring (my |his |her |their )?words",
+]
+
+# Emergencies that EMERGENCY_PATTERNS only accept in a current phrasing. Any
+# other mention ("to prevent a heart attack", "a seizure disorder", "does
+# warfarin cause severe bleeding") is left to the LLM rather than answered locally.
+EMERGENCY_TERMS = [
+    r"heart attack(s)?", r"seizure(s)?", r"seizing", r"convuls(ion|ions|ing)", r"bleed(ing|s)?",
+    r"faint(ed|ing|s)?", r"passed out", r"unconscious(ness)?", r"stroke(s)?(?! of)",
+]
+
+SYMPTOM_PATTERNS = [
+    r"cough(s|ing)?", r"fever(s|ish)?", r"headache(s)?", r"migraine(s)?", r"pain(s|ful)?",
+    r"ache(s)?", r"nausea", r"nauseous", r"vomit(ing)?", r"cold", r"flu", r"acne", r"rash(es)?",
+    r"swelling", r"swollen", r"infection(s)?", r"sore throat", r"dizzy", r"dizziness",
+    r"fatigue", r"tired(ness)?", r"weakness", r"stomach ?ache", r"diarrh(o)?ea", r"allerg(y|ies|ic)",
+    r"itch(y|ing)?", r"heartburn", r"indigestion", r"constipat(ed|ion)", r"insomnia", r"cramp(s)?",
+    r"congest(ed|ion)", r"sneez(e|ing)", r"runny nose", r"acid reflux", r"blood pressure",
+    r"diabetes", r"asthma", r"eczema", r"sinus(itis)?", r"toothache", r"sprain(ed)?",
+]
+
+# Matched against the WHOLE utterance: "I need meds for my back" names a body
+# part (and "give me medicine for my toddler" a patient), so anything after the
+# drug-seeking phrase leaves the decision to the LLM.
+ADVERSARIAL_PATTERNS = [
+    r"give me ((any|some)( kind of)? )?(drug|drugs|pills|meds|medicine|medication)",
+    r"i (want|need) (some |any )?(pills|drugs|meds)",
+    r"((recommend|give me|i (want|need)) )?something (strong|stronger)",
+    r"i (want|need) (a|to get) high",
+    r"(how (to|do i|can i) )?get high( on [a-z0-9' ]+)?",
+    r"(just )?prescribe me (something|anything)",
+    r"how (to|do i|can i) overdose( on [a-z0-9' ]+)?",
+    r"how (to|do i|can i) make (drugs|meth|pills)",
+]
+ADVERSARIAL_PREFIX = r"(please |pls |just |can you |could you )?"
+ADVERSARIAL_SUFFIX = r"( please| now| right now| asap)?"
+
+VAGUE_PATTERNS = [
+    r"i (feel|am feeling|'m feeling|m feeling) (bad|off|weird|strange|unwell|ill|sick|awful|terrible)",
+    r"i (am|'m|m) (sick|ill|unwell|not well|not feeling well)",
+    r"(i'm |i am |im )?not feeling (well|good|great)",
+    r"something (is|'s|s) wrong( with me)?",
+    r"my body feels (off|weird|strange|wrong)",
+    r"help me",
+]
+
+# Broader than EMERGENCY_PATTERNS and negation-blind: only used to move a query
+# up the Groq queue, never to decide its intent.
+URGENT_PATTERNS = EMERGENCY_PATTERNS + EMERGENCY_TERMS + [
+    r"emergency", r"urgent(ly)?", r"severe(ly)?", r"overdos(e|ed|ing)", r"bleed(ing)?",
+    r"breath(e|ing)?", r"chest", r"allergic reaction", r"swallowed", r"poison(ed|ing)?",
+]
+
+NEGATION_PATTERN = r"\b(no|not|without|never|denies|deny)\s+(\w+\s+){0,2}$"
+# "what to do if someone is having a seizure" asks about an emergency, it does not report one.
+HYPOTHETICAL_PATTERN = r"\b(if|when|whenever|in case|prevent|preventing|avoid|avoiding)\s+(\S+\s+){0,3}$"
+
+def _compile(patterns):
+    return [re.compile(rf"\b(?:{pattern})\b") for pattern in patterns]
+
+_EMERGENCY = _compile(EMERGENCY_PATTERNS)
+_SYMPTOM = _compile(SYMPTOM_PATTERNS)
+_EMERGENCY_TERMS = _compile(EMERGENCY_TERMS)
+_ADVERSARIAL = [re.compile(rf"{ADVERSARIAL_PREFIX}(?:{pattern}){ADVERSARIAL_SUFFIX}") for pattern in ADVERSARIAL_PATTERNS]
+_VAGUE = [re.compile(rf"(?:{pattern})") for pattern in VAGUE_PATTERNS]
+_NEGATION = re.compile(NEGATION_PATTERN)
+_HYPOTHETICAL = re.compile(HYPOTHETICAL_PATTERN)
+_URGENT = _compile(URGENT_PATTERNS)
+
+def _clean(query: str) -> str:
+    text = query.lower().replace("’", "'")
+    text = re.sub(r"[^a-z0-9' ]+", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+def classify_intent_locally(query: str) -> Optional[str]:
+    """
+    Returns an intent label when the rules decide it unambiguously, otherwise None.
+    Priority follows the LLM prompt: Emergency > Symptom > Adversarial/Vague.
+    """
+    text = _clean(query)
+    if not text:
+        return None
+
+    emergency_hits = [m for pattern in _EMERGENCY for m in pattern.finditer(text)]
+    if emergency_hits:
+        # "no chest pain" / "if he is having a seizure" must not trip the alarm on their own; let the LLM read it.
+        if any(_NEGATION.search(text[:m.start()]) or _HYPOTHETICAL.search(text[:m.start()]) for m in emergency_hits):
+            return None
+        return "EMERGENCY_ALERT"
+    if any(pattern.search(text) for pattern in _EMERGENCY_TERMS):
+        # Mentioned, but not as happening now (history, prevention, a question): not a confident call.
+        return None
+
+    has_symptom = any(pattern.search(text) for pattern in _SYMPTOM)
+    is_adversarial = any(pattern.fullmatch(text) for pattern in _ADVERSARIAL)
+
+    if has_symptom:
+        # "How to overdose on pain pills" mixes both signals: not a confident call.
+        return None if is_adversarial else "SEARCH_DRUGS"
+    if is_adversarial:
+        return "BLOCK_ADVERSARIAL"
+    if any(pattern.fullmatch(text) for pattern in _VAGUE):
+        return "CLARIFY_SYMPTOMS"
+    return None
+
+def looks_urgent(query: str) -> bool:
+    """True if the query mentions anything emergency-like, even negated or mixed."""
+    text = _clean(query)
+    return any(pattern.search(text) for pattern in _URGENT)
+
+def mentions_symptom(query: str) -> bool:
+    """True if the query names any known symptom or condition."""
+    text = _clean(query)
+    return any(pattern.search(text) for pattern in _SYMPTOM)
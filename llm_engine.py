@@ -1,27 +1,90 @@
 import os
+import time
+import hashlib
+import asyncio
+import threading
+import logging
+import weakref
+import httpx
 from dotenv import load_dotenv
-from groq import Groq
+from groq import Groq, AsyncGroq
+from cache import LRUCache, normalize_query
+from intent_rules import classify_intent_locally, looks_urgent
+from prompt_builder import build_pharmacist_messages, build_intent_messages, build_format_correction, estimate_tokens
+from groq_scheduler import SCHEDULER, PRIORITY_EMERGENCY, PRIORITY_INTERACTIVE, PRIORITY_SYNTHESIS, request_key
+from audio_preprocess import AUDIO_PREPROCESSING, preprocess_audio
+import tracing
 
 # TEAM 651 CONFIGURATION
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
 # Configuration
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 LLM_MODEL = "llama-3.1-8b-instant"
+INTENT_CACHE_SIZE = 1024
+TRANSCRIPTION_CACHE_SIZE = 64
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL")  # Point at a local stand-in server for testing
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "30"))
+GROQ_CONNECT_TIMEOUT = float(os.getenv("GROQ_CONNECT_TIMEOUT", "5"))
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "20"))
+# Expected completion sizes, charged against the token bucket before a call.
+INTENT_COMPLETION_TOKENS = 8
+SYNTHESIS_COMPLETION_TOKENS = 300
+RESPONSE_SECTIONS = ["**Clinical Decision:**", "**Recommendation:**", "**Reasoning:**", "**Safety Note:**"]
+
+# --- Shared Clients ---
+# One long-lived client per process (and one async client per event loop) so
+# every call reuses pooled keep-alive connections instead of paying TLS setup.
+# Every call goes through groq_scheduler.SCHEDULER, which owns retries (so the
+# SDK's own are off) and reads rate-limit headers via the httpx response hook.
+_client = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+_intent_cache = LRUCache(INTENT_CACHE_SIZE)
+# Recording content hash -> transcript. st.audio_input keeps its value across
+# reruns, so the same recording is handed to transcribe_audio on every rerun.
+_transcription_cache = LRUCache(TRANSCRIPTION_CACHE_SIZE)
+
+def _timeout():
+    return httpx.Timeout(GROQ_TIMEOUT, connect=GROQ_CONNECT_TIMEOUT)
+
+def _limits():
+    return httpx.Limits(max_connections=GROQ_MAX_CONNECTIONS, max_keepalive_connections=GROQ_MAX_CONNECTIONS)
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = Groq(
+                    api_key=GROQ_API_KEY,
+                    base_url=GROQ_BASE_URL,
+                    timeout=_timeout(),
+                    max_retries=0,
+                    http_client=httpx.Client(timeout=_timeout(), limits=_limits(), event_hooks={"response": [SCHEDULER.observe_response]}),
+                )
+    return _client
+
+def get_async_client():
+    # httpx async connections are bound to the loop that opened them.
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncGroq(
+            api_key=GROQ_API_KEY,
+            base_url=GROQ_BASE_URL,
+            timeout=_timeout(),
+            max_retries=0,
+            http_client=httpx.AsyncClient(timeout=_timeout(), limits=_limits(), event_hooks={"response": [SCHEDULER.aobserve_response]}),
+        )
+        _async_clients[loop] = client
+    return client
 
-def generate_pharmacist_response(user_query, retrieval_results, user_profile):
-    if "gsk_" not in GROQ_API_KEY and "GROQ_API_KEY" not in os.environ:
-        return "⚠️ **System Error:** Agent Brain disconnected (No API Key)."
-
-    try:
-        client = Groq(api_key=GROQ_API_KEY)
-    except Exception as e:
-        return f"Error initializing Groq client: {e}"
-
-    # 1. Construct Context 
-    context_text = ""
-
+def _pharmacist_messages(user_query, retrieval_results, user_profile):
+    """Budgeted prompt for the approved drugs; returns (messages, token stats)."""
     if isinstance(retrieval_results, list):
         # List of points (likely from the Evaluator Agent's safe_drugs list)
         points_to_process = retrieval_results
@@ -30,181 +93,293 @@ def generate_pharmacist_response(user_query, retrieval_results, user_profile):
         points_to_process = retrieval_results.points
     else:
         points_to_process = []
+    return build_pharmacist_messages(user_query, points_to_process, user_profile)
 
-    for doc in points_to_process:
-        payload = doc.payload
-        context_text += f"""
-        ---
-        Drug Name: {payload.get('drug_name', 'Unknown')}
-        Treats Condition: {payload.get('condition', 'Unknown')}
-        Safety Category: {payload.get('pregnancy_category', 'Unknown')}
-        Side Effects: {payload.get('side_effects', 'Unknown')}
-        ---
-        """
-
-
-    # 2. The "Smart" Prompt with Counter-Factual Logic
-    system_prompt = f"""
-    You are SafeMeds AI (Team 651), a clinical decision support agent.
-    
-    USER CONTEXT:
-    - Pregnancy Status: { 'YES (High Risk)' if user_profile['pregnancy_risk'] else 'No' }
-    - Rx Preference: { 'Prescription Only' if not user_profile['prescription_only_ok'] else 'Any' }
-    
-    CRITICAL INSTRUCTION: "The Counter-Factual Safety Check"
-    If you find a drug that matches the user's condition PERFECTLY but is blocked by Safety Rules (e.g. Accutane for Acne, but user is Pregnant):
-    1. DO NOT recommend it.
-    2. EXPLICITLY state: "I identified a standard treatment ([Drug Name]), but I have intervened to block it due to [Safety Constraint]."
-    3. Suggest a safe alternative if available.
-    
-    STANDARD RULES:
-    1. Match Name or Condition.
-    2. Be concise.
-    
-    OUTPUT FORMAT:
-    "**Clinical Decision:** [Approved/Intervention]
-     **Recommendation:** [Drug Name or 'None']
-     **Reasoning:** [Explain the safety logic]
-     **Safety Note:** [Warnings]"
-    """
 
-    user_message = f"User Query: {user_query}\n\nAvailable Drug Data:\n{context_text}"
+def _token_cost(messages, completion_tokens):
+    return sum(estimate_tokens(message["content"]) for message in messages) + completion_tokens
+
+
+def generate_pharmacist_response(user_query, retrieval_results, user_profile):
+    if "gsk_" not in GROQ_API_KEY and "GROQ_API_KEY" not in os.environ:
+        return "⚠️ **System Error:** Agent Brain disconnected (No API Key)."
 
-    # 3. Call LLM
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
-            model=LLM_MODEL,
-            temperature=0.1, 
+        client = get_client()
+    except Exception as e:
+        return f"Error initializing Groq client: {e}"
+
+    messages, prompt_stats = _pharmacist_messages(user_query, retrieval_results, user_profile)
+
+    try:
+        chat_completion = SCHEDULER.call(
+            lambda: client.chat.completions.create(
+                messages=messages,
+                model=LLM_MODEL,
+                temperature=0.1, 
+            ),
+            priority=PRIORITY_SYNTHESIS,
+            cost=prompt_stats["prompt_tokens_est"] + SYNTHESIS_COMPLETION_TOKENS,
+            key=request_key(LLM_MODEL, messages),
         )
         return chat_completion.choices[0].message.content
     except Exception as e:
         return f"Error connecting to Brain: {str(e)}"
-    
-
 
 
-
-def analyze_intent(query):
+def stream_pharmacist_response(user_query, retrieval_results, user_profile, timings=None, previous_answer=None, missing_sections=None):
     """
-    Classifies user query into: SEARCH_DRUGS, CLARIFY_SYMPTOMS, or EMERGENCY_ALERT.
+    Streaming variant of generate_pharmacist_response: yields text chunks as they arrive.
+    If `timings` is a dict it receives ttft_s, total_s, the estimated prompt size,
+    token counts (when the API reports them) and the missing_sections check.
+    Passing a malformed `previous_answer` and its `missing_sections` asks for a rewrite.
     """
-    if "gsk_" not in GROQ_API_KEY:
-        # Fail-safe: If API key is missing, default to search to avoid blocking user
-        return "SEARCH_DRUGS"
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
 
-    client = Groq(api_key=GROQ_API_KEY)
-    
-    prompt = f"""
-You are a strict medical intent classifier.
+    if "gsk_" not in GROQ_API_KEY and "GROQ_API_KEY" not in os.environ:
+        yield "⚠️ **System Error:** Agent Brain disconnected (No API Key)."
+        return
+
+    messages, prompt_stats = _pharmacist_messages(user_query, retrieval_results, user_profile)
+    if previous_answer is not None:
+        messages = build_format_correction(messages, previous_answer, missing_sections or [])
+        prompt_stats["prompt_tokens_est"] = _token_cost(messages, 0)
+    timings["prompt_tokens_est"] = prompt_stats["prompt_tokens_est"]
+    text = ""
+    try:
+        # Identical concurrent requests share one upstream stream.
+        stream = SCHEDULER.stream(
+            lambda: get_client().chat.completions.create(
+                messages=messages,
+                model=LLM_MODEL,
+                temperature=0.1, 
+                stream=True,
+            ),
+            priority=PRIORITY_SYNTHESIS,
+            cost=prompt_stats["prompt_tokens_est"] + SYNTHESIS_COMPLETION_TOKENS,
+            key=request_key(LLM_MODEL, messages, "stream"),
+        )
+        for chunk in stream:
+            # Groq reports usage on the final chunk under x_groq.
+            usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or getattr(chunk, "usage", None)
+            if usage is not None:
+                timings.update(_token_counts(usage))
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            if "ttft_s" not in timings:
+                timings["ttft_s"] = time.perf_counter() - start
+            text += delta
+            yield delta
+    except Exception as e:
+        yield f"Error connecting to Brain: {str(e)}"
+        return
+    finally:
+        timings["total_s"] = time.perf_counter() - start
 
-You MUST return exactly ONE label:
+    timings["missing_sections"] = missing_response_sections(text)
 
-EMERGENCY_ALERT
-SEARCH_DRUGS
-BLOCK_ADVERSARIAL
-CLARIFY_SYMPTOMS
 
-━━━━━━━━━━ ABSOLUTE RULE ━━━━━━━━━━
+def _token_counts(usage):
+    if usage is None:
+        return {}
+    return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
 
-If the input contains ANY real symptom word — even ONE word — it is SEARCH_DRUGS.
-Never treat symptoms as vague.
 
-Symptoms include (but are not limited to):
-cough, fever, headache, pain, nausea, vomiting, cold, flu, acne, rash, swelling, infection,
-sore throat, dizziness, fatigue, weakness, stomach ache, diarrhea, allergy, itching
+def missing_response_sections(text):
+    """Returns the OUTPUT FORMAT headings the response failed to include."""
+    return [section for section in RESPONSE_SECTIONS if section not in text]
 
-━━━━━━━━━━ EMERGENCY RULE ━━━━━━━━━━
 
-Return EMERGENCY_ALERT if input mentions:
-• breathing trouble
-• chest pain
-• unconsciousness
-• severe bleeding
-• serious allergic reaction
-• life-threatening language
+async def agenerate_pharmacist_response(user_query, retrieval_results, user_profile):
+    """Async variant of generate_pharmacist_response."""
+    if "gsk_" not in GROQ_API_KEY and "GROQ_API_KEY" not in os.environ:
+        return "⚠️ **System Error:** Agent Brain disconnected (No API Key)."
 
-Emergency ALWAYS overrides symptom rule.
+    try:
+        client = get_async_client()
+    except Exception as e:
+        return f"Error initializing Groq client: {e}"
 
-━━━━━━━━━━ ADVERSARIAL RULE ━━━━━━━━━━
+    messages, prompt_stats = _pharmacist_messages(user_query, retrieval_results, user_profile)
+
+    try:
+        chat_completion = await SCHEDULER.acall(
+            lambda: client.chat.completions.create(
+                messages=messages,
+                model=LLM_MODEL,
+                temperature=0.1, 
+            ),
+            priority=PRIORITY_SYNTHESIS,
+            cost=prompt_stats["prompt_tokens_est"] + SYNTHESIS_COMPLETION_TOKENS,
+            key=request_key(LLM_MODEL, messages),
+        )
+        return chat_completion.choices[0].message.content
+    except Exception as e:
+        return f"Error connecting to Brain: {str(e)}"
 
-Return BLOCK_ADVERSARIAL ONLY if:
-No symptom, no body part, no condition is mentioned at all and the user intent is clearly about seeking drugs or harmful information.
 
-Examples of Adversarial/Drug-Seeking:
-"Give me any drug", 
-"I want pills", 
-"Recommend something strong", 
-"I need a high".
-Lazy/Vague Requests for Meds: "Just prescribe me something", "Give me medicine" (without symptoms).
-Harmful: "How to overdose", "How to make drugs".
+def _intent_priority(query):
+    # Emergency-looking input that still needs the LLM (e.g. negated or mixed) jumps the queue.
+    return PRIORITY_EMERGENCY if looks_urgent(query) else PRIORITY_INTERACTIVE
 
-━━━━━━━━━━ VAGUE RULE ━━━━━━━━━━
 
-Return CLARIFY_SYMPTOMS ONLY if:
-No symptom, no body part, no condition is mentioned at all.
+def analyze_intent(query):
+    """
+    Classifies user query into: SEARCH_DRUGS, CLARIFY_SYMPTOMS, or EMERGENCY_ALERT.
+    Confident cases are settled by the local rules; only ambiguous input reaches the LLM.
+    """
+    local_intent = classify_intent_locally(query)
+    if local_intent:
+        return local_intent
+
+    if "gsk_" not in GROQ_API_KEY:
+        # Fail-safe: If API key is missing, default to search to avoid blocking user
+        return "SEARCH_DRUGS"
 
-Examples of vague:
-"I feel bad"
-"I am sick"
-"Something is wrong"
-"My body feels off"
+    key = normalize_query(query)
+    cached = _intent_cache.get(key)
+    if cached:
+        return cached
 
-━━━━━━━━━━ FINAL PRIORITY ━━━━━━━━━━
+    messages = build_intent_messages(key)
+    try:
+        with tracing.span("intent_llm") as span:
+            # Concurrent sessions asking the same thing share one call.
+            completion = SCHEDULER.call(
+                lambda: get_client().chat.completions.create(
+                    messages=messages,
+                    model="llama-3.1-8b-instant",
+                    temperature=0.0 
+                ),
+                priority=_intent_priority(query),
+                cost=_token_cost(messages, INTENT_COMPLETION_TOKENS),
+                key=request_key("llama-3.1-8b-instant", messages),
+            )
+            span.annotate(**_token_counts(completion.usage))
+    except Exception as e:
+        # Fail open so the user is never blocked, but not silently.
+        logger.warning("intent classification failed (%s: %s); defaulting to SEARCH_DRUGS", type(e).__name__, e)
+        return "SEARCH_DRUGS"
+    # Only real verdicts are cached, never the fallback.
+    intent = completion.choices[0].message.content.strip()
+    _intent_cache.put(key, intent)
+    return intent
 
-1. Emergency  
-2. Any symptom → SEARCH_DRUGS  
-3. Otherwise → CLARIFY_SYMPTOMS  
 
-━━━━━━━━━━ OUTPUT ━━━━━━━━━━
+async def aanalyze_intent(query):
+    """Async variant of analyze_intent (shares the local rules and verdict cache)."""
+    local_intent = classify_intent_locally(query)
+    if local_intent:
+        return local_intent
 
-Return ONLY:
-EMERGENCY_ALERT
-SEARCH_DRUGS
-CLARIFY_SYMPTOMS
-BLOCK_ADVERSARIAL
+    if "gsk_" not in GROQ_API_KEY:
+        return "SEARCH_DRUGS"
 
-User input:
-"{query}"
-"""
+    key = normalize_query(query)
+    cached = _intent_cache.get(key)
+    if cached:
+        return cached
 
-    
+    messages = build_intent_messages(key)
     try:
-        completion = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.1-8b-instant",
-            temperature=0.0 
-        )
-        return completion.choices[0].message.content.strip()
-    except:
+        with tracing.span("intent_llm") as span:
+            completion = await SCHEDULER.acall(
+                lambda: get_async_client().chat.completions.create(
+                    messages=messages,
+                    model="llama-3.1-8b-instant",
+                    temperature=0.0 
+                ),
+                priority=_intent_priority(query),
+                cost=_token_cost(messages, INTENT_COMPLETION_TOKENS),
+                key=request_key("llama-3.1-8b-instant", messages),
+            )
+            span.annotate(**_token_counts(completion.usage))
+    except Exception as e:
+        logger.warning("intent classification failed (%s: %s); defaulting to SEARCH_DRUGS", type(e).__name__, e)
         return "SEARCH_DRUGS"
-    
+    intent = completion.choices[0].message.content.strip()
+    _intent_cache.put(key, intent)
+    return intent
+
+
+def _read_audio(audio_file_obj):
+    """Returns (cache key, filename, raw bytes); the key hashes the bytes as uploaded."""
+    # getvalue() is position-independent; read() returns b"" once the buffer was consumed.
+    data = audio_file_obj.getvalue() if hasattr(audio_file_obj, "getvalue") else audio_file_obj.read()
+    name = getattr(audio_file_obj, "name", "audio.wav")
+    key = f"{hashlib.sha256(data).hexdigest()}:{'16k-mono-trimmed' if AUDIO_PREPROCESSING else 'raw'}"
+    return key, name, data
+
+def _prepare_upload(name, data):
+    """Returns (upload filename, upload bytes): the preprocessed WAV, unless it is no smaller."""
+    if AUDIO_PREPROCESSING:
+        upload, stats = preprocess_audio(data)
+        # Already-small input (8 kHz, 8-bit) can grow when re-encoded as 16 kHz 16-bit.
+        if stats["preprocessed"] and len(upload) < len(data):
+            return os.path.splitext(name)[0] + ".wav", upload
+    return name, data
 
 
 def transcribe_audio(audio_file_obj):
     """
     Uses Groq's Whisper model to transcribe voice to text.
+    Transcripts are cached by audio content hash, so a recording is sent only once.
     """
     if "gsk_" not in GROQ_API_KEY and "GROQ_API_KEY" not in os.environ:
         return None, "⚠️ API Key missing."
 
     try:
-        client = Groq(api_key=GROQ_API_KEY)
+        key, name, data = _read_audio(audio_file_obj)
+        cached = _transcription_cache.get(key)
+        if cached is not None:
+            return cached, None
+        # Decoding and resampling only happen on a cache miss.
+        name, upload = _prepare_upload(name, data)
+
+        client = get_client()
         
-        transcription = client.audio.transcriptions.create(
-            file=(audio_file_obj.name, audio_file_obj.read()),
-            model="whisper-large-v3", # Extremely fast
-            response_format="json",
-            temperature=0.0
+        transcription = SCHEDULER.call(
+            lambda: client.audio.transcriptions.create(
+                file=(name, upload),
+                model="whisper-large-v3", # Extremely fast
+                response_format="json",
+                temperature=0.0
+            ),
+            priority=PRIORITY_INTERACTIVE,
+            key=key,
         )
+        _transcription_cache.put(key, transcription.text)
         return transcription.text, None
     except Exception as e:
         return None, f"Transcription Error: {str(e)}"
-    
 
 
+async def atranscribe_audio(audio_file_obj):
+    """Async variant of transcribe_audio (shares the transcript cache)."""
+    if "gsk_" not in GROQ_API_KEY and "GROQ_API_KEY" not in os.environ:
+        return None, "⚠️ API Key missing."
 
-    
+    try:
+        key, name, data = _read_audio(audio_file_obj)
+        cached = _transcription_cache.get(key)
+        if cached is not None:
+            return cached, None
+        # Decoding and resampling only happen on a cache miss.
+        name, upload = _prepare_upload(name, data)
+
+        transcription = await SCHEDULER.acall(
+            lambda: get_async_client().audio.transcriptions.create(
+                file=(name, upload),
+                model="whisper-large-v3",
+                response_format="json",
+                temperature=0.0
+            ),
+            priority=PRIORITY_INTERACTIVE,
+            key=key,
+        )
+        _transcription_cache.put(key, transcription.text)
+        return transcription.text, None
+    except Exception as e:
+        return None, f"Transcription Error: {str(e)}"
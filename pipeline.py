@@ -0,0 +1,675 @@
+"""
+Headless SafeMeds pipeline: Planner -> Retriever -> Evaluator -> Synthesis with
+no Streamlit dependency, served over HTTP/JSON.
+
+    python pipeline.py --port 8700 --max-batch-size 32 --max-wait-ms 5
+
+Concurrent requests are gathered into micro-batches: query embeddings go
+through one `encode` call per batch and vector searches through one
+`query_batch_points` call per batch. app.py uses SafeMedsPipeline in-process,
+or PipelineClient when PIPELINE_URL points at a running server.
+"""
+import os
+import json
+import time
+import queue
+import signal
+import argparse
+import threading
+import contextvars
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import ScoredPoint
+from llm_engine import stream_pharmacist_response, analyze_intent
+from groq_scheduler import SCHEDULER
+from cache import QueryEmbeddingCache, ResponseCache, normalize_query
+from safety_tags import profile_mask, point_masks, contraindicated, mask_to_tags
+from filter_planner import load_stats, run_search_batch, matches, search_params
+from alias_index import AliasIndex, retrieve_points
+from query_decomposer import decompose_query, reciprocal_rank_fusion
+from vector_backend import NumpyVectorIndex, SnapshotIndex
+from encoder import EMBEDDING_MODEL, load_encoder
+import tracing
+
+# --- CONFIGURATION ---
+COLLECTION_NAME: str = "drugs_knowledge_base"
+DB_PATH: str = "qdrant_db"
+RETRIEVAL_LIMIT: int = 4
+# Unconstrained hits cached per query by candidates(); select() re-applies the
+# patient constraints to them, so a profile change needs no new search.
+CANDIDATE_LIMIT: int = int(os.getenv("CANDIDATE_LIMIT", "32"))
+UNCONSTRAINED_PROFILE: Dict[str, Any] = {"pregnancy_risk": False, "prescription_only_ok": True, "conditions": ()}
+# "qdrant" (default), "numpy" (in-process search over the exported memory-mapped
+# index) or "snapshot" (read-only: the current published snapshot, hot-swapped;
+# never opens qdrant_db, so any number of processes can serve at once)
+VECTOR_BACKEND: str = os.getenv("VECTOR_BACKEND", "qdrant")
+# numpy/snapshot backends only: "int8" or "binary" scans quantized codes and rescores the shortlist
+VECTOR_QUANTIZATION: Optional[str] = os.getenv("VECTOR_QUANTIZATION") or None
+# A batch is flushed when it holds MAX_BATCH_SIZE items or MAX_WAIT_MS after its first item.
+MAX_BATCH_SIZE: int = int(os.getenv("PIPELINE_MAX_BATCH_SIZE", "32"))
+MAX_WAIT_MS: float = float(os.getenv("PIPELINE_MAX_WAIT_MS", "5"))
+PIPELINE_HOST: str = os.getenv("PIPELINE_HOST", "127.0.0.1")
+PIPELINE_PORT: int = int(os.getenv("PIPELINE_PORT", "8700"))
+PIPELINE_URL: Optional[str] = os.getenv("PIPELINE_URL") or None
+# Server processes sharing the port (snapshot backend only; POSIX fork).
+PIPELINE_WORKERS: int = int(os.getenv("PIPELINE_WORKERS", "1"))
+
+# Planner verdict -> pipeline decision; anything else proceeds to retrieval.
+INTENT_DECISIONS: Dict[str, str] = {"EMERGENCY": "emergency", "BLOCK_ADVERSARIAL": "blocked", "CLARIFY": "clarify"}
+
+class MicroBatcher:
+    """
+    Gathers items submitted from many threads into lists for `fn(items) -> results`.
+
+    A worker thread takes the first waiting item, then keeps collecting until
+    the batch holds `max_batch_size` items or `max_wait_s` has passed, and
+    resolves each caller's Future with its own result.
+    """
+
+    def __init__(self, fn: Callable[[List[Any]], List[Any]], max_batch_size: int = MAX_BATCH_SIZE, max_wait_s: float = MAX_WAIT_MS / 1000, name: str = "batcher"):
+        self.fn = fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max(0.0, max_wait_s)
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any) -> Future:
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item: Any) -> Any:
+        return self.submit(item).result()
+
+    def _collect(self) -> Optional[list]:
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                # Flush what we have, then stop on the next loop.
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            # Callers that cancelled while queued are dropped from the batch.
+            live = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            items, futures = [item for item, _ in live], [future for _, future in live]
+            self.batches += 1
+            self.items += len(items)
+            self.largest_batch = max(self.largest_batch, len(items))
+            try:
+                results = self.fn(items)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def close(self) -> None:
+        self._queue.put(None)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch": self.items / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_s * 1000,
+        }
+
+def normalize_profile(user_profile: dict) -> dict:
+    """Canonical patient profile (JSON lists become sorted tuples, so cache scopes compare equal)."""
+    return {
+        "pregnancy_risk": bool(user_profile.get("pregnancy_risk", False)),
+        "prescription_only_ok": bool(user_profile.get("prescription_only_ok", True)),
+        "conditions": tuple(sorted(user_profile.get("conditions", ()))),
+    }
+
+def hit_to_json(hit) -> dict:
+    return {"id": hit.id, "score": hit.score, "payload": hit.payload}
+
+def json_to_points(hits: List[dict]) -> List[ScoredPoint]:
+    return [ScoredPoint(id=hit["id"], version=0, score=hit.get("score", 0.0), payload=hit["payload"]) for hit in hits]
+
+class SafeMedsPipeline:
+    """
+    The four agents as plain methods over JSON-serializable dicts. Thread-safe:
+    the HTTP server calls it from one thread per request.
+    """
+
+    def __init__(
+        self,
+        client: Optional[QdrantClient] = None,
+        encoder=None,
+        vector_backend: str = VECTOR_BACKEND,
+        quantization: Optional[str] = VECTOR_QUANTIZATION,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait_ms: float = MAX_WAIT_MS,
+    ):
+        # Embedded Qdrant locks qdrant_db to one process, so snapshot mode never opens it.
+        self.snapshots = SnapshotIndex(quantization=quantization) if vector_backend == "snapshot" else None
+        self.client = client or (QdrantClient(path=DB_PATH) if self.snapshots is None else None)
+        if encoder is None:
+            # Backend chosen by ENCODER_BACKEND; warmed up so the first query skips setup.
+            encoder, self.encoder_timings = load_encoder()
+        else:
+            self.encoder_timings = {"backend": getattr(encoder, "backend", "custom"), "load_s": 0.0, "warmup_s": 0.0}
+        self.encoder = encoder
+        # Persisted so common queries survive restarts.
+        self.query_cache = QueryEmbeddingCache(model_name=EMBEDDING_MODEL, max_size=1024, persist_path="query_cache.jsonl")
+        self.response_cache = ResponseCache(max_size=256, ttl_s=3600, similarity_threshold=0.9)
+        # Per-value cardinalities recorded by the indexer; drive the filter planner.
+        self.collection_stats = load_stats()
+        # Quantized rescoring params, only if the collection is actually quantized.
+        self.search_params = search_params(self.client, COLLECTION_NAME) if self.client is not None else None
+        # Generic + brand names -> point ids, for queries that name a drug directly.
+        # In snapshot mode it is rebuilt from each snapshot's payloads when the snapshot changes.
+        self._alias_lock = threading.Lock()
+        if self.snapshots is not None:
+            index = self.snapshots.current()
+            self._snapshot_aliases = (index, AliasIndex.from_points(index.drug_names()))
+            self.alias_index = self._snapshot_aliases[1]
+        else:
+            self.alias_index = AliasIndex.build(self.client, COLLECTION_NAME)
+        self.numpy_index = NumpyVectorIndex(quantization=quantization) if vector_backend == "numpy" else None
+        self.embed_batcher = MicroBatcher(self._encode_batch, max_batch_size, max_wait_ms / 1000, name="embed-batcher")
+        self.search_batcher = MicroBatcher(self._search_batch, max_batch_size, max_wait_ms / 1000, name="search-batcher")
+        # Speculative retrieval in run(); no more than the server's own concurrency needs.
+        self.executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="speculative")
+
+    # --- batched backends ---
+
+    def _encode_batch(self, texts: List[str]) -> List[List[float]]:
+        unique = list(dict.fromkeys(texts))
+        vectors = dict(zip(unique, self.encoder.encode(unique, batch_size=len(unique)).tolist()))
+        return [vectors[text] for text in texts]
+
+    def _serving_snapshot(self) -> Tuple[NumpyVectorIndex, AliasIndex]:
+        """Current snapshot and its alias index, taken together once per request."""
+        index = self.snapshots.current()
+        if self._snapshot_aliases[0] is not index:
+            with self._alias_lock:
+                if self._snapshot_aliases[0] is not index:
+                    self._snapshot_aliases = (index, AliasIndex.from_points(index.drug_names()))
+        return self._snapshot_aliases
+
+    def _search_batch(self, requests: List[tuple]) -> List[tuple]:
+        # One snapshot for the whole batch, even if a swap lands mid-batch.
+        index = self.snapshots.current() if self.snapshots is not None else self.numpy_index
+        if index is not None:
+            return index.search_batch([request[0] for request in requests], [request[1] for request in requests], [request[2] for request in requests])
+        # One query_batch_points round per distinct limit (patient searches vs. candidate fetches).
+        results: List[Optional[tuple]] = [None] * len(requests)
+        for limit in sorted({limit for _, _, limit in requests}):
+            rows = [i for i, request in enumerate(requests) if request[2] == limit]
+            batch = run_search_batch(
+                self.client, COLLECTION_NAME,
+                [requests[i][0] for i in rows], [requests[i][1] for i in rows],
+                self.collection_stats, limit=limit, params=self.search_params,
+            )
+            for i, result in zip(rows, batch):
+                results[i] = result
+        return results
+
+    def embed(self, query: str) -> List[float]:
+        with tracing.span("encode") as span:
+            vector = self.query_cache.get(query)
+            span.annotate(cached=vector is not None)
+            if vector is None:
+                # Encode the normalized form so every query sharing a cache key shares a vector.
+                vector = self.embed_batcher(normalize_query(query))
+                self.query_cache.put(query, vector)
+        return vector
+
+    def embed_many(self, queries: List[str]) -> List[List[float]]:
+        """Like embed(), but all cache misses are submitted together, so they share one encode call."""
+        with tracing.span("encode") as span:
+            vectors = [self.query_cache.get(query) for query in queries]
+            misses = [i for i, vector in enumerate(vectors) if vector is None]
+            span.annotate(cached=len(queries) - len(misses), queries=len(queries))
+            futures = [self.embed_batcher.submit(normalize_query(queries[i])) for i in misses]
+            for i, future in zip(misses, futures):
+                vectors[i] = future.result()
+                self.query_cache.put(queries[i], vectors[i])
+        return vectors
+
+    # --- agents ---
+
+    def plan(self, query: str) -> dict:
+        """Planner: intent label plus the routing decision (proceed/emergency/blocked/clarify)."""
+        with tracing.span("planner"):
+            intent = analyze_intent(query)
+        decision = next((value for label, value in INTENT_DECISIONS.items() if label in intent), "proceed")
+        return {"intent": intent, "decision": decision}
+
+    def retrieve(self, query: str, user_profile: dict) -> dict:
+        """Retriever: {"hits": [...], "plan": {...}} (hits are {"id", "score", "payload"})."""
+        with tracing.span("retriever"):
+            return self._retrieve(query, normalize_profile(user_profile))
+
+    def candidates(self, query: str) -> dict:
+        """
+        Retriever without patient constraints: up to CANDIDATE_LIMIT hits, to be
+        kept per query and narrowed with select(). "complete" is True when no
+        further point could match (every alias hit fetched, or the search ran
+        out of points).
+        """
+        with tracing.span("retriever"):
+            retrieval = self._retrieve(query, UNCONSTRAINED_PROFILE, limit=CANDIDATE_LIMIT)
+        if retrieval["plan"]["strategy"] == "alias lookup":
+            retrieval["complete"] = retrieval["plan"]["fetch_limit"] <= CANDIDATE_LIMIT
+        else:
+            retrieval["complete"] = len(retrieval["hits"]) < CANDIDATE_LIMIT
+        return retrieval
+
+    def select(self, query: str, candidates: dict, user_profile: dict) -> dict:
+        """
+        Retriever result for `user_profile`, filtered locally from candidates().
+        Same shape as retrieve(); falls back to a constrained search only when the
+        constraints leave fewer than RETRIEVAL_LIMIT hits of an incomplete set.
+        """
+        user_profile = normalize_profile(user_profile)
+        with tracing.span("select") as span:
+            survivors = [hit for hit in candidates["hits"] if matches(hit["payload"], user_profile)]
+            span.annotate(candidates=len(candidates["hits"]), survivors=len(survivors))
+            sub_queries = candidates.get("sub_queries")
+            if sub_queries:
+                # Re-fuse the filtered per-symptom rankings; every symptom needs enough survivors of its own.
+                by_id = {hit["id"]: hit for hit in survivors}
+                fetched = {hit["id"] for hit in candidates["hits"]}
+                ranked = [[by_id[point_id] for point_id in sub["ids"] if point_id in by_id] for sub in sub_queries]
+                sufficient = all(
+                    len(sub_hits) >= RETRIEVAL_LIMIT or (sub["complete"] and fetched.issuperset(sub["ids"]))
+                    for sub, sub_hits in zip(sub_queries, ranked)
+                )
+                hits = reciprocal_rank_fusion(ranked, RETRIEVAL_LIMIT)
+            else:
+                sufficient = len(survivors) >= RETRIEVAL_LIMIT or candidates.get("complete")
+                if not survivors and candidates["plan"]["strategy"] == "alias lookup":
+                    # The named drug is contraindicated: retrieve() searches for safe alternatives.
+                    sufficient = False
+                hits = survivors[:RETRIEVAL_LIMIT]
+        if not sufficient:
+            return self.retrieve(query, user_profile)
+        selectivity = len(survivors) / len(candidates["hits"]) if candidates["hits"] else None
+        plan = {"strategy": f"cached candidates ({candidates['plan']['strategy']})", "fetch_limit": len(candidates["hits"]), "selectivity": selectivity}
+        if "dropped_sub_queries" in candidates["plan"]:
+            plan["dropped_sub_queries"] = candidates["plan"]["dropped_sub_queries"]
+        return {"hits": hits, "plan": plan}
+
+    def _retrieve(self, query: str, user_profile: dict, limit: int = RETRIEVAL_LIMIT) -> dict:
+        # A query that names a known drug resolves straight to its points by id.
+        snapshot, alias_index = self._serving_snapshot() if self.snapshots is not None else (None, self.alias_index)
+        with tracing.span("alias_lookup") as span:
+            named_ids = alias_index.resolve(query)
+            span.annotate(matched=len(named_ids))
+        if named_ids:
+            with tracing.span("retrieve_points"):
+                results = snapshot.retrieve(named_ids) if snapshot is not None else retrieve_points(self.client, COLLECTION_NAME, named_ids)
+            hits = [hit for hit in results.points if matches(hit.payload, user_profile)][:limit]
+            if hits:
+                plan = {"strategy": "alias lookup", "fetch_limit": len(named_ids), "selectivity": None}
+                return {"hits": [hit_to_json(hit) for hit in hits], "plan": plan}
+            # Every named drug is contraindicated for this patient: search for safe alternatives instead.
+            retrieval = self._search(query, user_profile, limit)
+            retrieval["plan"]["strategy"] += " (named drug contraindicated)"
+            return retrieval
+        return self._search(query, user_profile, limit)
+
+    def _search(self, query: str, user_profile: dict, limit: int) -> dict:
+        with tracing.span("decompose") as span:
+            sub_queries, dropped = decompose_query(query)
+            span.annotate(sub_queries=len(sub_queries), dropped=len(dropped))
+        if len(sub_queries) == 1:
+            query_vector = self.embed(query)
+            with tracing.span("vector_search") as span:
+                results, plan = self.search_batcher((query_vector, user_profile, limit))
+                span.annotate(strategy=plan["strategy"])
+            # The Qdrant Filter object is an execution detail, not part of the response.
+            plan = {key: value for key, value in plan.items() if key != "filter"}
+            return {"hits": [hit_to_json(hit) for hit in results.points], "plan": plan}
+
+        # One vector per symptom. Submitted together, they share one encode call and
+        # one query_batch_points call; the rankings are merged by reciprocal rank.
+        vectors = self.embed_many(sub_queries)
+        with tracing.span("vector_search") as span:
+            futures = [self.search_batcher.submit((vector, user_profile, limit)) for vector in vectors]
+            searches = [future.result() for future in futures]
+            span.annotate(strategy=searches[0][1]["strategy"], sub_queries=len(sub_queries))
+        ranked = [[hit_to_json(hit) for hit in results.points] for results, _ in searches]
+        plan = {key: value for key, value in searches[0][1].items() if key != "filter"}
+        plan["strategy"] = f"{plan['strategy']}, fused over {len(sub_queries)} sub-queries"
+        plan["fetch_limit"] = sum(search_plan["fetch_limit"] for _, search_plan in searches)
+        if dropped:
+            # Symptoms past MAX_SUB_QUERIES were not searched; the UI tells the user.
+            plan["dropped_sub_queries"] = dropped
+        return {
+            "hits": reciprocal_rank_fusion(ranked, limit),
+            "plan": plan,
+            "sub_queries": [{"query": sub, "ids": [hit["id"] for hit in hits], "complete": len(hits) < limit} for sub, hits in zip(sub_queries, ranked)],
+        }
+
+    def evaluate(self, hits: List[dict], user_profile: dict) -> dict:
+        """Evaluator: splits hits into approved and blocked via one vectorized mask AND."""
+        with tracing.span("evaluator"):
+            return self._evaluate(hits, normalize_profile(user_profile))
+
+    def _evaluate(self, hits: List[dict], user_profile: dict) -> dict:
+        patient_mask = profile_mask(user_profile)
+        if not patient_mask:
+            return {"checked": False, "approved": hits, "blocked": []}
+
+        masks = point_masks(json_to_points(hits))
+        approved, blocked = [], []
+        for hit, mask, is_blocked in zip(hits, masks, contraindicated(masks, patient_mask)):
+            if not is_blocked:
+                approved.append(hit)
+            else:
+                blocked.append({
+                    "drug_name": hit["payload"].get("drug_name", "Unknown"),
+                    "pregnancy_category": hit["payload"].get("pregnancy_category", "N"),
+                    "reasons": mask_to_tags(int(mask) & patient_mask),
+                })
+        return {"checked": True, "approved": approved, "blocked": blocked}
+
+    def synthesize(self, query: str, approved: List[dict], user_profile: dict, bypass_cache: bool = False) -> Iterator[dict]:
+        """
+        Synthesis as a stream of events: {"delta": text} chunks, then one final
+        {"done": True, "cached": ..., ...timings} event. An answer missing required
+        sections is regenerated once; a {"retry": True, "missing_sections": [...]}
+        event tells the consumer to discard the deltas received so far.
+        """
+        user_profile = normalize_profile(user_profile)
+        approved_ids = [hit["id"] for hit in approved]
+        query_vector = self.embed(query)
+        started = time.perf_counter()
+
+        cached = None if bypass_cache else self.response_cache.get(query_vector, approved_ids, user_profile)
+        if cached:
+            response, similarity = cached
+            tracing.record("synthesis", started, cached=True)
+            yield {"delta": response}
+            yield {"done": True, "cached": True, "similarity": similarity}
+            return
+
+        timings: Dict[str, Any] = {}
+        chunks: List[str] = []
+        for delta in stream_pharmacist_response(query, json_to_points(approved), user_profile, timings):
+            chunks.append(delta)
+            yield {"delta": delta}
+        if timings.get("missing_sections"):
+            missing = timings["missing_sections"]
+            yield {"retry": True, "missing_sections": missing}
+            previous, chunks, timings = "".join(chunks), [], {"retried": True}
+            for delta in stream_pharmacist_response(query, json_to_points(approved), user_profile, timings, previous, missing):
+                chunks.append(delta)
+                yield {"delta": delta}
+        if "missing_sections" in timings and not timings["missing_sections"]:
+            # Only complete, well-formed answers are worth reusing.
+            self.response_cache.put(query_vector, approved_ids, user_profile, "".join(chunks))
+        # Recorded after the fact: a span cannot stay open across the caller's iteration.
+        tracing.record("synthesis", started, cached=False, **{key: timings[key] for key in ("ttft_s", "prompt_tokens_est", "retried", *tracing.TOKEN_ATTRIBUTES) if key in timings})
+        yield {"done": True, "cached": False, **timings}
+
+    def run(self, query: str, user_profile: dict, bypass_cache: bool = False) -> dict:
+        """End-to-end workflow; retrieval starts speculatively alongside the Planner."""
+        user_profile = normalize_profile(user_profile)
+        # The copied context carries the active trace into the worker thread.
+        pending = self.executor.submit(contextvars.copy_context().run, self.retrieve, query, user_profile)
+        result: Dict[str, Any] = {"query": query, **self.plan(query)}
+        if result["decision"] != "proceed":
+            pending.cancel()
+            return result
+
+        retrieval = pending.result()
+        evaluation = self.evaluate(retrieval["hits"], user_profile)
+        result.update(plan=retrieval["plan"], retrieved=retrieval["hits"], approved=evaluation["approved"], blocked=evaluation["blocked"])
+        if not evaluation["approved"]:
+            result["decision"] = "no_safe_candidates"
+            return result
+
+        chunks: List[str] = []
+        for event in self.synthesize(query, evaluation["approved"], user_profile, bypass_cache):
+            if "delta" in event:
+                chunks.append(event["delta"])
+            elif "retry" in event:
+                chunks = []
+            else:
+                result["synthesis"] = {key: value for key, value in event.items() if key != "done"}
+        result["response"] = "".join(chunks)
+        return result
+
+    def stats(self) -> dict:
+        stats = {
+            "encoder": self.encoder_timings,
+            "query_cache": self.query_cache.stats(),
+            "response_cache": self.response_cache.stats(),
+            "embed_batches": self.embed_batcher.stats(),
+            "search_batches": self.search_batcher.stats(),
+            "groq": SCHEDULER.stats(),
+        }
+        if self.snapshots is not None:
+            stats["snapshot"] = {"version": self.snapshots.version, "swaps": self.snapshots.swaps, "pid": os.getpid()}
+        return stats
+
+class PipelineClient:
+    """Same interface as SafeMedsPipeline, backed by a running `python pipeline.py` server."""
+
+    def __init__(self, base_url: str = PIPELINE_URL or f"http://{PIPELINE_HOST}:{PIPELINE_PORT}", timeout: float = 60.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _open(self, path: str, body: Optional[dict] = None):
+        data = None if body is None else json.dumps(body).encode("utf-8")
+        request = urllib.request.Request(self.base_url + path, data=data, headers={"Content-Type": "application/json"})
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def _call(self, path: str, body: Optional[dict] = None) -> dict:
+        with self._open(path, body) as response:
+            return json.loads(response.read())
+
+    # Spans here cover the HTTP round trip; the server traces the stages inside it.
+    def plan(self, query: str) -> dict:
+        with tracing.span("planner", remote=True):
+            return self._call("/v1/plan", {"query": query})
+
+    def retrieve(self, query: str, user_profile: dict) -> dict:
+        with tracing.span("retriever", remote=True):
+            return self._call("/v1/retrieve", {"query": query, "profile": user_profile})
+
+    def candidates(self, query: str) -> dict:
+        with tracing.span("retriever", remote=True):
+            return self._call("/v1/candidates", {"query": query})
+
+    def select(self, query: str, candidates: dict, user_profile: dict) -> dict:
+        with tracing.span("select", remote=True):
+            return self._call("/v1/select", {"query": query, "candidates": candidates, "profile": user_profile})
+
+    def evaluate(self, hits: List[dict], user_profile: dict) -> dict:
+        with tracing.span("evaluator", remote=True):
+            return self._call("/v1/evaluate", {"hits": hits, "profile": user_profile})
+
+    def synthesize(self, query: str, approved: List[dict], user_profile: dict, bypass_cache: bool = False) -> Iterator[dict]:
+        started = time.perf_counter()
+        body = {"query": query, "approved": approved, "profile": user_profile, "bypass_cache": bypass_cache}
+        event: dict = {}
+        with self._open("/v1/synthesize", body) as response:
+            for line in response:
+                if line.strip():
+                    event = json.loads(line)
+                    yield event
+        tracing.record("synthesis", started, remote=True, **{key: event[key] for key in tracing.TOKEN_ATTRIBUTES if key in event})
+
+    def run(self, query: str, user_profile: dict, bypass_cache: bool = False) -> dict:
+        return self._call("/v1/query", {"query": query, "profile": user_profile, "bypass_cache": bypass_cache})
+
+    def stats(self) -> dict:
+        return self._call("/v1/stats")
+
+    def metrics(self) -> str:
+        with self._open("/metrics") as response:
+            return response.read().decode("utf-8")
+
+def make_handler(pipeline: SafeMedsPipeline):
+    class PipelineHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body: dict) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/healthz":
+                self._send_json(200, {"status": "ok"})
+            elif self.path == "/v1/stats":
+                self._send_json(200, pipeline.stats())
+            elif self.path == "/v1/metrics":
+                self._send_json(200, tracing.METRICS.snapshot())
+            elif self.path == "/metrics":
+                data = tracing.METRICS.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            # No-op unless SAFEMEDS_TRACING=1; then every request feeds /metrics (and TRACE_LOG_PATH).
+            with tracing.trace(self.path):
+                self._handle_post()
+
+        def _handle_post(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                profile = body.get("profile", {})
+                if self.path == "/v1/synthesize":
+                    # Newline-delimited JSON events, flushed as the LLM streams.
+                    events = pipeline.synthesize(body["query"], body["approved"], profile, bool(body.get("bypass_cache")))
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.end_headers()
+                    for event in events:
+                        self.wfile.write((json.dumps(event) + "\n").encode("utf-8"))
+                    return
+                if self.path == "/v1/plan":
+                    result = pipeline.plan(body["query"])
+                elif self.path == "/v1/retrieve":
+                    result = pipeline.retrieve(body["query"], profile)
+                elif self.path == "/v1/candidates":
+                    result = pipeline.candidates(body["query"])
+                elif self.path == "/v1/select":
+                    result = pipeline.select(body["query"], body["candidates"], profile)
+                elif self.path == "/v1/evaluate":
+                    result = pipeline.evaluate(body["hits"], profile)
+                elif self.path == "/v1/query":
+                    result = pipeline.run(body["query"], profile, bool(body.get("bypass_cache")))
+                else:
+                    self._send_json(404, {"error": f"Unknown path {self.path}"})
+                    return
+            except (KeyError, ValueError) as e:
+                self._send_json(400, {"error": f"Bad request: {e}"})
+                return
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+                return
+            self._send_json(200, result)
+
+        def log_message(self, format, *args):
+            pass
+
+    return PipelineHandler
+
+def serve(pipeline: SafeMedsPipeline, host: str = PIPELINE_HOST, port: int = PIPELINE_PORT) -> ThreadingHTTPServer:
+    """Starts a threaded HTTP server (one thread per request). Call serve_forever() on the result."""
+    server = ThreadingHTTPServer((host, port), make_handler(pipeline))
+    server.daemon_threads = True
+    return server
+
+def serve_workers(make_pipeline: Callable[[], SafeMedsPipeline], workers: int, host: str = PIPELINE_HOST, port: int = PIPELINE_PORT) -> None:
+    """
+    Pre-fork server: binds once, then forks `workers` processes that accept on the
+    shared socket. Each builds its own pipeline after the fork (threads do not
+    survive fork); the snapshot backend maps the same files, so the index is held
+    once in the page cache however many workers run. Blocks until all exit.
+    """
+    server = ThreadingHTTPServer((host, port), BaseHTTPRequestHandler)
+    server.daemon_threads = True
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.RequestHandlerClass = make_handler(make_pipeline())
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os._exit(0)
+        children.append(pid)
+    server.socket.close()
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        # Ctrl+C reaches the whole process group, but a plain `kill -INT` only the parent.
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGINT)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=PIPELINE_HOST)
+    parser.add_argument("--port", type=int, default=PIPELINE_PORT)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE, help="Most queries per encode / batch search call.")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS, help="Longest a query waits for its batch to fill.")
+    parser.add_argument("--workers", type=int, default=PIPELINE_WORKERS, help="Server processes (needs VECTOR_BACKEND=snapshot).")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        if VECTOR_BACKEND != "snapshot":
+            parser.error("--workers > 1 needs VECTOR_BACKEND=snapshot (embedded Qdrant allows one process per qdrant_db).")
+        if not hasattr(os, "fork"):
+            parser.error("--workers > 1 needs os.fork (Linux/macOS).")
+        print(f"--- 🧠 Starting {args.workers} workers on http://{args.host}:{args.port} (snapshot backend) ---")
+        serve_workers(lambda: SafeMedsPipeline(max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms), args.workers, args.host, args.port)
+        raise SystemExit(0)
+
+    print("--- 🧠 Loading pipeline (encoder, caches, alias index)... ---")
+    server = serve(SafeMedsPipeline(max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms), args.host, args.port)
+    print(f"--- ✅ SafeMeds pipeline serving on http://{args.host}:{args.port} (batch {args.max_batch_size}, wait {args.max_wait_ms} ms) ---")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
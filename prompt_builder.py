@@ -0,0 +1,147 @@
+import os
+import re
+import logging
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+# Whole pharmacist prompt (system + user message), in estimated tokens.
+PROMPT_TOKEN_BUDGET: int = int(os.getenv("PROMPT_TOKEN_BUDGET", "1200"))
+# Side-effect terms matching these are kept first when a list has to be cut.
+SEVERE_SIDE_EFFECTS = re.compile(
+    r"sever|serious|fatal|death|bleed|hemorrhag|liver|hepat|kidney|renal|heart|cardi|stroke|seizure|"
+    r"anaphyla|allerg|swelling of|breath|suicid|birth defect|pregnan|fetal|coma|ulcer|blood",
+    re.IGNORECASE,
+)
+# Rough BPE stand-in: words split into 4-character pieces, plus punctuation.
+TOKEN_PATTERN = re.compile(r"\w{1,4}|[^\w\s]")
+
+# Static system prompts. Per-request data lives only in the user message, so
+# these stay byte-identical across calls and the provider can cache the prefix.
+PHARMACIST_SYSTEM_PROMPT = """You are SafeMeds AI (Team 651), a clinical decision support agent.
+
+CRITICAL INSTRUCTION: "The Counter-Factual Safety Check"
+If you find a drug that matches the user's condition PERFECTLY but is blocked by Safety Rules (e.g. Accutane for Acne, but user is Pregnant):
+1. DO NOT recommend it.
+2. EXPLICITLY state: "I identified a standard treatment ([Drug Name]), but I have intervened to block it due to [Safety Constraint]."
+3. Suggest a safe alternative if available.
+
+STANDARD RULES:
+1. Match Name or Condition.
+2. Be concise.
+3. Use only the drugs listed under Available Drug Data, and respect the User Context.
+
+OUTPUT FORMAT:
+**Clinical Decision:** [Approved/Intervention]
+**Recommendation:** [Drug Name or 'None']
+**Reasoning:** [Explain the safety logic]
+**Safety Note:** [Warnings]"""
+
+INTENT_SYSTEM_PROMPT = """You are a strict medical intent classifier. Return exactly ONE label: EMERGENCY_ALERT, SEARCH_DRUGS, BLOCK_ADVERSARIAL or CLARIFY_SYMPTOMS.
+
+Rules, in priority order:
+1. EMERGENCY_ALERT if the input mentions breathing trouble, chest pain, unconsciousness, severe bleeding, a serious allergic reaction or life-threatening language. Emergency ALWAYS overrides the symptom rule.
+2. SEARCH_DRUGS if the input contains ANY real symptom word, even one. Never treat symptoms as vague. Symptoms include (but are not limited to): cough, fever, headache, pain, nausea, vomiting, cold, flu, acne, rash, swelling, infection, sore throat, dizziness, fatigue, weakness, stomach ache, diarrhea, allergy, itching.
+3. BLOCK_ADVERSARIAL ONLY if no symptom, body part or condition is mentioned and the intent is clearly drug-seeking or harmful. Examples: "Give me any drug", "I want pills", "Recommend something strong", "I need a high", "Just prescribe me something", "Give me medicine" (without symptoms), "How to overdose", "How to make drugs".
+4. CLARIFY_SYMPTOMS ONLY if no symptom, body part or condition is mentioned at all. Examples: "I feel bad", "I am sick", "Something is wrong", "My body feels off".
+
+Return ONLY the label."""
+
+def estimate_tokens(text: str) -> int:
+    return len(TOKEN_PATTERN.findall(text))
+
+def compact(text) -> str:
+    """Collapses every run of whitespace (newlines, indentation) to one space."""
+    return re.sub(r"\s+", " ", str(text)).strip()
+
+def prioritized_side_effects(side_effects: str) -> List[str]:
+    """Unique side-effect terms, severe ones first, otherwise in source order."""
+    # Commas inside parentheses belong to the term: "allergic reaction (rash, swelling)".
+    terms = list(dict.fromkeys(term for term in (compact(t).lower() for t in re.split(r"[,;](?![^()]*\))", side_effects)) if term))
+    return [t for t in terms if SEVERE_SIDE_EFFECTS.search(t)] + [t for t in terms if not SEVERE_SIDE_EFFECTS.search(t)]
+
+def fit_side_effects(terms: List[str], budget: int) -> Tuple[str, bool]:
+    """Joins as many whole terms as fit in `budget` tokens; returns (text, truncated)."""
+    kept: List[str] = []
+    used = 0
+    for term in terms:
+        cost = estimate_tokens(term) + 1
+        if kept and used + cost > budget:
+            return ", ".join(kept) + ", …", True
+        kept.append(term)
+        used += cost
+    return ", ".join(kept), False
+
+def drug_line(payload: dict, side_effects: str) -> str:
+    line = (
+        f"- {compact(payload.get('drug_name', 'Unknown'))} | treats: {compact(payload.get('condition', 'Unknown'))}"
+        f" | pregnancy category: {compact(payload.get('pregnancy_category', 'Unknown'))}"
+    )
+    return line + (f" | side effects: {side_effects}" if side_effects else "")
+
+def user_context(user_profile: dict) -> str:
+    return (
+        "User Context:\n"
+        f"- Pregnancy Status: {'YES (High Risk)' if user_profile['pregnancy_risk'] else 'No'}\n"
+        f"- Rx Preference: {'Any' if user_profile['prescription_only_ok'] else 'OTC Only'}\n"
+        f"- Other Conditions: {', '.join(user_profile.get('conditions', ())) or 'None'}"
+    )
+
+def build_pharmacist_messages(user_query: str, points: list, user_profile: dict, budget: int = PROMPT_TOKEN_BUDGET) -> Tuple[List[dict], Dict[str, int]]:
+    """
+    Pharmacist prompt within `budget` estimated tokens. Drugs are deduplicated by
+    name (the first, best-ranked hit wins) and kept in rank order; the
+    lowest-ranked are dropped only if their one-line summaries do not fit. Side
+    effects share the rest and are cut term by term, severe terms last; at least
+    the most severe term of every drug is always kept.
+    """
+    header = f"{user_context(user_profile)}\n\nUser Query: {compact(user_query)}\n\nAvailable Drug Data:\n"
+    remaining = budget - estimate_tokens(PHARMACIST_SYSTEM_PROMPT) - estimate_tokens(header)
+
+    drugs: Dict[str, dict] = {}
+    for point in points:
+        payload = point.payload
+        drugs.setdefault(compact(payload.get("drug_name", "Unknown")).lower(), payload)
+
+    payloads = list(drugs.values())
+    base_costs = [estimate_tokens(drug_line(payload, "")) + 1 for payload in payloads]
+    # Drop the lowest-ranked drugs until every kept drug's one-line summary fits.
+    kept = len(payloads)
+    while kept > 1 and sum(base_costs[:kept]) > remaining:
+        kept -= 1
+
+    # What is left goes to side effects: an equal share per drug, unused share carries over.
+    spare = remaining - sum(base_costs[:kept])
+    lines: List[str] = []
+    truncated = 0
+    for i, payload in enumerate(payloads[:kept]):
+        side_effects, cut = fit_side_effects(prioritized_side_effects(str(payload.get("side_effects", ""))), max(0, spare) // (kept - i))
+        line = drug_line(payload, side_effects)
+        lines.append(line)
+        truncated += cut
+        spare -= estimate_tokens(line) + 1 - base_costs[i]
+
+    user_message = header + ("\n".join(lines) if lines else "None")
+    stats = {
+        "prompt_tokens_est": estimate_tokens(PHARMACIST_SYSTEM_PROMPT) + estimate_tokens(user_message),
+        "drugs": len(lines),
+        "duplicates_removed": len(points) - len(payloads),
+        "drugs_dropped": len(payloads) - len(lines),
+        "side_effects_truncated": truncated,
+    }
+    logger.info("pharmacist prompt: %(prompt_tokens_est)d est. tokens, %(drugs)d drugs (%(drugs_dropped)d dropped, %(duplicates_removed)d duplicates, %(side_effects_truncated)d side-effect lists cut)", stats)
+    return [{"role": "system", "content": PHARMACIST_SYSTEM_PROMPT}, {"role": "user", "content": user_message}], stats
+
+def build_intent_messages(query: str) -> List[dict]:
+    messages = [{"role": "system", "content": INTENT_SYSTEM_PROMPT}, {"role": "user", "content": f'User input: "{compact(query)}"'}]
+    logger.info("intent prompt: %d est. tokens", estimate_tokens(INTENT_SYSTEM_PROMPT) + estimate_tokens(messages[1]["content"]))
+    return messages
+
+def build_format_correction(messages: List[dict], previous_answer: str, missing_sections: List[str]) -> List[dict]:
+    """Follow-up turn asking the model to rewrite an answer that skipped OUTPUT FORMAT headings."""
+    correction = (
+        f"Your answer is missing these required headings: {', '.join(missing_sections)}. "
+        "Rewrite the whole answer using exactly the four OUTPUT FORMAT headings, in order."
+    )
+    return messages + [{"role": "assistant", "content": previous_answer}, {"role": "user", "content": correction}]
@@ -0,0 +1,76 @@
+import os
+import re
+import logging
+from typing import Any, Dict, List, Tuple
+from intent_rules import mentions_symptom
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+# Set QUERY_DECOMPOSITION=0 to always search with the whole query as one vector.
+QUERY_DECOMPOSITION: bool = os.getenv("QUERY_DECOMPOSITION", "1") == "1"
+MAX_SUB_QUERIES: int = 4
+# Standard reciprocal-rank-fusion constant: damps the gap between the top ranks.
+RRF_K: int = 60
+
+SPLIT_PATTERN = re.compile(r"\s*(?:[,;&+/]|\b(?:and|or|plus|with|also|as well as|along with)\b)\s*")
+# Patient context is enforced by the profile filters, not by similarity search.
+CONTEXT_PATTERN = re.compile(r"\b(?:pregnan(?:t|cy)|breast ?feeding|nursing|trimester)\b")
+NEGATED_PATTERN = re.compile(r"^(?:no|not|without|never|but no)\b")
+# "sore throat but no cough": what follows a negation is not searched for.
+NEGATED_TAIL_PATTERN = re.compile(r"\b(?:but )?(?:no|not|without|never)\b.*$")
+FILLER_WORDS = {
+    "i", "im", "i'm", "ive", "i've", "me", "my", "am", "is", "are", "have", "has", "had", "got",
+    "getting", "having", "feel", "feeling", "suffering", "from", "a", "an", "the", "some", "really",
+    "very", "also", "while", "been", "currently", "since", "today", "need", "something", "for",
+}
+
+def _strip(segment: str) -> str:
+    words = CONTEXT_PATTERN.sub(" ", NEGATED_TAIL_PATTERN.sub("", segment)).split()
+    return " ".join(word for word in words if word.strip(".!?'\"") not in FILLER_WORDS).strip(" .!?")
+
+def decompose_query(query: str) -> Tuple[List[str], List[str]]:
+    """
+    Splits a compound query ("migraine and nausea while pregnant") into one
+    sub-query per symptom or condition (["migraine", "nausea"]). Fragments
+    without a symptom, and negated ones, stay attached to the previous
+    sub-query. Returns (sub_queries, dropped): sub_queries is [query] unchanged
+    unless at least two symptoms are found; dropped lists the symptoms past
+    MAX_SUB_QUERIES, which are not searched.
+    """
+    if not QUERY_DECOMPOSITION:
+        return [query], []
+    parts: List[str] = []
+    for segment in SPLIT_PATTERN.split(query.lower().replace("’", "'")):
+        segment = segment.strip()
+        if not segment:
+            continue
+        if mentions_symptom(segment) and not NEGATED_PATTERN.match(segment):
+            parts.append(segment)
+        elif parts:
+            parts[-1] = f"{parts[-1]} {segment}"
+    sub_queries = list(dict.fromkeys(part for part in map(_strip, parts) if part))
+    if len(sub_queries) < 2:
+        return [query], []
+    dropped = sub_queries[MAX_SUB_QUERIES:]
+    if dropped:
+        logger.warning("query names %d symptoms; only the first %d are searched, dropped: %s", len(sub_queries), MAX_SUB_QUERIES, ", ".join(dropped))
+    return sub_queries[:MAX_SUB_QUERIES], dropped
+
+def reciprocal_rank_fusion(ranked_lists: List[List[dict]], limit: int, k: int = RRF_K) -> List[dict]:
+    """
+    Merges ranked hit lists ({"id", "score", "payload"}) by the sum of
+    1 / (k + rank) over the lists each point appears in. A point found by
+    several sub-queries appears once, with its best similarity as "score" and
+    the fused value as "rrf_score". Ties keep list order, so the top hit of
+    every list comes before any list's second.
+    """
+    scores: Dict[Any, float] = {}
+    best: Dict[Any, dict] = {}
+    for hits in ranked_lists:
+        for rank, hit in enumerate(hits, start=1):
+            scores[hit["id"]] = scores.get(hit["id"], 0.0) + 1.0 / (k + rank)
+            if hit["id"] not in best or hit["score"] > best[hit["id"]]["score"]:
+                best[hit["id"]] = hit
+    order = sorted(scores, key=lambda point_id: -scores[point_id])[:limit]
+    return [{**best[point_id], "rrf_score": scores[point_id]} for point_id in order]
@@ -0,0 +1,75 @@
+import re
+import numpy as np
+from typing import Dict, Iterable, List, Optional
+from data_processor import get_golden_dataset
+
+# Bit positions are part of the stored index format: only ever APPEND new tags.
+SAFETY_TAGS: List[str] = [
+    "pregnancy", "kidney_disease", "liver_disease", "stomach_ulcer", "bleeding_disorder",
+    "asthma", "hypertension", "children", "alcohol_use_disorder", "respiratory_issues",
+    "history_of_addiction", "history_of_kidney_stones", "penicillin_allergy", "heart_arrhythmia",
+    "tendon_issues", "myasthenia_gravis", "diabetes", "history_of_angioedema", "heart_failure",
+    "bradycardia", "high_fall_risk", "glaucoma", "prostate_issues", "elderly",
+    "taking_other_medications", "sun_sensitivity",
+]
+TAG_BITS: Dict[str, int] = {tag: 1 << position for position, tag in enumerate(SAFETY_TAGS)}
+
+# Evaluator rule: only FDA categories A, B and N are acceptable in pregnancy.
+PREGNANCY_SAFE_CATEGORIES = {"A", "B", "N"}
+
+def tags_to_mask(tags: Iterable[str]) -> int:
+    mask = 0
+    for tag in tags:
+        mask |= TAG_BITS.get(tag, 0)
+    return mask
+
+def mask_to_tags(mask: int) -> List[str]:
+    return [tag for tag, bit in TAG_BITS.items() if mask & bit]
+
+def drug_names_from_text(text: str) -> List[str]:
+    """'Ibuprofen (Advil, Motrin): NSAID ...' -> ['ibuprofen', 'advil', 'motrin']"""
+    head = text.split(":", 1)[0]
+    return [name.strip().lower() for name in re.split(r"[(),]", head) if name.strip()]
+
+def build_golden_tag_index() -> Dict[str, int]:
+    """Maps every generic and brand name in the golden dataset to its tag mask."""
+    index: Dict[str, int] = {}
+    for entry in get_golden_dataset():
+        mask = tags_to_mask(entry["safety_tags"])
+        for name in drug_names_from_text(entry["text"]):
+            index[name] = index.get(name, 0) | mask
+    return index
+
+_GOLDEN_TAGS: Optional[Dict[str, int]] = None
+
+def drug_safety_mask(drug_name: str, pregnancy_category: str) -> int:
+    """Compiled contraindication mask for one drug (golden tags + FDA pregnancy category)."""
+    global _GOLDEN_TAGS
+    if _GOLDEN_TAGS is None:
+        _GOLDEN_TAGS = build_golden_tag_index()
+    mask = _GOLDEN_TAGS.get(str(drug_name).strip().lower(), 0)
+    if str(pregnancy_category) not in PREGNANCY_SAFE_CATEGORIES:
+        mask |= TAG_BITS["pregnancy"]
+    return mask
+
+def profile_mask(user_profile: dict) -> int:
+    mask = tags_to_mask(user_profile.get("conditions", ()))
+    if user_profile.get("pregnancy_risk"):
+        mask |= TAG_BITS["pregnancy"]
+    return mask
+
+def point_masks(points) -> np.ndarray:
+    # Points indexed before safety masks existed fall back to an on-the-fly mask.
+    return np.fromiter(
+        (
+            hit.payload["safety_mask"] if "safety_mask" in hit.payload
+            else drug_safety_mask(hit.payload.get("drug_name", ""), hit.payload.get("pregnancy_category", "N"))
+            for hit in points
+        ),
+        dtype=np.int64,
+        count=len(points),
+    )
+
+def contraindicated(masks: np.ndarray, patient_mask: int) -> np.ndarray:
+    """One vectorized AND over all candidates: True where any patient constraint is hit."""
+    return (masks & np.int64(patient_mask)) != 0
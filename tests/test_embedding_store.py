@@ -0,0 +1,27 @@
+import numpy as np
+from embedding_store import EmbeddingStore
+
+DIM = 8
+
+def vectors(n, start=0):
+    return np.arange(start * DIM, (start + n) * DIM, dtype=np.float32).reshape(n, DIM)
+
+def test_append_after_torn_write_stays_row_aligned(tmp_path):
+    store = EmbeddingStore("test-model", dim=DIM, root=str(tmp_path))
+    store.add(["a", "b"], vectors(2))
+    # Simulate a crash halfway through the next append: half a vector, half a manifest line.
+    with open(store.vectors_path, "ab") as f:
+        f.write(vectors(1, 2).tobytes()[: DIM * 2])
+    with open(store.manifest_path, "a", encoding="utf-8") as f:
+        f.write('{"hash": "c", "ro')
+
+    reopened = EmbeddingStore("test-model", dim=DIM, root=str(tmp_path))
+    assert len(reopened) == 2
+    reopened.add(["d"], vectors(1, 3))
+
+    final = EmbeddingStore("test-model", dim=DIM, root=str(tmp_path))
+    assert len(final) == 3
+    matrix = final.matrix()
+    assert matrix.shape == (3, DIM)
+    np.testing.assert_array_equal(matrix[final._rows["d"]], vectors(1, 3)[0])
+    np.testing.assert_array_equal(matrix[final._rows["b"]], vectors(1, 1)[0])
@@ -0,0 +1,72 @@
+import pytest
+from intent_rules import classify_intent_locally, looks_urgent
+
+@pytest.mark.parametrize("query", [
+    "I think I am having a stroke",
+    "my dad is having a stroke",
+    "what are stroke symptoms, her face is drooping",
+    "sudden slurred speech and confusion",
+    "I can't breathe",
+    "I'm having a heart attack",
+    "my husband is having a seizure",
+    "he is seizing",
+    "I can't stop bleeding",
+    "she's unconscious and won't wake up",
+])
+def test_emergencies(query):
+    assert classify_intent_locally(query) == "EMERGENCY_ALERT"
+
+@pytest.mark.parametrize("query", [
+    "I had a stroke of bad luck, my back hurts",
+    "stroke of genius: what helps a headache",
+])
+def test_figurative_stroke_is_not_an_emergency(query):
+    assert classify_intent_locally(query) != "EMERGENCY_ALERT"
+
+@pytest.mark.parametrize("query", [
+    "I take aspirin to prevent a heart attack, can I use it for my headache?",
+    "what medication helps prevent seizures",
+    "I have a seizure disorder, which painkiller is safe?",
+    "my son has a history of seizures and a fever",
+    "does warfarin cause severe bleeding",
+    "I fainted yesterday but feel fine now, headache though",
+    "what to do if someone is having a seizure",
+])
+def test_mentioned_but_not_happening_now_is_left_to_the_llm(query):
+    assert classify_intent_locally(query) is None
+    # Still moved up the Groq queue, just not answered locally.
+    assert looks_urgent(query)
+
+def test_negated_emergency_is_left_to_the_llm():
+    assert classify_intent_locally("no chest pain, just a cough") is None
+
+@pytest.mark.parametrize("query", [
+    "Give me any drug",
+    "I want pills",
+    "Recommend something strong",
+    "I need a high",
+    "Just prescribe me something",
+    "How to overdose",
+    "How to make drugs",
+    "give me medicine",
+    "how do i get high on codeine",
+    "please give me some pills now!",
+])
+def test_drug_seeking_is_blocked(query):
+    assert classify_intent_locally(query) == "BLOCK_ADVERSARIAL"
+
+@pytest.mark.parametrize("query", [
+    "I need meds for my back",
+    "I need pills for my knee",
+    "give me medicine for my stomach",
+    "i want meds for my eyes",
+    "I need meds for my son",
+    "give me some medicine for my toddler",
+    "recommend something strong for my back",
+    "how do i get high blood sugar down",
+])
+def test_requests_naming_a_body_part_or_patient_are_not_blocked(query):
+    assert classify_intent_locally(query) != "BLOCK_ADVERSARIAL"
+
+def test_overdose_question_with_a_symptom_is_left_to_the_llm():
+    assert classify_intent_locally("How to overdose on pain pills") is None
@@ -0,0 +1,78 @@
+import io
+import wave
+import asyncio
+import weakref
+import numpy as np
+import pytest
+import llm_engine
+from benchmarks import fake_groq
+
+@pytest.fixture
+def groq_server(monkeypatch):
+    """Local stand-in for the Groq API, with fresh shared clients pointed at it."""
+    server = fake_groq.start(latency_ms=0, token_ms=0)
+    monkeypatch.setattr(llm_engine, "GROQ_BASE_URL", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(llm_engine, "GROQ_API_KEY", "gsk_test")
+    monkeypatch.setenv("GROQ_API_KEY", "gsk_test")
+    monkeypatch.setattr(llm_engine, "_client", None)
+    monkeypatch.setattr(llm_engine, "_async_clients", weakref.WeakKeyDictionary())
+    yield server
+    if llm_engine._client is not None:
+        llm_engine._client.close()
+    server.shutdown()
+
+PROFILE = {"pregnancy_risk": False, "prescription_only_ok": True, "conditions": ()}
+
+def test_sync_calls_share_one_pooled_connection(groq_server):
+    client = llm_engine.get_client()
+    for i in range(5):
+        # Distinct queries the local rules cannot settle, so each one reaches the server.
+        assert llm_engine.analyze_intent(f"tell me about remedy number {i}") == "SEARCH_DRUGS"
+        assert "**Clinical Decision:**" in llm_engine.generate_pharmacist_response(f"question {i}", [], PROFILE)
+    assert llm_engine.get_client() is client
+    assert groq_server.counts["requests"] == 10
+    assert groq_server.counts["connections"] == 1
+
+def test_async_calls_share_one_client_per_event_loop(groq_server):
+    async def calls():
+        client = llm_engine.get_async_client()
+        for i in range(5):
+            assert await llm_engine.aanalyze_intent(f"ask about remedy number {i}") == "SEARCH_DRUGS"
+            assert "**Clinical Decision:**" in await llm_engine.agenerate_pharmacist_response(f"async question {i}", [], PROFILE)
+        assert llm_engine.get_async_client() is client
+        await client.close()
+
+    asyncio.run(calls())
+    assert groq_server.counts["requests"] == 10
+    assert groq_server.counts["connections"] == 1
+
+def wav_bytes(rate, width, seconds=1.0):
+    """A 440 Hz tone as PCM WAV."""
+    tone = np.sin(2 * np.pi * 440 * np.arange(int(rate * seconds)) / rate)
+    frames = (tone * 100 + 128).astype(np.uint8) if width == 1 else (tone * 10000).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(width)
+        wav.setframerate(rate)
+        wav.writeframes(frames.tobytes())
+    return buffer.getvalue()
+
+def test_repeated_transcription_skips_preprocessing(groq_server, monkeypatch):
+    calls = []
+    preprocess = llm_engine.preprocess_audio
+    monkeypatch.setattr(llm_engine, "preprocess_audio", lambda data: calls.append(len(data)) or preprocess(data))
+    monkeypatch.setattr(llm_engine, "_transcription_cache", llm_engine.LRUCache(4))
+    recording = wav_bytes(44100, 2)
+    for _ in range(3):
+        text, error = llm_engine.transcribe_audio(io.BytesIO(recording))
+        assert error is None and text
+    assert len(calls) == 1
+    assert groq_server.counts["requests"] == 1
+
+def test_upload_keeps_original_when_preprocessing_does_not_shrink_it(monkeypatch):
+    monkeypatch.setattr(llm_engine, "AUDIO_PREPROCESSING", True)
+    small = wav_bytes(8000, 1)
+    assert llm_engine._prepare_upload("voice.wav", small) == ("voice.wav", small)
+    _, upload = llm_engine._prepare_upload("voice.wav", wav_bytes(44100, 2))
+    assert len(upload) < len(wav_bytes(44100, 2))
@@ -0,0 +1,111 @@
+import zlib
+import numpy as np
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.models import Distance, PointStruct, VectorParams
+from pipeline import COLLECTION_NAME, SafeMedsPipeline
+from safety_tags import tags_to_mask
+
+DIM = 16
+
+class HashingEncoder:
+    """Deterministic bag-of-words encoder, so no model has to be downloaded."""
+    backend = "hashing"
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        vectors = np.zeros((len(texts), DIM), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in str(text).lower().split():
+                vectors[row, zlib.crc32(word.encode()) % DIM] += 1.0
+        vectors[:, 0] += 1e-3
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+DRUGS = [
+    # (drug_name, condition, pregnancy_category, safety_tags)
+    ("Acetaminophen", "pain fever", "B", ["liver_disease", "alcohol_use_disorder"]),
+    ("drug101", "pain relief", "B", []),
+    ("drug102", "fever pain", "A", []),
+    ("drug103", "pain", "X", ["pregnancy"]),
+]
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    # The query cache and collection stats are read from the working directory.
+    monkeypatch.chdir(tmp_path)
+    encoder = HashingEncoder()
+    client = QdrantClient(":memory:")
+    client.create_collection(COLLECTION_NAME, vectors_config=VectorParams(size=DIM, distance=Distance.COSINE))
+    vectors = encoder.encode([f"{name} {condition}" for name, condition, _, _ in DRUGS])
+    client.upsert(COLLECTION_NAME, points=[
+        PointStruct(id=i, vector=vector.tolist(), payload={
+            "drug_name": name, "condition": condition, "pregnancy_category": category, "rx_otc": "OTC",
+            "safety_tags": tags, "safety_mask": tags_to_mask(tags) | (tags_to_mask(["pregnancy"]) if category == "X" else 0),
+        })
+        for i, ((name, condition, category, tags), vector) in enumerate(zip(DRUGS, vectors))
+    ])
+    pipeline = SafeMedsPipeline(client=client, encoder=encoder, max_wait_ms=0)
+    yield pipeline
+    pipeline.embed_batcher.close()
+    pipeline.search_batcher.close()
+    client.close()
+
+HEALTHY = {"pregnancy_risk": False, "prescription_only_ok": True, "conditions": []}
+AT_RISK = {"pregnancy_risk": True, "prescription_only_ok": True, "conditions": ["liver_disease"]}
+
+def names(hits):
+    return {hit["payload"]["drug_name"] for hit in hits}
+
+def test_named_drug_resolves_by_alias(pipeline):
+    retrieval = pipeline.retrieve("is tylenol ok", HEALTHY)
+    assert retrieval["plan"]["strategy"] == "alias lookup"
+    assert names(retrieval["hits"]) == {"Acetaminophen"}
+
+def test_contraindicated_named_drug_falls_back_to_safe_alternatives(pipeline):
+    retrieval = pipeline.retrieve("is tylenol ok", AT_RISK)
+    assert retrieval["plan"]["strategy"].endswith("(named drug contraindicated)")
+    assert names(retrieval["hits"]) == {"drug101", "drug102"}
+
+def test_select_from_alias_candidates_falls_back_to_safe_alternatives(pipeline):
+    candidates = pipeline.candidates("is tylenol ok")
+    assert names(candidates["hits"]) == {"Acetaminophen"}
+    assert names(pipeline.select("is tylenol ok", candidates, HEALTHY)["hits"]) == {"Acetaminophen"}
+    assert names(pipeline.select("is tylenol ok", candidates, AT_RISK)["hits"]) == {"drug101", "drug102"}
+
+def test_unsearched_symptoms_are_surfaced_in_the_plan(pipeline):
+    query = "cough, fever, headache, nausea, rash and itching"
+    assert pipeline.retrieve(query, HEALTHY)["plan"]["dropped_sub_queries"] == ["rash", "itching"]
+    candidates = pipeline.candidates(query)
+    assert pipeline.select(query, candidates, AT_RISK)["plan"]["dropped_sub_queries"] == ["rash", "itching"]
+
+WELL_FORMED = "**Clinical Decision:** Approved\n**Recommendation:** drug101\n**Reasoning:** Safe.\n**Safety Note:** None."
+
+def scripted_answers(monkeypatch, *answers):
+    """Replaces the LLM stream with canned answers, one per call; returns the call log."""
+    calls = []
+
+    def fake_stream(query, points, profile, timings=None, previous_answer=None, missing_sections=None):
+        calls.append((previous_answer, missing_sections))
+        text = answers[len(calls) - 1]
+        timings["missing_sections"] = [s for s in ("**Clinical Decision:**", "**Recommendation:**", "**Reasoning:**", "**Safety Note:**") if s not in text]
+        yield text
+
+    monkeypatch.setattr("pipeline.stream_pharmacist_response", fake_stream)
+    return calls
+
+def test_malformed_answer_is_regenerated_once_and_only_the_fix_is_cached(pipeline, monkeypatch):
+    calls = scripted_answers(monkeypatch, "Take drug101.", WELL_FORMED)
+    approved = pipeline.evaluate(pipeline.retrieve("pain relief", HEALTHY)["hits"], HEALTHY)["approved"]
+    events = list(pipeline.synthesize("pain relief", approved, HEALTHY))
+    assert events[1] == {"retry": True, "missing_sections": ["**Clinical Decision:**", "**Recommendation:**", "**Reasoning:**", "**Safety Note:**"]}
+    assert calls[1] == ("Take drug101.", events[1]["missing_sections"])
+    assert events[-1]["retried"] and events[-1]["missing_sections"] == []
+    assert pipeline.run("pain relief", HEALTHY)["response"] == WELL_FORMED  # served from the response cache
+    assert len(calls) == 2
+
+def test_answer_still_malformed_after_retry_is_not_cached(pipeline, monkeypatch):
+    calls = scripted_answers(monkeypatch, "Take drug101.", "Still drug101.", WELL_FORMED)
+    result = pipeline.run("pain relief", HEALTHY)
+    assert result["response"] == "Still drug101."
+    assert result["synthesis"]["missing_sections"]
+    assert pipeline.run("pain relief", HEALTHY)["response"] == WELL_FORMED
+    assert len(calls) == 3
@@ -0,0 +1,23 @@
+import logging
+from query_decomposer import MAX_SUB_QUERIES, decompose_query, reciprocal_rank_fusion
+
+def test_splits_symptoms_and_drops_patient_context():
+    assert decompose_query("migraine and nausea while pregnant") == (["migraine", "nausea"], [])
+
+def test_single_symptom_query_is_unchanged():
+    assert decompose_query("headache and no fever") == (["headache and no fever"], [])
+
+def test_symptoms_past_the_limit_are_reported(caplog):
+    query = "cough, fever, headache, nausea, rash and itching"
+    with caplog.at_level(logging.WARNING, logger="query_decomposer"):
+        sub_queries, dropped = decompose_query(query)
+    assert len(sub_queries) == MAX_SUB_QUERIES
+    assert dropped == ["rash", "itching"]
+    assert "rash, itching" in caplog.text
+
+def test_rank_fusion_interleaves_lists_and_dedups():
+    first = [{"id": 1, "score": 0.9}, {"id": 2, "score": 0.8}]
+    second = [{"id": 3, "score": 0.7}, {"id": 1, "score": 0.95}]
+    fused = reciprocal_rank_fusion([first, second], limit=3)
+    assert [hit["id"] for hit in fused] == [1, 3, 2]
+    assert fused[0]["score"] == 0.95
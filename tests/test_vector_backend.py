@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from vector_backend import NumpyVectorIndex, write_numpy_index
+
+ROWS, DIM = 500, 32
+PROFILES = [
+    {"pregnancy_risk": False, "prescription_only_ok": True, "conditions": ()},
+    {"pregnancy_risk": True, "prescription_only_ok": False, "conditions": ("liver_disease",)},
+]
+
+@pytest.fixture(scope="module")
+def index_path(tmp_path_factory):
+    rng = np.random.default_rng(7)
+    vectors = rng.normal(size=(ROWS, DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    payloads = [
+        {
+            "drug_name": f"drug{i}", "pregnancy_category": "BXC"[i % 3], "rx_otc": ["OTC", "Rx"][i % 2],
+            "safety_tags": ["liver_disease"] if i % 5 == 0 else [], "safety_mask": 4 if i % 5 == 0 else 0,
+        }
+        for i in range(ROWS)
+    ]
+    path = str(tmp_path_factory.mktemp("numpy_index"))
+    write_numpy_index(path, list(range(ROWS)), vectors, payloads)
+    return path, vectors
+
+def ids(results):
+    return [point.id for point in results.points]
+
+@pytest.mark.parametrize("quantization", [None, "int8", "binary"])
+def test_search_batch_matches_single_searches(index_path, quantization):
+    path, vectors = index_path
+    index = NumpyVectorIndex(path, quantization=quantization)
+    queries = vectors[:6] + 0.1
+    profiles = [PROFILES[i % 2] for i in range(6)]
+    limits = [4, 32, 4, 32, 4, 4]
+    batch = index.search_batch(queries, profiles, limits)
+    for query, profile, limit, (results, plan) in zip(queries, profiles, limits, batch):
+        single, single_plan = index.search(query, profile, limit)
+        assert ids(results) == ids(single)
+        assert plan == single_plan
+
+def test_exact_batch_matches_brute_force(index_path):
+    path, vectors = index_path
+    index = NumpyVectorIndex(path)
+    queries = vectors[10:14] * 3.0
+    for query, profile, (results, _) in zip(queries, PROFILES * 2, index.search_batch(queries, PROFILES * 2, [4] * 4)):
+        allowed = index.filter_mask(profile)
+        scores = np.where(allowed, vectors @ (query / np.linalg.norm(query)), -np.inf) if allowed is not None else vectors @ (query / np.linalg.norm(query))
+        assert ids(results) == np.argsort(-scores)[:4].tolist()
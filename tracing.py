@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import threading
+import itertools
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# --- CONFIGURATION ---
+# Aggregate per-stage metrics for every request. Developer Mode traces its own
+# requests regardless; with both off, span() is a single context-var lookup.
+TRACING_ENABLED: bool = os.getenv("SAFEMEDS_TRACING", "0") == "1"
+# When set, every finished trace is appended to this file as one JSON line.
+TRACE_LOG_PATH: Optional[str] = os.getenv("TRACE_LOG_PATH") or None
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TOKEN_ATTRIBUTES = ("prompt_tokens", "completion_tokens")
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("safemeds_trace", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("safemeds_span", default=None)
+_span_ids = itertools.count(1)
+
+class Metrics:
+    """Per-stage latency histograms and LLM token counters, exportable as Prometheus text."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, dict] = {}
+        self._tokens: Dict[tuple, int] = {}
+
+    def observe(self, name: str, duration_s: float, attributes: Dict[str, Any]) -> None:
+        with self._lock:
+            stage = self._stages.setdefault(name, {"count": 0, "sum": 0.0, "buckets": [0] * len(LATENCY_BUCKETS)})
+            stage["count"] += 1
+            stage["sum"] += duration_s
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if duration_s <= bound:
+                    stage["buckets"][i] += 1
+            for kind in TOKEN_ATTRIBUTES:
+                if attributes.get(kind):
+                    self._tokens[(name, kind)] = self._tokens.get((name, kind), 0) + int(attributes[kind])
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "stages": {name: {"count": s["count"], "sum_s": s["sum"], "mean_ms": 1000 * s["sum"] / s["count"]} for name, s in self._stages.items()},
+                "tokens": {f"{name}.{kind}": count for (name, kind), count in self._tokens.items()},
+            }
+
+    def prometheus_text(self) -> str:
+        lines = [
+            "# HELP safemeds_stage_duration_seconds Time spent per pipeline stage.",
+            "# TYPE safemeds_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for name, stage in sorted(self._stages.items()):
+                for bound, count in zip(LATENCY_BUCKETS, stage["buckets"]):
+                    lines.append(f'safemeds_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+                lines.append(f'safemeds_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {stage["count"]}')
+                lines.append(f'safemeds_stage_duration_seconds_sum{{stage="{name}"}} {stage["sum"]:.6f}')
+                lines.append(f'safemeds_stage_duration_seconds_count{{stage="{name}"}} {stage["count"]}')
+            lines += ["# HELP safemeds_llm_tokens_total LLM tokens per stage.", "# TYPE safemeds_llm_tokens_total counter"]
+            for (name, kind), count in sorted(self._tokens.items()):
+                lines.append(f'safemeds_llm_tokens_total{{stage="{name}",kind="{kind.split("_")[0]}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def dump_jsonl(self, path: str) -> None:
+        """Appends the current aggregates to `path` as one JSON line."""
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.snapshot()) + "\n")
+
+METRICS = Metrics()
+
+class Trace:
+    """Spans recorded for one request, with start offsets relative to the request start."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.wall_started = time.time()
+        self.duration_s: Optional[float] = None
+        self.spans: List[dict] = []
+
+    def add(self, name: str, start: float, duration_s: float, span_id: int, parent_id: Optional[int], attributes: Dict[str, Any]) -> None:
+        # list.append is atomic, so spans from the speculative worker can land concurrently.
+        self.spans.append({"name": name, "id": span_id, "parent": parent_id, "start_s": start - self.started, "duration_s": duration_s, **attributes})
+
+    def to_dict(self) -> dict:
+        return {"trace": self.name, "timestamp": self.wall_started, "duration_s": self.duration_s, "spans": sorted(self.spans, key=lambda s: s["start_s"])}
+
+class _Span:
+    __slots__ = ("name", "trace", "attributes", "id", "parent_id", "start", "_token")
+
+    def __init__(self, name: str, trace: Optional[Trace], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace = trace
+        self.attributes = attributes
+        self.id = next(_span_ids)
+        parent = _current_span.get()
+        self.parent_id = parent.id if parent is not None else None
+
+    def annotate(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> "_Span":
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        _finish(self.name, self.trace, self.start, duration, self.id, self.parent_id, self.attributes)
+        return False
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def annotate(self, **attributes) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+_NOOP = _NoopSpan()
+
+def _finish(name: str, trace: Optional[Trace], start: float, duration: float, span_id: int, parent_id: Optional[int], attributes: Dict[str, Any]) -> None:
+    if trace is not None:
+        trace.add(name, start, duration, span_id, parent_id, attributes)
+    METRICS.observe(name, duration, attributes)
+
+def span(name: str, **attributes):
+    """Times a stage. A no-op unless tracing is enabled or a trace is active in this context."""
+    trace = _current_trace.get()
+    if trace is None and not TRACING_ENABLED:
+        return _NOOP
+    return _Span(name, trace, attributes)
+
+def annotate(**attributes) -> None:
+    """Adds attributes (e.g. token counts) to the innermost open span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.annotate(**attributes)
+
+def record(name: str, start: float, **attributes) -> None:
+    """Records a span that ran from `start` (a perf_counter value) until now; for generators."""
+    trace = _current_trace.get()
+    if trace is None and not TRACING_ENABLED:
+        return
+    parent = _current_span.get()
+    _finish(name, trace, start, time.perf_counter() - start, next(_span_ids), parent.id if parent is not None else None, attributes)
+
+@contextmanager
+def trace(name: str, force: bool = False) -> Iterator[Optional[Trace]]:
+    """
+    Collects every span in this context (and in contexts copied from it) into a
+    Trace. Yields None, and records nothing, unless tracing is enabled or `force`.
+    """
+    if not (TRACING_ENABLED or force):
+        yield None
+        return
+    current = Trace(name)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        current.duration_s = time.perf_counter() - current.started
+        METRICS.observe(name, current.duration_s, {})
+        if TRACE_LOG_PATH:
+            with open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(current.to_dict(), default=str) + "\n")
+
+def waterfall(current: Trace, width: int = 32) -> str:
+    """Plain-text waterfall: one row per span, bars scaled to the whole request."""
+    spans = current.to_dict()["spans"]
+    total = max([current.duration_s or 0.0] + [s["start_s"] + s["duration_s"] for s in spans]) or 1e-9
+    known = {s["id"] for s in spans}
+    children: Dict[Optional[int], List[dict]] = {}
+    for s in spans:
+        children.setdefault(s["parent"] if s["parent"] in known else None, []).append(s)
+
+    # Depth-first in start order, so each stage's sub-spans sit right under it.
+    ordered: List[tuple] = []
+    stack = [(s, 0) for s in reversed(children.get(None, []))]
+    while stack:
+        s, depth = stack.pop()
+        ordered.append((s, depth))
+        stack.extend((child, depth + 1) for child in reversed(children.get(s["id"], [])))
+
+    rows = []
+    for s, depth in ordered:
+        offset = int(width * s["start_s"] / total)
+        length = max(1, int(width * s["duration_s"] / total))
+        bar = (" " * offset + "█" * length)[:width].ljust(width)
+        notes = ""
+        if s.get("prompt_tokens") is not None:
+            notes = f"  tokens {s['prompt_tokens']}→{s.get('completion_tokens', '?')}"
+        label = ("  " * depth + s["name"])[:22]
+        rows.append(f"{label:<22} {s['start_s'] * 1000:8.1f} {s['duration_s'] * 1000:8.1f} |{bar}|{notes}")
+    header = f"{'stage':<22} {'start ms':>8} {'dur ms':>8} |{'timeline'.center(width)}|"
+    return "\n".join([header] + rows + [f"{'total':<22} {'':>8} {total * 1000:8.1f}"])
@@ -0,0 +1,372 @@
+import os
+import json
+import time
+import uuid
+import threading
+import numpy as np
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import QueryResponse, ScoredPoint
+from filter_planner import OTC_VALUES
+from safety_tags import PREGNANCY_SAFE_CATEGORIES, drug_safety_mask, profile_mask
+
+# --- CONFIGURATION ---
+NUMPY_INDEX_PATH: str = "numpy_index"
+SCROLL_PAGE_SIZE: int = 1024
+# Rows scored per block; bounds the float32 temporary when the matrix is float16/int8.
+SCORE_BLOCK_ROWS: int = 4096
+QUANTIZATION_MODES: List[str] = ["int8", "binary"]
+# Quantized codes only shortlist candidates; limit * oversampling of them are
+# rescored against the full-precision (memory-mapped) vectors.
+DEFAULT_OVERSAMPLING: int = 4
+INT8_SCALE: float = 127.0
+# Read-only serving: the indexer publishes immutable versioned snapshots under
+# SNAPSHOT_ROOT and swaps the CURRENT pointer file; any number of processes
+# memory-map the current snapshot (sharing the page cache) and pick up a new one
+# within SNAPSHOT_CHECK_INTERVAL_S.
+SNAPSHOT_ROOT: str = os.getenv("SNAPSHOT_ROOT", "index_snapshots")
+SNAPSHOT_POINTER: str = "CURRENT"
+SNAPSHOTS_KEPT: int = 3
+SNAPSHOT_CHECK_INTERVAL_S: float = float(os.getenv("SNAPSHOT_CHECK_INTERVAL_S", "2"))
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+def quantize_int8(vectors: np.ndarray) -> np.ndarray:
+    # Unit vectors have every component in [-1, 1], so one fixed scale suffices.
+    return np.clip(np.rint(vectors * INT8_SCALE), -127, 127).astype(np.int8)
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    # One sign bit per dimension: 384 dims -> 48 bytes per vector.
+    return np.packbits(np.asarray(vectors) > 0, axis=-1)
+
+def write_numpy_index(
+    path: str,
+    ids: List[Any],
+    vectors: np.ndarray,
+    payloads: List[Dict[str, Any]],
+    dtype: str = "float32",
+) -> None:
+    """
+    Writes a NumPy search index:
+        vectors.npy          L2-normalized (rows x dim) matrix, float32 or float16
+        codes_int8.npy / codes_binary.npy   quantized copies for shortlist search
+        pregnancy_category.npy / rx_otc.npy / safety_mask.npy   columnar filter arrays
+        payloads.jsonl + payload_offsets.npy   full payloads, read only for top-k hits
+        ids.json             point ids in row order
+    """
+    os.makedirs(path, exist_ok=True)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    np.save(os.path.join(path, "vectors.npy"), vectors.astype(dtype))
+    np.save(os.path.join(path, "codes_int8.npy"), quantize_int8(vectors))
+    np.save(os.path.join(path, "codes_binary.npy"), quantize_binary(vectors))
+
+    np.save(os.path.join(path, "pregnancy_category.npy"), np.array([str(p.get("pregnancy_category", "N")) for p in payloads], dtype="U8"))
+    np.save(os.path.join(path, "rx_otc.npy"), np.array([str(p.get("rx_otc", "Rx")) for p in payloads], dtype="U8"))
+    np.save(os.path.join(path, "safety_mask.npy"), np.array([
+        p["safety_mask"] if "safety_mask" in p else drug_safety_mask(p.get("drug_name", ""), p.get("pregnancy_category", "N"))
+        for p in payloads
+    ], dtype=np.int64))
+
+    offsets = np.zeros(len(payloads) + 1, dtype=np.int64)
+    with open(os.path.join(path, "payloads.jsonl"), "wb") as f:
+        for row, payload in enumerate(payloads):
+            line = (json.dumps(payload) + "\n").encode("utf-8")
+            f.write(line)
+            offsets[row + 1] = offsets[row] + len(line)
+    np.save(os.path.join(path, "payload_offsets.npy"), offsets)
+
+    with open(os.path.join(path, "ids.json"), "w", encoding="utf-8") as f:
+        json.dump([str(point_id) if not isinstance(point_id, int) else point_id for point_id in ids], f)
+
+def read_collection(client: QdrantClient, collection_name: str) -> Tuple[List[Any], np.ndarray, List[Dict[str, Any]]]:
+    """Every point of a Qdrant collection as (ids, vectors, payloads)."""
+    ids: List[Any] = []
+    vectors: List[List[float]] = []
+    payloads: List[Dict[str, Any]] = []
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            limit=SCROLL_PAGE_SIZE,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        for record in records:
+            ids.append(record.id)
+            vectors.append(record.vector)
+            payloads.append(record.payload)
+        if offset is None:
+            break
+    return ids, np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1), payloads
+
+def export_from_qdrant(client: QdrantClient, collection_name: str, path: str = NUMPY_INDEX_PATH, dtype: str = "float32") -> int:
+    """Dumps every point of a Qdrant collection into a NumPy index. Returns the row count."""
+    ids, vectors, payloads = read_collection(client, collection_name)
+    write_numpy_index(path, ids, vectors, payloads, dtype=dtype)
+    return len(ids)
+
+def read_pointer(root: str = SNAPSHOT_ROOT) -> Optional[str]:
+    """Version named by the CURRENT pointer, or None if nothing was published yet."""
+    try:
+        with open(os.path.join(root, SNAPSHOT_POINTER), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def publish_snapshot(
+    ids: List[Any],
+    vectors: np.ndarray,
+    payloads: List[Dict[str, Any]],
+    root: str = SNAPSHOT_ROOT,
+    dtype: str = "float32",
+    keep: int = SNAPSHOTS_KEPT,
+) -> str:
+    """
+    Writes a new immutable snapshot and makes it current. Returns its version.
+
+    The snapshot is written to a hidden directory and renamed into place, then
+    CURRENT is replaced with os.replace, so readers only ever see a complete
+    snapshot and either the old or the new pointer. Published snapshots are
+    never modified; all but the newest `keep` are removed.
+    """
+    os.makedirs(root, exist_ok=True)
+    # UTC timestamp (to the microsecond) first, so versions sort in publish order.
+    now = time.time()
+    version = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(now))}.{int(now * 1e6) % 1000000:06d}-{uuid.uuid4().hex[:6]}"
+    staging = os.path.join(root, f".staging-{version}")
+    write_numpy_index(staging, ids, vectors, payloads, dtype=dtype)
+    os.rename(staging, os.path.join(root, version))
+
+    pointer_tmp = os.path.join(root, f".{SNAPSHOT_POINTER}-{version}")
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer_tmp, os.path.join(root, SNAPSHOT_POINTER))
+    prune_snapshots(root, keep)
+    return version
+
+def prune_snapshots(root: str = SNAPSHOT_ROOT, keep: int = SNAPSHOTS_KEPT) -> List[str]:
+    """
+    Removes all but the newest `keep` snapshots (never the current one). Workers
+    still mapping a removed snapshot keep working: open mappings outlive unlink.
+    """
+    current = read_pointer(root)
+    versions = sorted(name for name in os.listdir(root) if not name.startswith(".") and os.path.isdir(os.path.join(root, name)))
+    removed = [version for version in versions[:-keep] if version != current] if keep > 0 else []
+    for version in removed:
+        path = os.path.join(root, version)
+        for name in os.listdir(path):
+            os.remove(os.path.join(path, name))
+        os.rmdir(path)
+    return removed
+
+def publish_from_qdrant(client: QdrantClient, collection_name: str, root: str = SNAPSHOT_ROOT, dtype: str = "float32") -> Tuple[str, int]:
+    """Publishes the collection as a new snapshot. Returns (version, row count)."""
+    ids, vectors, payloads = read_collection(client, collection_name)
+    return publish_snapshot(ids, vectors, payloads, root=root, dtype=dtype), len(ids)
+
+def _top_k(scores: np.ndarray, allowed: Optional[np.ndarray], limit: int) -> Tuple[np.ndarray, np.ndarray]:
+    if allowed is not None:
+        scores = np.where(allowed, scores, -np.inf)
+    k = min(limit, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    rows = np.argpartition(-scores, k - 1)[:k]
+    rows = rows[np.argsort(-scores[rows])]
+    rows = rows[np.isfinite(scores[rows])]
+    return rows, scores[rows]
+
+class NumpyVectorIndex:
+    """
+    In-process exact cosine search over a memory-mapped matrix.
+
+    Top-k is one matrix product per block for a whole batch of queries, plus an
+    argpartition per query; patient constraints are boolean masks over the
+    columnar payload arrays. With
+    `quantization` set, only the int8 or binary codes are held in RAM and scanned,
+    and the shortlisted rows are rescored from the memory-mapped full vectors.
+    """
+
+    def __init__(self, path: str = NUMPY_INDEX_PATH, quantization: Optional[str] = None, oversampling: int = DEFAULT_OVERSAMPLING):
+        if quantization not in (None, *QUANTIZATION_MODES):
+            raise ValueError(f"❌ Unknown quantization '{quantization}', expected one of {QUANTIZATION_MODES}.")
+        self.path = path
+        self.quantization = quantization
+        self.oversampling = oversampling
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        # Memory-mapped like everything else, so worker processes share one copy in the page cache.
+        self.codes = np.load(os.path.join(path, f"codes_{quantization}.npy"), mmap_mode="r") if quantization else None
+        self.pregnancy_category = np.load(os.path.join(path, "pregnancy_category.npy"), mmap_mode="r")
+        self.rx_otc = np.load(os.path.join(path, "rx_otc.npy"), mmap_mode="r")
+        self.safety_mask = np.load(os.path.join(path, "safety_mask.npy"), mmap_mode="r")
+        self.payload_offsets = np.load(os.path.join(path, "payload_offsets.npy"), mmap_mode="r")
+        # Mapped rather than reopened per hit: a snapshot pruned while in use stays readable.
+        payloads_path = os.path.join(path, "payloads.jsonl")
+        self.payload_bytes = np.memmap(payloads_path, dtype=np.uint8, mode="r") if os.path.getsize(payloads_path) else np.empty(0, dtype=np.uint8)
+        with open(os.path.join(path, "ids.json"), "r", encoding="utf-8") as f:
+            self.ids = json.load(f)
+        self._rows: Optional[Dict[Any, int]] = None
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    def filter_mask(self, user_profile: dict) -> Optional[np.ndarray]:
+        """Boolean row mask equivalent to filter_planner's Qdrant filter (None = no filter)."""
+        allowed: Optional[np.ndarray] = None
+        if user_profile["pregnancy_risk"]:
+            allowed = np.isin(self.pregnancy_category, sorted(PREGNANCY_SAFE_CATEGORIES))
+        if not user_profile["prescription_only_ok"]:
+            otc = np.isin(self.rx_otc, OTC_VALUES)
+            allowed = otc if allowed is None else allowed & otc
+        patient_mask = profile_mask(user_profile)
+        if patient_mask:
+            safe = (self.safety_mask & np.int64(patient_mask)) == 0
+            allowed = safe if allowed is None else allowed & safe
+        return allowed
+
+    def _normalized(self, query_vectors) -> np.ndarray:
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.vectors.shape[1])
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        return queries / np.where(norms == 0, 1.0, norms)
+
+    def score_matrix(self, query_vectors) -> np.ndarray:
+        """Cosine scores, queries x rows: one matrix product per block for the whole batch."""
+        queries = self._normalized(query_vectors)
+        if self.vectors.dtype == np.float32:
+            return queries @ self.vectors.T
+        out = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), SCORE_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            out[:, start:start + SCORE_BLOCK_ROWS] = queries @ block.T
+        return out
+
+    def scores(self, query_vector) -> np.ndarray:
+        return self.score_matrix([query_vector])[0]
+
+    def approximate_score_matrix(self, query_vectors) -> np.ndarray:
+        """Scores from the quantized codes, queries x rows (higher is better, comparable within one query)."""
+        queries = self._normalized(query_vectors)
+        out = np.empty((len(queries), len(self)), dtype=np.float32)
+        if self.quantization == "binary":
+            query_codes = quantize_binary(queries)
+            for start in range(0, len(self), SCORE_BLOCK_ROWS):
+                # Each block of codes is read once for every query in the batch.
+                block = self.codes[start:start + SCORE_BLOCK_ROWS]
+                for i, query_code in enumerate(query_codes):
+                    out[i, start:start + SCORE_BLOCK_ROWS] = -POPCOUNT[block ^ query_code].sum(axis=1, dtype=np.int32)
+            return out
+        for start in range(0, len(self), SCORE_BLOCK_ROWS):
+            out[:, start:start + SCORE_BLOCK_ROWS] = queries @ self.codes[start:start + SCORE_BLOCK_ROWS].astype(np.float32).T
+        return out
+
+    def approximate_scores(self, query_vector) -> np.ndarray:
+        return self.approximate_score_matrix([query_vector])[0]
+
+    def memory_bytes(self) -> int:
+        """Bytes the scan has to keep resident: the codes when quantized, else the full matrix."""
+        return int(self.codes.nbytes if self.codes is not None else self.vectors.nbytes)
+
+    def payload(self, row: int) -> Dict[str, Any]:
+        return json.loads(self.payload_bytes[int(self.payload_offsets[row]):int(self.payload_offsets[row + 1])].tobytes())
+
+    def drug_names(self) -> Iterator[Tuple[Any, str]]:
+        """(point id, drug name) for every row; feeds AliasIndex.from_points."""
+        for row, point_id in enumerate(self.ids):
+            yield point_id, self.payload(row).get("drug_name", "")
+
+    def retrieve(self, point_ids: List[Any]) -> QueryResponse:
+        """Points by id, like alias_index.retrieve_points (score 1.0 = exact match)."""
+        if self._rows is None:
+            self._rows = {point_id: row for row, point_id in enumerate(self.ids)}
+        rows = [self._rows[point_id] for point_id in point_ids if point_id in self._rows]
+        return QueryResponse(points=[ScoredPoint(id=self.ids[row], version=0, score=1.0, payload=self.payload(row)) for row in rows])
+
+    def top_k_batch(self, query_vectors, allowed: List[Optional[np.ndarray]], limits: List[int]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """(rows, scores) per query; the scan over the index is shared by the whole batch."""
+        if self.quantization is None:
+            scores = self.score_matrix(query_vectors)
+            return [_top_k(scores[i], allowed[i], limit) for i, limit in enumerate(limits)]
+
+        approximate = self.approximate_score_matrix(query_vectors)
+        queries = self._normalized(query_vectors)
+        results = []
+        for i, limit in enumerate(limits):
+            candidates, _ = _top_k(approximate[i], allowed[i], limit * self.oversampling)
+            candidates = np.sort(candidates)
+            exact = np.asarray(self.vectors[candidates], dtype=np.float32) @ queries[i]
+            order = np.argsort(-exact)[:limit]
+            results.append((candidates[order], exact[order]))
+        return results
+
+    def top_k(self, query_vector, allowed: Optional[np.ndarray], limit: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.top_k_batch([query_vector], [allowed], [limit])[0]
+
+    def search_batch(self, query_vectors, user_profiles: List[dict], limits: List[int]) -> List[Tuple[QueryResponse, Dict[str, Any]]]:
+        """
+        Same (results, plan) contract as filter_planner.run_search_batch: all
+        queries are scored in one pass, and each distinct profile's mask is built once.
+        """
+        masks: Dict[tuple, Optional[np.ndarray]] = {}
+        allowed = []
+        for user_profile in user_profiles:
+            key = (user_profile["pregnancy_risk"], user_profile["prescription_only_ok"], tuple(sorted(user_profile.get("conditions", ()))))
+            if key not in masks:
+                masks[key] = self.filter_mask(user_profile)
+            allowed.append(masks[key])
+
+        strategy = f"numpy mask ({self.quantization} + rescore)" if self.quantization else "numpy mask"
+        results = []
+        for (rows, scores), mask, limit in zip(self.top_k_batch(query_vectors, allowed, limits), allowed, limits):
+            points = [
+                ScoredPoint(id=self.ids[row], version=0, score=float(score), payload=self.payload(int(row)))
+                for row, score in zip(rows, scores)
+            ]
+            selectivity = 1.0 if mask is None else float(mask.mean()) if len(mask) else 0.0
+            plan = {"strategy": strategy, "filter": None, "fetch_limit": limit, "selectivity": selectivity}
+            results.append((QueryResponse(points=points), plan))
+        return results
+
+    def search(self, query_vector, user_profile: dict, limit: int = 4) -> Tuple[QueryResponse, Dict[str, Any]]:
+        """Same (results, plan) contract as filter_planner.run_search."""
+        return self.search_batch([query_vector], [user_profile], [limit])[0]
+
+class SnapshotIndex:
+    """
+    Read-only view of the current published snapshot, for multi-process serving.
+
+    current() returns the NumpyVectorIndex of the snapshot CURRENT points at.
+    At most every `check_interval_s` it re-reads the pointer; when it changed, one
+    caller maps the new snapshot while the others keep serving the old one, and
+    the reference is then swapped in a single assignment. Callers should take
+    current() once per request so a request never mixes two snapshots.
+    """
+
+    def __init__(self, root: str = SNAPSHOT_ROOT, quantization: Optional[str] = None, check_interval_s: float = SNAPSHOT_CHECK_INTERVAL_S):
+        self.root = root
+        self.quantization = quantization
+        self.check_interval_s = check_interval_s
+        self.swaps = 0
+        self._lock = threading.Lock()
+        self._checked_at = time.monotonic()
+        version = read_pointer(root)
+        if version is None:
+            raise FileNotFoundError(f"❌ No snapshot published under '{root}'. Run: python indexer.py --publish-snapshot")
+        self.version = version
+        self._index = NumpyVectorIndex(os.path.join(root, version), quantization=quantization)
+
+    def current(self) -> NumpyVectorIndex:
+        if time.monotonic() - self._checked_at >= self.check_interval_s and self._lock.acquire(blocking=False):
+            try:
+                self._checked_at = time.monotonic()
+                version = read_pointer(self.root)
+                if version and version != self.version:
+                    index = NumpyVectorIndex(os.path.join(self.root, version), quantization=self.quantization)
+                    self._index, self.version = index, version
+                    self.swaps += 1
+                    print(f"--- 🔄 Switched to index snapshot {version} ({len(index)} vectors) ---")
+            finally:
+                self._lock.release()
+        return self._index